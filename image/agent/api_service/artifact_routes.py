@@ -0,0 +1,53 @@
+"""
+API routes serving content-addressed artifacts (screenshots referenced by id in streams).
+"""
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Artifacts never change once written, so clients and proxies may cache them forever
+IMMUTABLE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    return request.headers.get("if-none-match") == etag
+
+
+@router.get("/artifacts/{artifact_id}")
+async def get_artifact(artifact_id: str, request: Request):
+    """The stored bytes of an artifact."""
+    from ..artifacts import artifact_store
+    
+    found = artifact_store.find(artifact_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    etag = f'"{artifact_id}"'
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={**IMMUTABLE_HEADERS, "ETag": etag})
+    path, media_type = found
+    return FileResponse(path, media_type=media_type, headers={**IMMUTABLE_HEADERS, "ETag": etag})
+
+
+@router.get("/artifacts/{artifact_id}/thumbnail")
+async def get_artifact_thumbnail(artifact_id: str, request: Request, width: int = 320):
+    """A PNG thumbnail of an image artifact for timelines."""
+    from ..artifacts import THUMBNAIL_WIDTHS, artifact_store
+    
+    if width not in THUMBNAIL_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"width must be one of {', '.join(map(str, THUMBNAIL_WIDTHS))}")
+    etag = f'"{artifact_id}-{width}"'
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={**IMMUTABLE_HEADERS, "ETag": etag})
+    try:
+        path = await artifact_store.thumbnail(artifact_id, width)
+    except Exception as e:
+        logger.error(f"Error rendering thumbnail for {artifact_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not path:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return FileResponse(path, media_type="image/png", headers={**IMMUTABLE_HEADERS, "ETag": etag})
@@ -0,0 +1,98 @@
+"""
+API routes for runtime diagnostics.
+"""
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from typing import Dict, Any, Optional
+import asyncio
+import json
+import logging
+import os
+import secrets
+import threading
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+def require_debug_token(
+    x_debug_token: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+):
+    """Allow the request only with the TILT_DEBUG_TOKEN, sent as X-Debug-Token or a bearer token."""
+    expected = os.getenv('TILT_DEBUG_TOKEN')
+    if not expected:
+        raise HTTPException(status_code=403, detail="Debug endpoints are disabled; set TILT_DEBUG_TOKEN to enable them")
+    supplied = x_debug_token
+    if not supplied and authorization and authorization.lower().startswith("bearer "):
+        supplied = authorization[7:]
+    if not supplied or not secrets.compare_digest(supplied, expected):
+        raise HTTPException(status_code=401, detail="Invalid debug token")
+
+@router.get("/debug/blocking", dependencies=[Depends(require_debug_token)])
+async def get_blocking_report() -> Dict[str, Any]:
+    """Event-loop stalls caught by the watchdog, with the stacks that caused them."""
+    from ..watchdog import loop_watchdog
+    
+    return {
+        "status": "success",
+        "data": loop_watchdog.report()
+    }
+
+@router.delete("/debug/blocking", dependencies=[Depends(require_debug_token)])
+async def clear_blocking_report() -> Dict[str, Any]:
+    """Forget recorded stalls, e.g. before a CI run."""
+    from ..watchdog import loop_watchdog
+    
+    loop_watchdog.clear()
+    return {
+        "status": "success",
+        "message": "Blocking report cleared"
+    }
+
+@router.post("/debug/profile", dependencies=[Depends(require_debug_token)])
+async def capture_profile(
+    seconds: float = 10,
+    interval_ms: float = 10,
+    run_id: Optional[str] = None,
+    format: str = "speedscope",
+):
+    """
+    Sample every thread of the API process for `seconds` and return a speedscope JSON
+    (format=speedscope) or a pstats file (format=pstats). `run_id` keeps only event-loop
+    samples taken while that run's tasks were executing.
+    """
+    from ..profiler import MAX_DURATION_SECONDS, profiler
+    
+    if format not in ("speedscope", "pstats"):
+        raise HTTPException(status_code=400, detail="format must be 'speedscope' or 'pstats'")
+    if not 0 < seconds <= MAX_DURATION_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {MAX_DURATION_SECONDS}")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    if profiler.busy:
+        raise HTTPException(status_code=409, detail="A profile capture is already running")
+    
+    loop = asyncio.get_running_loop()
+    loop_thread_id = threading.get_ident()
+    try:
+        profile = await asyncio.to_thread(
+            profiler.capture, seconds, interval_ms / 1000, run_id, loop, loop_thread_id
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    logger.info(f"Captured {profile.sample_count} samples over {profile.duration:.1f}s (run: {run_id or 'all'})")
+    filename = f"profile-{run_id or 'all'}-{int(profile.started_at)}"
+    if format == "pstats":
+        return Response(
+            content=profile.to_pstats(),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.pstats"'},
+        )
+    return Response(
+        content=json.dumps(profile.to_speedscope()),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.speedscope.json"'},
+    )
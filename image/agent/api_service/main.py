@@ -1,10 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from .routes import router
 from .timing_routes import router as timing_router
+from .debug_routes import router as debug_router
+from .artifact_routes import router as artifact_router
 import uvicorn
 import logging
+import os
 import sys
+import time
 
 app = FastAPI(
     title="Computer Use API",
@@ -23,6 +27,121 @@ app.add_middleware(
 
 app.include_router(router, prefix="/api/v1")
 app.include_router(timing_router, prefix="/api/v1")
+app.include_router(debug_router, prefix="/api/v1")
+app.include_router(artifact_router, prefix="/api/v1")
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and time them until the response starts (streams are not waited on)."""
+    from .. import metrics
+
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so ids in the path don't explode cardinality
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        metrics.HTTP_REQUESTS.labels(method=request.method, route=path, status=str(status)).inc()
+        metrics.HTTP_REQUEST_DURATION.labels(method=request.method, route=path).observe(time.perf_counter() - started)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    from ..metrics import render_latest
+
+    body, content_type = render_latest()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+
+@app.on_event("startup")
+async def start_interrupt_watcher():
+    """Deliver interrupts written by other processes via a MongoDB change stream."""
+    from ..interrupts import interrupt_hub
+
+    interrupt_hub.watch_mongodb()
+
+
+@app.on_event("startup")
+async def start_notification_watcher():
+    """Relay interrupt deliveries and task status changes made by other processes."""
+    from ..notifications import notification_hub
+
+    notification_hub.watch_mongodb()
+
+
+@app.on_event("startup")
+async def start_settings_watcher():
+    """Drop cached settings when another process changes them."""
+    from ..settings import settings_service
+
+    settings_service.watch_mongodb()
+
+
+@app.on_event("startup")
+async def ensure_mongodb_indexes():
+    """Create the indexes behind task listing in the background, so startup never waits on MongoDB."""
+    import asyncio
+    from .. import db
+
+    async def create():
+        try:
+            await db.ensure_task_indexes()
+        except Exception as e:
+            logger.warning(f"Could not create task indexes: {e}")
+
+    asyncio.create_task(create())
+
+
+@app.on_event("shutdown")
+async def flush_settings():
+    """Write panel preferences still waiting in the write-behind buffer."""
+    from ..settings import settings_service
+
+    await settings_service.close()
+
+
+@app.on_event("shutdown")
+async def close_mongodb_client():
+    from .. import db
+
+    db.close_client()
+
+
+@app.on_event("shutdown")
+async def close_tool_sessions():
+    from ..tool_sessions import tool_session_registry
+
+    await tool_session_registry.close_all()
+
+
+@app.on_event("shutdown")
+async def stop_display_pool():
+    from ..displays import display_pool
+
+    await display_pool.shutdown()
+
+
+@app.on_event("startup")
+async def start_loop_watchdog():
+    """Measure event-loop lag and capture stacks of blocking calls (TILT_LOOP_WATCHDOG=0 disables)."""
+    if os.getenv('TILT_LOOP_WATCHDOG', '1') == '0':
+        return
+    from ..watchdog import loop_watchdog
+
+    loop_watchdog.start()
+
+
+@app.on_event("shutdown")
+async def stop_loop_watchdog():
+    from ..watchdog import loop_watchdog
+
+    loop_watchdog.stop()
 
 # Configure logging
 import os
@@ -45,5 +164,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=False,
-        log_level="info"
+        log_level="info",
+        # Negotiates permessage-deflate for /chat/ws; set TILT_WS_DEFLATE=0 to turn it off
+        ws_per_message_deflate=os.getenv('TILT_WS_DEFLATE', '1') != '0',
     )
\ No newline at end of file
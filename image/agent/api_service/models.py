@@ -15,6 +15,15 @@ class ChatRequest(BaseModel):
     thinking_budget: Optional[int] = None
     token_efficient_tools_beta: bool = False
     test_id: Optional[str] = None
+    # Labels used to group this run's telemetry rollups
+    tags: Optional[List[str]] = None
+    # When set, run each instruction step as its own bounded sub-conversation
+    steps: Optional[List[str]] = None
+    # Send screenshots as artifact ids served by /artifacts instead of inline base64;
+    # messages may then reference images as {"source": {"type": "artifact", ...}}
+    image_refs: bool = False
+    # Keep the history server-side: send only the new turn and get only new messages in `done`
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     messages: List[ChatMessage]
@@ -24,6 +33,8 @@ class ToolExecuteRequest(BaseModel):
     tool_name: str
     tool_input: Dict[str, Any]
     tool_version: ToolVersion = "computer_use_20241022"
+    # Reuse the same tool instances (bash shell, network capture, connections) across calls
+    session_id: Optional[str] = None
 
 class ToolExecuteResponse(BaseModel):
     result: Dict[str, Any]
@@ -1,17 +1,89 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from .models import *
-from ..loop import sampling_loop, APIProvider
-from ..tools import ToolCollection, ToolResult, TOOL_GROUPS_BY_VERSION
+from .. import db, metrics
+from ..displays import display_pool
+from ..outbound import KEEPALIVE_SECONDS, OutboundBuffer
+from ..notifications import notification_hub
+from ..settings import settings_service
+from ..loop import sampling_events, APIProvider, Done, LoopEvent, TextDelta, ToolResultEvent, ToolUse, Usage
+from ..routing import ModelRouter
+from ..steps import SegmentedEvent, StepFinished, StepStarted, StepsDone, run_segmented_steps
+from ..telemetry import record_run
+from ..timing_utils import run_timing
+from ..tracing import span, tracer
 import asyncio
+import base64
 import json
+import logging
 import os
-from typing import Dict
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional
+from pydantic import ValidationError
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def _event_to_sse_data(event: LoopEvent | SegmentedEvent) -> Optional[Dict[str, Any]]:
+    """Convert a sampling loop event into the JSON payload sent to the frontend."""
+    if isinstance(event, TextDelta):
+        if event.echo:
+            return {"type": "message", "role": "assistant", "content": event.text, "echo": True}
+        return {"type": "message", "role": "assistant", "content": event.text}
+    if isinstance(event, ToolUse):
+        return {"type": "tool_use", "tool_name": event.name, "tool_input": event.input}
+    if isinstance(event, ToolResultEvent):
+        return {
+            "type": "tool_result",
+            "tool_id": event.tool_use_id,
+            "tool_name": event.tool_name,
+            "output": event.result.output,
+            "error": event.result.error,
+            "base64_image": event.result.base64_image
+        }
+    if isinstance(event, Usage):
+        return {
+            "type": "usage",
+            "model": event.model,
+            "input_tokens": event.input_tokens,
+            "output_tokens": event.output_tokens,
+            "cache_creation_input_tokens": event.cache_creation_input_tokens,
+            "cache_read_input_tokens": event.cache_read_input_tokens,
+            "tier": event.tier,
+            "latency": event.latency
+        }
+    if isinstance(event, Done):
+        return {"type": "done", "messages": event.messages}
+    if isinstance(event, StepStarted):
+        return {"type": "step_start", "index": event.index, "instruction": event.instruction}
+    if isinstance(event, StepFinished):
+        return {"type": "step_result", **event.result.to_dict()}
+    if isinstance(event, StepsDone):
+        return {
+            "type": "done",
+            "messages": event.messages,
+            "steps": [result.to_dict() for result in event.results],
+            "passed": event.passed
+        }
+    return None
+
+
+async def _externalize_event_images(event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Swap the base64 images in an SSE payload for artifact ids (ChatRequest.image_refs)."""
+    from ..artifacts import artifact_store, artifact_url
+    
+    if event_data.get("base64_image"):
+        image_id = await asyncio.to_thread(artifact_store.put_base64, event_data["base64_image"])
+        event_data.update(base64_image=None, image_id=image_id, image_url=artifact_url(image_id))
+    if event_data.get("messages"):
+        event_data["messages"] = await asyncio.to_thread(artifact_store.externalize_messages, event_data["messages"])
+    return event_data
+
+
 @router.options("/chat/stream")
 async def chat_stream_options():
     return {
@@ -21,187 +93,245 @@ async def chat_stream_options():
         "Access-Control-Allow-Methods": "POST, OPTIONS",
     }
 
-@router.post("/chat/stream")
-async def chat_completion_stream(request: ChatRequest):
-    async def event_stream():
-        try:
-            # Get API key from MongoDB
-            from ..utils import get_api_key_from_mongodb, validate_api_key
-            
-            api_key = get_api_key_from_mongodb()
-            if not api_key:
-                raise ValueError("No API key found in MongoDB database - please store your Anthropic API key in the 'settings' collection with key 'anthropic_key'")
-            
-            if not validate_api_key(api_key):
-                raise ValueError("Invalid API key format found in MongoDB")
-            
-            # Get model and provider from environment, with defaults
-            model = os.getenv('ANTHROPIC_MODEL', 'claude-sonnet-4-20250514')
-            provider_str = os.getenv('API_PROVIDER', 'anthropic')
-            
-            print(f"Starting new stream request with {len(request.messages)} messages")
-            print(f"Last message: {request.messages[-1] if request.messages else 'None'}")
-            print(f"Model: {model}, Provider: {provider_str}")
-            print(f"API key present: {'Yes' if api_key else 'No'}")
-            print(f"All messages: {[f'Role: {msg.role}, Content preview: {str(msg.content)[:100]}...' for msg in request.messages]}")
-            # Convert request to format expected by sampling_loop
-            provider = APIProvider(provider_str)
-            
-            # Storage for tool results
-            tool_state: Dict[str, ToolResult] = {}
-            # Track tool names by tool_id for frontend processing
-            tool_names: Dict[str, str] = {}
-            
-            # Use a queue to handle streaming
-            message_queue = asyncio.Queue()
-            
-            def sync_output_callback(content):
-                """Handle assistant output - add to queue"""
-                if isinstance(content, dict):
-                    if content.get("type") == "text":
-                        event_data = {
-                            "type": "message",
-                            "role": "assistant",
-                            "content": content["text"]
-                        }
-                        message_queue.put_nowait(f"data: {json.dumps(event_data)}\n\n")
-                    elif content.get("type") == "tool_use":
-                        # Track tool name for later use in tool_result callback
-                        tool_names[content["id"]] = content["name"]
-                        event_data = {
-                            "type": "tool_use",
-                            "tool_name": content["name"],
-                            "tool_input": content["input"]
-                        }
-                        message_queue.put_nowait(f"data: {json.dumps(event_data)}\n\n")
-            
-            def sync_tool_output_callback(tool_output: ToolResult, tool_id: str):
-                """Handle tool output - add to queue"""
-                tool_state[tool_id] = tool_output
-                event_data = {
-                    "type": "tool_result",
-                    "tool_id": tool_id,
-                    "tool_name": tool_names.get(tool_id, "unknown"),  # Include tool name
-                    "output": tool_output.output,
-                    "error": tool_output.error,
-                    "base64_image": tool_output.base64_image
-                }
-                message_queue.put_nowait(f"data: {json.dumps(event_data)}\n\n")
-            
-            def api_response_callback(
-                request,
-                response,
-                error
-            ):
-                """Handle API response - just store for debugging"""
-                pass
-            
-            # Yield initial status
-            yield f"data: {json.dumps({'type': 'status', 'message': 'Starting...'})}\n\n"
-            
-            # Start the sampling loop in a background task
-            async def run_sampling_loop():
-                try:
-                    print("Starting sampling_loop execution")
-                    
-                    result_messages = await sampling_loop(
-                        system_prompt_suffix=request.system_prompt_suffix or "",
-                        model=model,
-                        provider=provider,
-                        messages=[msg.model_dump() for msg in request.messages],
-                        output_callback=sync_output_callback,
-                        tool_output_callback=sync_tool_output_callback,
-                        api_response_callback=api_response_callback,
-                        api_key=api_key,
-                        only_n_most_recent_images=request.only_n_most_recent_images,
-                        tool_version=request.tool_version,
-                        max_tokens=request.max_tokens,
-                        thinking_budget=request.thinking_budget,
-                        token_efficient_tools_beta=request.token_efficient_tools_beta,
-                    )
-                    print(f"Sampling loop completed with {len(result_messages)} messages")
-                    if len(result_messages) <= len(request.messages):
-                        print("WARNING: No new messages generated by AI!")
-                        print(f"Input messages: {len(request.messages)}, Output messages: {len(result_messages)}")
-                    else:
-                        print(f"AI generated {len(result_messages) - len(request.messages)} new messages")
-                    
-                    # Add a small delay to ensure all tool results are processed by frontend
-                    print("Waiting briefly for frontend to process final tool results...")
-                    await asyncio.sleep(0.5)
-                    
-                    # Signal completion
-                    await message_queue.put(f"data: {json.dumps({'type': 'done', 'messages': [msg for msg in result_messages]})}\n\n")
-                except Exception as e:
-                    print(f"Error in sampling_loop: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    # Send error details to frontend
-                    error_details = f"Sampling loop error: {str(e)}"
-                    print(f"Full error details: {error_details}")
-                    await message_queue.put(f"data: {json.dumps({'type': 'error', 'message': error_details})}\n\n")
-                finally:
-                    # Always signal end of stream, regardless of success or failure
-                    print("Signaling end of stream")
-                    await message_queue.put(None)
+
+async def _chat_events(request: ChatRequest, interrupt_key: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run a chat request and yield its events as payload dicts, with a keepalive whenever
+    the run is quiet. Shared by the SSE and WebSocket transports.
+    """
+    interrupt_key = interrupt_key or request.test_id
+    try:
+        # Get API key from MongoDB
+        from ..utils import get_api_key_from_mongodb, validate_api_key
+        
+        api_key = await get_api_key_from_mongodb()
+        if not api_key:
+            raise ValueError("No API key found in MongoDB database - please store your Anthropic API key in the 'settings' collection with key 'anthropic_key'")
+        
+        if not validate_api_key(api_key):
+            raise ValueError("Invalid API key format found in MongoDB")
+        
+        # Model and provider come from the environment, read once at startup
+        model = settings_service.model_settings.model
+        provider_str = settings_service.model_settings.provider
+        
+        print(f"Starting new stream request with {len(request.messages)} messages")
+        print(f"Last message: {request.messages[-1] if request.messages else 'None'}")
+        print(f"Model: {model}, Provider: {provider_str}")
+        print(f"API key present: {'Yes' if api_key else 'No'}")
+        print(f"All messages: {[f'Role: {msg.role}, Content preview: {str(msg.content)[:100]}...' for msg in request.messages]}")
+        # Convert request to format expected by sampling_loop
+        provider = APIProvider(provider_str)
+        # Route trivial turns to ANTHROPIC_FAST_MODEL when it is configured
+        model_router = ModelRouter.from_env(model)
+        
+        run_id = uuid.uuid4().hex
+        
+        messages = [msg.model_dump() for msg in request.messages]
+        if request.image_refs:
+            from ..artifacts import MissingArtifactError, artifact_store
             
-            # Start the sampling loop
-            loop_task = asyncio.create_task(run_sampling_loop())
+            # Images the client sent back by reference go to the model as base64
+            try:
+                messages = await asyncio.to_thread(artifact_store.resolve_messages, messages)
+            except MissingArtifactError as e:
+                raise ValueError(
+                    f"Image {e.artifact_id} is no longer stored on the server; "
+                    "resend the conversation with base64 images (image_refs=false)"
+                ) from None
+        
+        session = None
+        base_count = 0
+        if request.session_id:
+            from ..sessions import session_store
             
+            if request.steps:
+                raise ValueError("session_id is not supported with steps")
+            session = session_store.get_or_create(request.session_id)
+        
+        # Bounded and coalescing, so a slow client neither grows memory nor stalls the run for long
+        outbound = OutboundBuffer()
+        metrics.track_sse_queue(outbound)
+        
+        # Yield initial status
+        status = {'type': 'status', 'message': 'Starting...'}
+        if session:
+            status['session_id'] = session.session_id
+        yield status
+        
+        # Pull events from the sampling loop in a background task
+        async def run_sampling_loop():
+            nonlocal messages, base_count
+            # One correlation id per run; spans, trace files and timing data are keyed by it
             try:
-                # Stream messages from the queue
-                while True:
+                with run_timing(run_id, test_id=request.test_id), \
+                        span("run", "run", trace_id=run_id, test_id=request.test_id, steps=len(request.steps or [])):
                     try:
-                        message = await asyncio.wait_for(message_queue.get(), timeout=1.0)
-                        if message is None:  # End of stream signal
-                            break
-                        yield message
-                    except asyncio.TimeoutError:
-                        # Send keepalive and check if loop task is still running
-                        if not loop_task.done():
-                            yield f"data: {json.dumps({'type': 'keepalive'})}\n\n"
-                        else:
-                            # Loop task finished, check for any remaining messages
-                            try:
-                                message = message_queue.get_nowait()
-                                if message is None:
-                                    break
-                                yield message
-                            except asyncio.QueueEmpty:
-                                break
-                        continue
-                    except Exception as e:
-                        print(f"Error in message queue processing: {e}")
-                        break
+                        # Runs on its own desktop when a display pool is configured
+                        async with display_pool.lease(f"stream:{run_id}"):
+                            print("Starting sampling_loop execution")
+                            notification_hub.publish_status(interrupt_key, "running", run_id=run_id)
+                            if session:
+                                # The client sent only its new turn; prepend the stored history
+                                history = await asyncio.to_thread(session_store.history, session)
+                                base_count = len(history)
+                                messages = history + messages
                 
-                # Ensure the sampling loop task is complete
-                if not loop_task.done():
-                    await loop_task
-            except GeneratorExit:
-                # Client disconnected
-                print("Client disconnected during stream")
-                if not loop_task.done():
-                    loop_task.cancel()
-                    try:
-                        await loop_task
-                    except asyncio.CancelledError:
-                        pass
-                raise
-            except Exception as e:
-                print(f"Error in streaming loop: {e}")
-                # Cancel the loop task if still running
-                if not loop_task.done():
-                    loop_task.cancel()
-                    try:
-                        await loop_task
+                            if request.steps:
+                                events = run_segmented_steps(
+                                    instructions=request.steps,
+                                    system_prompt_suffix=request.system_prompt_suffix or "",
+                                    model=model,
+                                    provider=provider,
+                                    api_key=api_key,
+                                    only_n_most_recent_images=request.only_n_most_recent_images,
+                                    tool_version=request.tool_version,
+                                    max_tokens=request.max_tokens,
+                                    thinking_budget=request.thinking_budget,
+                                    token_efficient_tools_beta=request.token_efficient_tools_beta,
+                                    interrupt_key=interrupt_key,
+                                    router=model_router,
+                                )
+                            else:
+                                events = sampling_events(
+                                    system_prompt_suffix=request.system_prompt_suffix or "",
+                                    model=model,
+                                    provider=provider,
+                                    messages=messages,
+                                    api_key=api_key,
+                                    only_n_most_recent_images=request.only_n_most_recent_images,
+                                    tool_version=request.tool_version,
+                                    max_tokens=request.max_tokens,
+                                    thinking_budget=request.thinking_budget,
+                                    token_efficient_tools_beta=request.token_efficient_tools_beta,
+                                    interrupt_key=interrupt_key,
+                                    router=model_router,
+                                )
+                
+                            async for event in events:
+                                if isinstance(event, (Done, StepsDone)):
+                                    result_messages = event.messages
+                                    print(f"Sampling loop completed with {len(result_messages)} messages")
+                                    if len(result_messages) <= len(messages):
+                                        print("WARNING: No new messages generated by AI!")
+                        
+                                    # Add a small delay to ensure all tool results are processed by frontend
+                                    await asyncio.sleep(0.5)
+                    
+                                event_data = _event_to_sse_data(event)
+                                if event_data is not None and event_data["type"] == "done":
+                                    event_data["run_id"] = run_id
+                                    if model_router:
+                                        event_data["routing"] = model_router.stats()
+                                        logger.info(f"Model routing: {json.dumps(event_data['routing'])}")
+                                    if session:
+                                        await asyncio.to_thread(session_store.commit, session, event.messages)
+                                        # Only what this run added; the rest is already on the client
+                                        event_data.update(
+                                            messages=event.messages[base_count:],
+                                            session_id=session.session_id,
+                                            message_count=session.message_count,
+                                        )
+                                if event_data is not None:
+                                    if request.image_refs:
+                                        event_data = await _externalize_event_images(event_data)
+                                    await outbound.put(event_data)
+                        notification_hub.publish_status(interrupt_key, "completed", run_id=run_id)
                     except asyncio.CancelledError:
-                        pass
-                # Send error message before terminating
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                        notification_hub.publish_status(interrupt_key, "stopped", run_id=run_id)
+                        raise
+                    except Exception as e:
+                        print(f"Error in sampling_loop: {e}")
+                        import traceback
+                        traceback.print_exc()
+                        notification_hub.publish_status(interrupt_key, "error", run_id=run_id, message=str(e))
+                        # Send error details to frontend
+                        error_details = f"Sampling loop error: {str(e)}"
+                        await outbound.put({'type': 'error', 'message': error_details})
+                    finally:
+                        # Always signal end of stream, regardless of success or failure
+                        print("Signaling end of stream")
+                        outbound.close()
+            finally:
+                # Export once the run span has closed, even if the stream was cancelled
+                await asyncio.to_thread(tracer.write_run, run_id)
+                record_run(run_id, test_id=request.test_id, tags=request.tags)
+        
+        if session:
+            # One run per session at a time; acquiring a free lock does not suspend
+            if session.lock.locked():
+                raise ValueError(f"Session {session.session_id} is busy with another run")
+            await session.lock.acquire()
+        
+        # Start the sampling loop
+        # Task names carry the run id so profiles can be filtered to this run
+        loop_task = asyncio.create_task(run_sampling_loop(), name=f"run:{run_id}")
+        if session:
+            # Released even if the task is cancelled before it starts
+            loop_task.add_done_callback(lambda _: session.lock.release())
+        current_task = asyncio.current_task()
+        if current_task:
+            current_task.set_name(f"stream:{run_id}")
+        
+        try:
+            # Stream events from the buffer, with a keepalive whenever it sits idle
+            while True:
+                try:
+                    event_data = await outbound.get(timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield {'type': 'keepalive'}
+                    continue
+                except Exception as e:
+                    print(f"Error in message queue processing: {e}")
+                    break
+                if event_data is None:  # End of stream signal
+                    break
+                yield event_data
+            if outbound.coalesced or outbound.dropped:
+                logger.info(f"Stream {run_id}: {outbound.coalesced} events coalesced, {outbound.dropped} dropped")
             
+            # Ensure the sampling loop task is complete
+            if not loop_task.done():
+                await loop_task
+        except (GeneratorExit, asyncio.CancelledError):
+            # Client disconnected or stopped the run
+            print("Stream closed by the client")
+            if not loop_task.done():
+                loop_task.cancel()
+                try:
+                    await loop_task
+                except asyncio.CancelledError:
+                    pass
+            raise
         except Exception as e:
-            print(f"Top-level stream error: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            print(f"Error in streaming loop: {e}")
+            # Cancel the loop task if still running
+            if not loop_task.done():
+                loop_task.cancel()
+                try:
+                    await loop_task
+                except asyncio.CancelledError:
+                    pass
+            # Send error message before terminating
+            yield {'type': 'error', 'message': str(e)}
+        
+    except Exception as e:
+        print(f"Top-level stream error: {e}")
+        yield {'type': 'error', 'message': str(e)}
+
+
+@router.post("/chat/stream")
+async def chat_completion_stream(request: ChatRequest):
+    async def event_stream():
+        metrics.SSE_CLIENTS.inc()
+        events = _chat_events(request)
+        try:
+            async for event_data in events:
+                yield f"data: {json.dumps(event_data)}\n\n"
+        finally:
+            # Closing the run's generator cancels the run when the client goes away
+            await events.aclose()
+            metrics.SSE_CLIENTS.dec()
     
     print("Creating StreamingResponse...")
     return StreamingResponse(
@@ -217,18 +347,146 @@ async def chat_completion_stream(request: ChatRequest):
         }
     )
 
+def _log_run_failure(task: asyncio.Task):
+    """Log a failed WebSocket run, e.g. a send to a closed socket, instead of losing it with the task"""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"WebSocket run {task.get_name()} failed", exc_info=task.exception())
+
+
+@router.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Chat over a WebSocket. Send {"type": "start", ...ChatRequest fields} to begin a run
+    and receive the same events as /chat/stream as JSON text frames. A screenshot is
+    announced by an event with `image_frame: true` and its PNG bytes follow in the next
+    binary frame. While a run is going, {"type": "interrupt", "message": ...} queues a
+    message for the agent and {"type": "stop"} cancels the run.
+    """
+    from ..interrupts import Interrupt, interrupt_hub
+
+    await websocket.accept()
+    metrics.WS_CLIENTS.inc()
+    # Keeps an image event and its binary frame together
+    send_lock = asyncio.Lock()
+    run_task: Optional[asyncio.Task] = None
+    interrupt_key: Optional[str] = None
+
+    async def send_event(event_data: Dict[str, Any]):
+        image = event_data.get("base64_image")
+        async with send_lock:
+            if image:
+                image_bytes = base64.b64decode(image)
+                event_data = {**event_data, "base64_image": None, "image_frame": True, "image_bytes": len(image_bytes)}
+                await websocket.send_text(json.dumps(event_data))
+                await websocket.send_bytes(image_bytes)
+            else:
+                await websocket.send_text(json.dumps(event_data))
+
+    async def run(chat_request: ChatRequest, key: str):
+        events = _chat_events(chat_request, interrupt_key=key)
+        try:
+            async for event_data in events:
+                await send_event(event_data)
+        finally:
+            await events.aclose()
+
+    async def stop_run():
+        if run_task and not run_task.done():
+            run_task.cancel()
+            try:
+                await run_task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                # Already logged by _log_run_failure
+                pass
+
+    try:
+        while True:
+            command = await websocket.receive_json()
+            command_type = command.get("type")
+
+            if command_type == "start":
+                if run_task and not run_task.done():
+                    await send_event({"type": "error", "message": "A run is already in progress on this connection"})
+                    continue
+                try:
+                    chat_request = ChatRequest.model_validate({k: v for k, v in command.items() if k != "type"})
+                except ValidationError as e:
+                    await send_event({"type": "error", "message": f"Invalid chat request: {e}"})
+                    continue
+                # Interrupts sent on this socket reach the run even without a test id
+                interrupt_key = chat_request.test_id or f"ws-{uuid.uuid4().hex}"
+                run_task = asyncio.create_task(run(chat_request, interrupt_key), name=f"ws-run:{interrupt_key}")
+                run_task.add_done_callback(_log_run_failure)
+            elif command_type == "interrupt":
+                if not run_task or run_task.done():
+                    await send_event({"type": "error", "message": "No run in progress to interrupt"})
+                    continue
+                if not command.get("message"):
+                    await send_event({"type": "error", "message": "Missing required field: message"})
+                    continue
+                # Straight to the loop in this process; no MongoDB round trip
+                queued = interrupt_hub.publish(Interrupt(key=interrupt_key, message=command["message"]))
+                await send_event({"type": "interrupt_queued" if queued else "interrupt_dropped"})
+            elif command_type == "stop":
+                await stop_run()
+                await send_event({"type": "stopped"})
+            else:
+                await send_event({"type": "error", "message": f"Unknown command type: {command_type}"})
+    except WebSocketDisconnect:
+        logger.info("WebSocket client disconnected")
+    except Exception as e:
+        logger.error(f"WebSocket error: {e}")
+    finally:
+        await stop_run()
+        metrics.WS_CLIENTS.dec()
+
+@router.get("/chat/sessions/{session_id}")
+async def get_chat_session(session_id: str):
+    """Size and state of a server-side conversation session"""
+    from ..sessions import session_store
+
+    session = session_store.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    return session.to_dict()
+
+@router.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    """Forget a conversation session and its spilled history"""
+    from ..sessions import session_store
+
+    session = session_store.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    if session.lock.locked():
+        return {"error": "Session is busy with another run"}
+    await asyncio.to_thread(session_store.delete, session_id)
+    return {"success": True, "message": "Session deleted successfully"}
+
 @router.post("/tools/execute", response_model=ToolExecuteResponse)
 async def execute_tool(request: ToolExecuteRequest):
+    from ..tool_sessions import build_tool_collection, tool_session_registry
+    
     try:
-        # Get tools for the specified version
-        tool_group = TOOL_GROUPS_BY_VERSION[request.tool_version]
-        tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
-        
-        # Execute tool directly
-        result = await tool_collection.run(
-            name=request.tool_name, 
-            tool_input=request.tool_input
-        )
+        if request.session_id:
+            # Warm tools kept by the registry between calls
+            async with tool_session_registry.session(request.session_id, request.tool_version) as tool_collection:
+                result = await tool_collection.run(
+                    name=request.tool_name,
+                    tool_input=request.tool_input
+                )
+        else:
+            # One-off tools for this call only
+            tool_collection = build_tool_collection(request.tool_version)
+            try:
+                result = await tool_collection.run(
+                    name=request.tool_name, 
+                    tool_input=request.tool_input
+                )
+            finally:
+                await asyncio.to_thread(tool_collection.close)
         
         return ToolExecuteResponse(result={"output": result.output, "error": result.error})
     except Exception as e:
@@ -237,52 +495,201 @@ async def execute_tool(request: ToolExecuteRequest):
             error=str(e)
         )
 
+@router.get("/tools/sessions")
+async def get_tool_sessions():
+    """Open tool sessions and how recently each was used"""
+    from ..tool_sessions import tool_session_registry
+    
+    return {"sessions": [tool_session.to_dict() for tool_session in tool_session_registry.sessions()]}
+
+@router.delete("/tools/sessions/{session_id}")
+async def delete_tool_session(session_id: str):
+    """Close a tool session's shell, browser capture and connections"""
+    from ..tool_sessions import tool_session_registry
+    
+    tool_session = tool_session_registry.get(session_id)
+    if not tool_session:
+        return {"error": "Tool session not found"}
+    if tool_session.lock.locked():
+        return {"error": "Tool session is busy with another call"}
+    await tool_session_registry.close(session_id)
+    return {"success": True, "message": "Tool session closed successfully"}
+
+
+# Fields GET /tasks can return; `result` and `execution_report` can hold whole message histories
+TASK_LIST_FIELDS = (
+    "instructions", "label", "status", "created_at", "started_at", "completed_at",
+    "last_run", "result", "error", "tool_use", "execution_report",
+)
+SUMMARY_TASK_FIELDS = tuple(field for field in TASK_LIST_FIELDS if field not in ("result", "execution_report"))
+# Stored fields each listed field is built from
+TASK_FIELD_SOURCES = {
+    "instructions": ("instructions", "instruction"),
+    "last_run": ("last_run", "started_at", "created_at"),
+}
+MAX_TASK_PAGE_SIZE = 500
+
+
+def _format_task(task: Dict[str, Any], fields=TASK_LIST_FIELDS) -> Dict[str, Any]:
+    """API shape of a stored task, limited to `fields`"""
+    # Get instructions, preserving array format if it exists
+    instructions = task.get('instructions')
+    if instructions is None:
+        # Fallback to old 'instruction' field for backwards compatibility
+        instruction = task.get('instruction')
+        if instruction:
+            instructions = [instruction] if isinstance(instruction, str) else instruction
+        else:
+            instructions = []
+    
+    formatted_task = {
+        "id": str(task["_id"]),
+        "instructions": instructions,
+        "label": task.get('label'),
+        "status": task.get('status', 'pending'),
+        "created_at": task.get('created_at'),
+        "started_at": task.get('started_at'),
+        "completed_at": task.get('completed_at'),
+        "last_run": task.get('last_run') or task.get('started_at') or task.get('created_at'),
+        "result": task.get('result'),
+        "error": task.get('error'),
+        "tool_use": task.get('tool_use'),
+        "execution_report": task.get('execution_report')
+    }
+    if fields is TASK_LIST_FIELDS:
+        return formatted_task
+    return {key: value for key, value in formatted_task.items() if key == "id" or key in fields}
+
+
+def _encode_task_cursor(task: Dict[str, Any]) -> str:
+    import base64
+    
+    created_at = task.get("created_at")
+    position = {"created_at": None, "id": str(task["_id"])}
+    if isinstance(created_at, str):
+        # Older tasks store created_at as a string, which MongoDB orders before dates
+        position["created_at"] = created_at
+        position["created_at_string"] = True
+    elif created_at:
+        position["created_at"] = created_at.isoformat()
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
 
-def get_mongodb_connection():
-    """Helper function to get MongoDB connection"""
-    import os
-    from pymongo import MongoClient
+def _task_cursor_query(cursor: str) -> Dict[str, Any]:
+    """Tasks after a cursor position in (created_at, _id) order"""
+    import base64
+    from bson import ObjectId
     
-    # MongoDB is always running locally on the container
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client.tilt
-    return db.tasks
+    position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    task_id = ObjectId(position["id"])
+    if position["created_at"] is None:
+        # Tasks without created_at sort first
+        return {"$or": [
+            {"created_at": None, "_id": {"$gt": task_id}},
+            {"created_at": {"$ne": None}},
+        ]}
+    if position.get("created_at_string"):
+        created_at = position["created_at"]
+        return {"$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "_id": {"$gt": task_id}},
+            {"created_at": {"$type": "date"}},
+        ]}
+    created_at = datetime.fromisoformat(position["created_at"])
+    return {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "_id": {"$gt": task_id}},
+    ]}
+
 
 @router.get("/tasks")
-async def get_all_tasks():
-    """Get all tasks from MongoDB"""
+async def get_all_tasks(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    label: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    format: str = "json",
+):
+    """
+    Get tasks from MongoDB, oldest first. Without parameters every task is returned in full.
+    
+    - limit/cursor: keyset pagination; the response carries `next_cursor` (null on the last page)
+    - fields: comma-separated fields to return, or "summary" for all but result/execution_report
+    - status (comma-separated), label (case-insensitive substring), created_after/created_before
+    - format=ndjson: stream one task per line instead of building one JSON document; with limit the
+      last line is `{"next_cursor": ...}`
+    """
     try:
-        tasks_collection = get_mongodb_connection()
-        
-        tasks = []
-        for task in tasks_collection.find().sort("created_at", 1):
-            # Get instructions, preserving array format if it exists
-            instructions = task.get('instructions')
-            if instructions is None:
-                # Fallback to old 'instruction' field for backwards compatibility
-                instruction = task.get('instruction')
-                if instruction:
-                    instructions = [instruction] if isinstance(instruction, str) else instruction
-                else:
-                    instructions = []
+        import re
+        from fastapi.encoders import jsonable_encoder
+        
+        if limit is not None and not 1 <= limit <= MAX_TASK_PAGE_SIZE:
+            return {"error": f"limit must be between 1 and {MAX_TASK_PAGE_SIZE}"}
+        if format not in ("json", "ndjson"):
+            return {"error": "format must be 'json' or 'ndjson'"}
+        
+        selected = TASK_LIST_FIELDS
+        projection = None
+        if fields:
+            selected = SUMMARY_TASK_FIELDS if fields == "summary" else tuple(field.strip() for field in fields.split(","))
+            unknown = [field for field in selected if field not in TASK_LIST_FIELDS]
+            if unknown:
+                return {"error": f"Unknown task fields: {', '.join(unknown)}"}
+            # Only read what is returned, so large result documents never leave MongoDB
+            projection = {"created_at": 1}
+            for field in selected:
+                for source in TASK_FIELD_SOURCES.get(field, (field,)):
+                    projection[source] = 1
+        
+        conditions = []
+        if status:
+            conditions.append({"status": {"$in": [value.strip() for value in status.split(",")]}})
+        if label:
+            conditions.append({"label": {"$regex": re.escape(label), "$options": "i"}})
+        if created_after or created_before:
+            created_range = {}
+            if created_after:
+                created_range["$gte"] = created_after
+            if created_before:
+                created_range["$lt"] = created_before
+            conditions.append({"created_at": created_range})
+        if cursor:
+            try:
+                conditions.append(_task_cursor_query(cursor))
+            except Exception:
+                return {"error": "Invalid cursor"}
+        query = {"$and": conditions} if conditions else {}
+        
+        # Read one extra task to know whether another page follows
+        fetch_limit = limit + 1 if limit else 0
+        
+        if format == "ndjson":
+            async def stream_tasks():
+                streamed = 0
+                last_task = None
+                async for task in db.iter_tasks(query, projection, fetch_limit):
+                    if limit is not None and streamed == limit:
+                        # The extra task only shows that another page follows
+                        yield json.dumps({"next_cursor": _encode_task_cursor(last_task)}) + "\n"
+                        return
+                    yield json.dumps(jsonable_encoder(_format_task(task, selected))) + "\n"
+                    streamed += 1
+                    last_task = task
+                if limit is not None:
+                    yield json.dumps({"next_cursor": None}) + "\n"
             
-            formatted_task = {
-                "id": str(task["_id"]),
-                "instructions": instructions,
-                "label": task.get('label'),
-                "status": task.get('status', 'pending'),
-                "created_at": task.get('created_at'),
-                "started_at": task.get('started_at'),
-                "completed_at": task.get('completed_at'),
-                "last_run": task.get('last_run') or task.get('started_at') or task.get('created_at'),
-                "result": task.get('result'),
-                "error": task.get('error'),
-                "tool_use": task.get('tool_use'),
-                "execution_report": task.get('execution_report')
-            }
-            tasks.append(formatted_task)
+            return StreamingResponse(stream_tasks(), media_type="application/x-ndjson")
+        
+        stored_tasks = [task async for task in db.iter_tasks(query, projection, fetch_limit)]
+        tasks = [_format_task(task, selected) for task in stored_tasks[:limit]]
         
-        return {"tasks": tasks}
+        if limit is None:
+            return {"tasks": tasks}
+        next_cursor = _encode_task_cursor(stored_tasks[limit - 1]) if len(stored_tasks) > limit else None
+        return {"tasks": tasks, "next_cursor": next_cursor}
         
     except Exception as e:
         return {"error": f"Failed to fetch tasks: {str(e)}"}
@@ -291,13 +698,11 @@ async def get_all_tasks():
 async def get_next_task():
     """Get the next pending task from MongoDB"""
     try:
-        tasks_collection = get_mongodb_connection()
-        
         # Get the first pending task with non-empty instructions
-        task = tasks_collection.find_one({
+        task = await db.find_first_task({
             "status": "pending",
             "instructions": {"$exists": True, "$ne": [], "$ne": None}
-        }, sort=[("created_at", 1)])
+        })
         
         if not task:
             return {"task": None, "message": "No pending tasks with valid instructions"}
@@ -332,11 +737,8 @@ async def get_next_task():
 async def complete_task(task_id: str, request_data: dict):
     """Mark task as completed"""
     try:
-        from bson import ObjectId
         from datetime import datetime, timezone
         
-        tasks_collection = get_mongodb_connection()
-        
         # Use status from request if provided, otherwise default to 'passed'
         status = request_data.get("status", "passed")
         
@@ -351,12 +753,11 @@ async def complete_task(task_id: str, request_data: dict):
         if "execution_report" in request_data:
             update_data["execution_report"] = request_data["execution_report"]
         
-        result = tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
-            {"$set": update_data}
-        )
+        modified = await db.update_task(task_id, {"$set": update_data})
+        if modified:
+            notification_hub.publish_status(task_id, status, task=True)
         
-        return {"success": result.modified_count > 0}
+        return {"success": modified}
         
     except Exception as e:
         return {"error": f"Failed to complete task: {str(e)}"}
@@ -365,11 +766,8 @@ async def complete_task(task_id: str, request_data: dict):
 async def error_task(task_id: str, request_data: dict):
     """Mark task as failed"""
     try:
-        from bson import ObjectId
         from datetime import datetime, timezone
         
-        tasks_collection = get_mongodb_connection()
-        
         update_data = {
             "status": "error",
             "completed_at": datetime.now(timezone.utc),
@@ -381,12 +779,11 @@ async def error_task(task_id: str, request_data: dict):
         if "execution_report" in request_data:
             update_data["execution_report"] = request_data["execution_report"]
         
-        result = tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
-            {"$set": update_data}
-        )
+        modified = await db.update_task(task_id, {"$set": update_data})
+        if modified:
+            notification_hub.publish_status(task_id, "error", task=True)
         
-        return {"success": result.modified_count > 0}
+        return {"success": modified}
         
     except Exception as e:
         return {"error": f"Failed to mark task as error: {str(e)}"}
@@ -395,22 +792,18 @@ async def error_task(task_id: str, request_data: dict):
 async def start_task(task_id: str):
     """Mark task as running"""
     try:
-        from bson import ObjectId
         from datetime import datetime, timezone
         
-        tasks_collection = get_mongodb_connection()
-        
-        result = tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
-            {
-                "$set": {
-                    "status": "running",
-                    "started_at": datetime.now(timezone.utc)
-                }
+        modified = await db.update_task(task_id, {
+            "$set": {
+                "status": "running",
+                "started_at": datetime.now(timezone.utc)
             }
-        )
+        })
+        if modified:
+            notification_hub.publish_status(task_id, "running", task=True)
         
-        return {"success": result.modified_count > 0}
+        return {"success": modified}
         
     except Exception as e:
         return {"error": f"Failed to start task: {str(e)}"}
@@ -419,25 +812,20 @@ async def start_task(task_id: str):
 async def stop_task(task_id: str):
     """Stop/cancel a running task and reset to pending"""
     try:
-        from bson import ObjectId
-        
-        tasks_collection = get_mongodb_connection()
-        
-        result = tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
-            {
-                "$set": {
-                    "status": "pending"
-                },
-                "$unset": {
-                    "started_at": "",
-                    "completed_at": "",
-                    "error": ""
-                }
+        modified = await db.update_task(task_id, {
+            "$set": {
+                "status": "pending"
+            },
+            "$unset": {
+                "started_at": "",
+                "completed_at": "",
+                "error": ""
             }
-        )
+        })
+        if modified:
+            notification_hub.publish_status(task_id, "pending", task=True)
         
-        return {"success": result.modified_count > 0}
+        return {"success": modified}
         
     except Exception as e:
         return {"error": f"Failed to stop task: {str(e)}"}
@@ -446,25 +834,20 @@ async def stop_task(task_id: str):
 async def reset_task(task_id: str):
     """Reset task status to pending"""
     try:
-        from bson import ObjectId
-        
-        tasks_collection = get_mongodb_connection()
-        
-        result = tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
-            {
-                "$set": {
-                    "status": "pending"
-                },
-                "$unset": {
-                    "started_at": "",
-                    "completed_at": "",
-                    "error": ""
-                }
+        modified = await db.update_task(task_id, {
+            "$set": {
+                "status": "pending"
+            },
+            "$unset": {
+                "started_at": "",
+                "completed_at": "",
+                "error": ""
             }
-        )
+        })
+        if modified:
+            notification_hub.publish_status(task_id, "pending", task=True)
         
-        return {"success": result.modified_count > 0}
+        return {"success": modified}
         
     except Exception as e:
         return {"error": f"Failed to reset task: {str(e)}"}
@@ -475,8 +858,6 @@ async def create_task(request_data: dict):
     try:
         from datetime import datetime, timezone
         
-        tasks_collection = get_mongodb_connection()
-        
         # Validate instructions
         instructions = request_data.get("instructions")
         if not instructions or (isinstance(instructions, list) and len(instructions) == 0):
@@ -510,9 +891,9 @@ async def create_task(request_data: dict):
         if "tool_use" in request_data:
             task_doc["tool_use"] = request_data["tool_use"]
             
-        result = tasks_collection.insert_one(task_doc)
+        task_id = await db.insert_task(task_doc)
         
-        return {"success": True, "task_id": str(result.inserted_id)}
+        return {"success": True, "task_id": task_id}
         
     except Exception as e:
         return {"error": f"Failed to create task: {str(e)}"}
@@ -521,12 +902,8 @@ async def create_task(request_data: dict):
 async def delete_task(task_id: str):
     """Delete a task"""
     try:
-        from bson import ObjectId
-        
-        tasks_collection = get_mongodb_connection()
-        
         # Check if task exists
-        task = tasks_collection.find_one({"_id": ObjectId(task_id)})
+        task = await db.find_task(task_id)
         if not task:
             return {"error": "Task not found"}
         
@@ -535,9 +912,7 @@ async def delete_task(task_id: str):
             return {"error": "Cannot delete running task"}
         
         # Delete the task
-        result = tasks_collection.delete_one({"_id": ObjectId(task_id)})
-        
-        if result.deleted_count > 0:
+        if await db.delete_task(task_id):
             return {"success": True, "message": "Task deleted successfully"}
         else:
             return {"error": "Failed to delete task"}
@@ -549,10 +924,6 @@ async def delete_task(task_id: str):
 async def update_task(task_id: str, request_data: dict):
     """Update a task"""
     try:
-        from bson import ObjectId
-        
-        tasks_collection = get_mongodb_connection()
-        
         set_data = {}
         unset_data = {}
         
@@ -582,12 +953,9 @@ async def update_task(task_id: str, request_data: dict):
         if unset_data:
             update_query["$unset"] = unset_data
         
-        result = tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
-            update_query
-        )
+        modified = await db.update_task(task_id, update_query)
         
-        return {"success": result.modified_count > 0}
+        return {"success": modified}
         
     except Exception as e:
         return {"error": f"Failed to update task: {str(e)}"}
@@ -653,9 +1021,8 @@ async def terminate_agents():
         except Exception:
             pass
         
-        # Give processes time to terminate
-        import time
-        time.sleep(2)
+        # Give processes time to terminate without holding up other streams
+        await asyncio.sleep(2)
         
         return {
             "success": True,
@@ -674,7 +1041,6 @@ async def cleanup_browser():
     """Clean up browser processes and state between tests"""
     try:
         import subprocess
-        import time
         
         cleanup_results = []
         
@@ -713,7 +1079,7 @@ async def cleanup_browser():
         cleanup_results.append("Browser temp files cleared")
         
         # Wait for processes to fully terminate
-        time.sleep(2)
+        await asyncio.sleep(2)
         
         # Reset VNC display and start fresh chrome session
         try:
@@ -726,7 +1092,7 @@ async def cleanup_browser():
             cleanup_results.append("VNC viewers cleared")
             
             
-            time.sleep(5)  
+            await asyncio.sleep(5)
             
             # Take a screenshot to ensure VNC is responsive
             try:
@@ -759,13 +1125,11 @@ async def get_panel_preferences():
     """Get panel preferences from MongoDB"""
     try:
         import os
-        from pymongo import MongoClient
         from datetime import datetime, timezone
         
-        # MongoDB is always running locally on the container
+        # Get the latest preferences, cached after the first load
         try:
-            client = MongoClient("mongodb://localhost:27017/")
-            db = client.tilt
+            preferences = await settings_service.get_panel_preferences()
         except Exception:
             # Return default preferences if MongoDB connection fails
             return {
@@ -794,12 +1158,7 @@ async def get_panel_preferences():
                 }
             }
         
-        preferences_collection = db.panel_preferences
-        
-        # Get the latest preferences document
-        prefs_doc = preferences_collection.find_one(sort=[("updated_at", -1)])
-        
-        if not prefs_doc:
+        if preferences is None:
             # Check if this is first run and create better defaults
             first_run_file = "/home/tilt/.tilt_first_run"
             is_first_run = not os.path.exists(first_run_file)
@@ -844,18 +1203,14 @@ async def get_panel_preferences():
             # Auto-save these defaults for first-time users
             if is_first_run:
                 try:
-                    prefs_doc = {
-                        "preferences": default_prefs["preferences"],
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                    preferences_collection.replace_one({}, prefs_doc, upsert=True)
+                    await settings_service.save_panel_preferences(default_prefs["preferences"])
                     print("✅ First run: saved default preferences to database")
                 except Exception as e:
                     print(f"Failed to save first run defaults: {e}")
             
             return default_prefs
         
-        return {"preferences": prefs_doc.get("preferences", {})}
+        return {"preferences": preferences}
         
     except Exception as e:
         return {"error": f"Failed to fetch panel preferences: {str(e)}"}
@@ -864,33 +1219,15 @@ async def get_panel_preferences():
 async def save_panel_preferences(request_data: dict):
     """Save panel preferences to MongoDB"""
     try:
-        import os
-        from pymongo import MongoClient
-        from datetime import datetime, timezone
-        
-        # MongoDB is always running locally on the container
         preferences = request_data.get("preferences")
         if not preferences:
             return {"error": "Missing preferences data"}
         
-        client = MongoClient("mongodb://localhost:27017/")
-        db = client.tilt
-        preferences_collection = db.panel_preferences
+        # Replace the existing preferences document (we only keep the latest). Written
+        # behind, so a burst of drags ends in a single write of the final layout
+        settings_service.update_panel_preferences(preferences)
         
-        # Create or update preferences document
-        prefs_doc = {
-            "preferences": preferences,
-            "updated_at": datetime.now(timezone.utc)
-        }
-        
-        # Replace the existing preferences document (we only keep the latest)
-        result = preferences_collection.replace_one(
-            {},  # Match any document (we only store one)
-            prefs_doc,
-            upsert=True  # Create if doesn't exist
-        )
-        
-        return {"success": True, "upserted": result.upserted_id is not None}
+        return {"success": True, "queued": True}
         
     except Exception as e:
         return {"error": f"Failed to save panel preferences: {str(e)}"}
@@ -899,13 +1236,18 @@ async def save_panel_preferences(request_data: dict):
 async def health_check():
     return {"status": "healthy", "service": "computer-use-api"}
 
+@router.get("/displays")
+async def get_displays():
+    """Virtual display pool: which displays are leased and by which run"""
+    return display_pool.stats()
+
 @router.get("/api-key/status")
 async def get_api_key_status():
     """Check if API key is configured in MongoDB"""
     try:
         from ..utils import get_api_key_from_mongodb, validate_api_key
         
-        api_key = get_api_key_from_mongodb()
+        api_key = await get_api_key_from_mongodb()
         has_key = api_key is not None
         is_valid = validate_api_key(api_key) if has_key else False
         
@@ -931,7 +1273,7 @@ async def set_api_key(request_data: dict):
         if not validate_api_key(api_key):
             return {"error": "Invalid API key format. API key should start with 'sk-ant-' and be at least 20 characters long."}
         
-        success = store_api_key_in_mongodb(api_key)
+        success = await store_api_key_in_mongodb(api_key)
         if success:
             return {"success": True, "message": "API key stored successfully"}
         else:
@@ -944,8 +1286,6 @@ async def set_api_key(request_data: dict):
 async def send_message_to_agent(request_data: dict):
     """Send a chat message with additional instructions to the running agent"""
     try:
-        from datetime import datetime, timezone
-        
         test_id = request_data.get("testId")
         message = request_data.get("message")
         timestamp = request_data.get("timestamp")
@@ -956,37 +1296,33 @@ async def send_message_to_agent(request_data: dict):
         # Log the chat message
         print(f"[Agent Chat] Test {test_id}: {message}")
         
-        # Store the chat message in a queue or database for the agent to process
-        # Store it in MongoDB in an 'interrupts' collection (keeping same name as frontend expects)
+        # Persist the message in the 'interrupts' collection (keeping same name as frontend expects)
+        # and push it straight to the running loop through the in-process hub
+        from ..interrupts import Interrupt, interrupt_hub
+        
         try:
-            from pymongo import MongoClient
-            
-            client = MongoClient("mongodb://localhost:27017/")
-            db = client.tilt
-            interrupts_collection = db.interrupts
-            
-            interrupt_doc = {
-                "test_id": test_id,
-                "message": message,
-                "timestamp": timestamp or datetime.now(timezone.utc).isoformat(),
-                "created_at": datetime.now(timezone.utc),
-                "processed": False
-            }
-            
-            result = interrupts_collection.insert_one(interrupt_doc)
+            interrupt_doc = await db.insert_interrupt(test_id, message, timestamp)
+            interrupt_hub.publish(Interrupt(
+                key=test_id,
+                message=message,
+                interrupt_id=str(interrupt_doc["_id"]),
+                created_at=interrupt_doc["created_at"],
+            ))
             
             return {
                 "success": True,
                 "message": "Interrupt message queued for agent",
-                "interrupt_id": str(result.inserted_id)
+                "interrupt_id": str(interrupt_doc["_id"])
             }
             
         except Exception as db_error:
             print(f"Failed to store interrupt in database: {db_error}")
-            # Even if DB storage fails, we can still log the interrupt
+            # Even if DB storage fails, a loop running in this process still gets it
+            if not interrupt_hub.publish(Interrupt(key=test_id, message=message)):
+                return {"error": "Failed to store interrupt and no agent is running for this test in this process"}
             return {
                 "success": True,
-                "message": "Interrupt message logged (database unavailable)",
+                "message": "Interrupt message delivered to agent (database unavailable)",
                 "warning": "Message not persisted"
             }
         
@@ -998,25 +1334,12 @@ async def send_message_to_agent(request_data: dict):
 async def get_agent_chat_messages(test_id: str):
     """Get pending chat messages for a test"""
     try:
-        from pymongo import MongoClient
-        
-        client = MongoClient("mongodb://localhost:27017/")
-        db = client.tilt
-        interrupts_collection = db.interrupts
-        
         # Get unprocessed chat messages for this test
-        messages = list(interrupts_collection.find({
-            "test_id": test_id,
-            "processed": False
-        }).sort("created_at", 1))
+        messages = await db.find_unprocessed_interrupts(test_id)
         
         # Mark messages as processed
         if messages:
-            message_ids = [message["_id"] for message in messages]
-            interrupts_collection.update_many(
-                {"_id": {"$in": message_ids}},
-                {"$set": {"processed": True}}
-            )
+            await db.mark_interrupts_processed([message["_id"] for message in messages])
         
         # Format response
         formatted_messages = []
@@ -1035,4 +1358,32 @@ async def get_agent_chat_messages(test_id: str):
         
     except Exception as e:
         print(f"Error fetching agent chat messages: {e}")
-        return {"error": f"Failed to fetch messages: {str(e)}"}
\ No newline at end of file
+        return {"error": f"Failed to fetch messages: {str(e)}"}
+
+@router.get("/agent/events/{test_id}")
+async def stream_agent_events(test_id: str):
+    """Push interrupts, their delivery and run status for a test as they happen, instead of polling"""
+    queue = notification_hub.subscribe(test_id)
+    
+    async def event_stream():
+        try:
+            yield f"data: {json.dumps({'type': 'subscribed', 'test_id': test_id})}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield f"data: {json.dumps({'type': 'keepalive'})}\n\n"
+                    continue
+                yield f"data: {json.dumps(event, default=str)}\n\n"
+        finally:
+            notification_hub.unsubscribe(test_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+        },
+    )
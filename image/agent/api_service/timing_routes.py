@@ -3,28 +3,59 @@ API routes for timing statistics and reporting.
 """
 
 from fastapi import APIRouter, HTTPException
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
 # Import timing collector with fallback
 try:
-    from ..timing_utils import timing_collector
+    from ..timing_utils import TimingCollector, collector_registry, timing_collector
 except ImportError:
     logger.warning("Timing utilities not available")
     timing_collector = None
 
 router = APIRouter()
 
-@router.get("/timing/statistics")
-async def get_timing_statistics() -> Dict[str, Any]:
-    """Get comprehensive timing statistics for all steps."""
+
+def _collector_for(run_id: Optional[str]) -> "TimingCollector":
+    """The collector for one run, or the aggregate of all runs when no run id is given."""
+    if not timing_collector:
+        raise HTTPException(status_code=503, detail="Timing collection not available")
+    if run_id is None:
+        return timing_collector
+    collector = collector_registry.get(run_id)
+    if collector is None:
+        raise HTTPException(status_code=404, detail=f"No timing data for run {run_id}")
+    return collector
+
+@router.get("/timing/runs")
+async def list_timing_runs(test_id: Optional[str] = None) -> Dict[str, Any]:
+    """List runs with their own timing data, optionally for one test."""
     if not timing_collector:
         raise HTTPException(status_code=503, detail="Timing collection not available")
     
+    runs = [collector.describe() for collector in collector_registry.find(test_id=test_id)]
+    return {
+        "status": "success",
+        "data": {
+            "runs": runs,
+            "count": len(runs)
+        }
+    }
+
+@router.get("/timing/statistics")
+async def get_timing_statistics(window: Optional[float] = None, run_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get comprehensive timing statistics, including p50/p95/p99 per metric, for all
+    runs or one `run_id`. `window` limits them to the last N seconds (up to an hour).
+    """
+    collector = _collector_for(run_id)
+    if window is not None and window <= 0:
+        raise HTTPException(status_code=400, detail="window must be a positive number of seconds")
+    
     try:
-        stats = timing_collector.get_statistics()
+        stats = collector.get_statistics(window)
         return {
             "status": "success",
             "data": stats
@@ -34,13 +65,12 @@ async def get_timing_statistics() -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/timing/history")
-async def get_timing_history() -> Dict[str, Any]:
-    """Get detailed timing history for all completed steps."""
-    if not timing_collector:
-        raise HTTPException(status_code=503, detail="Timing collection not available")
+async def get_timing_history(run_id: Optional[str] = None) -> Dict[str, Any]:
+    """Get detailed timing history for completed steps of all runs or one run."""
+    collector = _collector_for(run_id)
     
     try:
-        history = timing_collector.get_step_history()
+        history = collector.get_step_history()
         return {
             "status": "success",
             "data": {
@@ -53,13 +83,12 @@ async def get_timing_history() -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/timing/summary")
-async def get_timing_summary() -> Dict[str, Any]:
+async def get_timing_summary(run_id: Optional[str] = None) -> Dict[str, Any]:
     """Get a concise timing summary with key metrics."""
-    if not timing_collector:
-        raise HTTPException(status_code=503, detail="Timing collection not available")
+    collector = _collector_for(run_id)
     
     try:
-        stats = timing_collector.get_statistics()
+        stats = collector.get_statistics()
         
         if stats["total_steps"] == 0:
             return {
@@ -77,7 +106,8 @@ async def get_timing_summary() -> Dict[str, Any]:
                 "step_number": stats["longest_step"]["step_number"],
                 "duration": round(stats["longest_step"]["duration"], 3)
             },
-            "total_time": round(stats["total_time"], 3)
+            "total_time": round(stats["total_time"], 3),
+            "p95_step_time": round(stats["p95_step_time"], 3)
         }
         
         # Add sub-timing averages if available
@@ -103,12 +133,8 @@ async def reset_timing_data() -> Dict[str, Any]:
         raise HTTPException(status_code=503, detail="Timing collection not available")
     
     try:
-        # Reset the collector by creating a new instance
-        from ..timing_utils import TimingCollector
-        # Replace the global collector
-        import sys
-        module = sys.modules['agent.timing_utils']
-        module.timing_collector = TimingCollector()
+        # Clear in place so every module holding the collector sees the reset
+        collector_registry.reset()
         
         return {
             "status": "success",
@@ -119,17 +145,109 @@ async def reset_timing_data() -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/timing/log")
-async def log_timing_statistics() -> Dict[str, Any]:
+async def log_timing_statistics(run_id: Optional[str] = None) -> Dict[str, Any]:
     """Force logging of current timing statistics."""
-    if not timing_collector:
-        raise HTTPException(status_code=503, detail="Timing collection not available")
+    collector = _collector_for(run_id)
     
     try:
-        timing_collector.log_statistics()
+        collector.log_statistics()
         return {
             "status": "success",
             "message": "Timing statistics logged successfully"
         }
     except Exception as e:
         logger.error(f"Error logging timing statistics: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+@router.get("/timing/traces")
+async def list_traces() -> Dict[str, Any]:
+    """List the run ids that have recorded spans."""
+    from ..tracing import tracer
+    
+    run_ids = tracer.trace_ids()
+    return {
+        "status": "success",
+        "data": {
+            "run_ids": run_ids,
+            "count": len(run_ids)
+        }
+    }
+
+@router.get("/timing/trace")
+async def export_trace(run_id: Optional[str] = None, format: str = "chrome") -> Dict[str, Any]:
+    """
+    Export spans for one run (or all runs) as Chrome trace-event JSON (load in Perfetto)
+    or OTLP JSON.
+    """
+    from ..tracing import tracer
+    
+    if format not in ("chrome", "otlp"):
+        raise HTTPException(status_code=400, detail="format must be 'chrome' or 'otlp'")
+    if run_id and not tracer.spans(run_id):
+        raise HTTPException(status_code=404, detail=f"No spans recorded for run {run_id}")
+    
+    if format == "otlp":
+        return tracer.export_otlp(run_id)
+    return tracer.export_chrome(run_id)
+
+@router.get("/timing/rollups")
+async def get_timing_rollups(dimension: str = "test", key: Optional[str] = None, days: int = 30) -> Dict[str, Any]:
+    """
+    Daily per-test or per-tag rollups (p50/p95 step time, tokens, screenshot bytes),
+    read from precomputed summaries.
+    """
+    if dimension not in ("test", "tag"):
+        raise HTTPException(status_code=400, detail="dimension must be 'test' or 'tag'")
+    
+    try:
+        from datetime import datetime, timedelta, timezone
+        from ..db import get_database
+        from ..metrics import time_mongodb
+        from ..telemetry import ROLLUP_COLLECTION
+        
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        query: Dict[str, Any] = {"dimension": dimension, "day": {"$gte": since}}
+        if key is not None:
+            query["key"] = key
+        
+        with time_mongodb(ROLLUP_COLLECTION, "find"):
+            cursor = get_database()[ROLLUP_COLLECTION].find(query, {"_id": 0}).sort([("day", 1), ("key", 1)])
+            rollups = await cursor.to_list(length=None)
+        for rollup in rollups:
+            rollup["day"] = rollup["day"].date().isoformat()
+            if rollup.get("updated_at"):
+                rollup["updated_at"] = rollup["updated_at"].isoformat()
+        return {
+            "status": "success",
+            "data": {
+                "rollups": rollups,
+                "count": len(rollups)
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error reading timing rollups: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/timing/rollups/refresh")
+async def refresh_timing_rollups(days: int = 2) -> Dict[str, Any]:
+    """Flush buffered telemetry and recompute the rollups for the last `days` days."""
+    try:
+        import asyncio
+        from ..telemetry import compute_rollups, telemetry_writer
+        
+        def refresh():
+            written = telemetry_writer.flush()
+            result = compute_rollups(telemetry_writer.database(), days=days)
+            return written, result
+        
+        written, result = await asyncio.to_thread(refresh)
+        return {
+            "status": "success",
+            "data": {
+                "flushed_records": written,
+                "since": result["since"].isoformat(),
+                "duration": result["duration"]
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error refreshing timing rollups: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
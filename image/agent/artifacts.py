@@ -0,0 +1,248 @@
+"""
+Content-addressed store for screenshots and other binary artifacts.
+
+Images are written once under their SHA-256 and referenced by id, so a stream can send
+`image_id` instead of repeating megabytes of base64. Conversations sent to the API carry
+image blocks with an `artifact` source, which `resolve_messages` turns back into base64
+before the model call. Thumbnails are rendered on demand with ImageMagick and cached
+next to the original.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Soft cap on the store; the oldest artifacts are pruned past it
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Puts between size checks, so pruning never scans the directory on every screenshot
+PRUNE_EVERY = 200
+THUMBNAIL_WIDTHS = (160, 320, 640)
+
+_MEDIA_TYPES: List[Tuple[bytes, str, str]] = [
+    (b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+    (b"\xff\xd8\xff", "image/jpeg", "jpg"),
+    (b"GIF8", "image/gif", "gif"),
+    (b"RIFF", "image/webp", "webp"),
+]
+_EXTENSIONS = {extension: media_type for _, media_type, extension in _MEDIA_TYPES}
+
+
+class MissingArtifactError(KeyError):
+    """A referenced artifact is not in the store, usually because it was pruned."""
+
+    def __init__(self, artifact_id: str):
+        super().__init__(artifact_id)
+        self.artifact_id = artifact_id
+
+    def __str__(self) -> str:
+        return f"Unknown artifact {self.artifact_id}"
+
+
+def sniff_media_type(data: bytes) -> Tuple[str, str]:
+    """(media type, file extension) from the leading magic bytes."""
+    for magic, media_type, extension in _MEDIA_TYPES:
+        if data.startswith(magic):
+            return media_type, extension
+    return "application/octet-stream", "bin"
+
+
+class ArtifactStore:
+    """Artifacts on disk at <root>/<id[:2]>/<id>.<ext>, written atomically and never modified."""
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.root = root or os.getenv('TILT_ARTIFACT_DIR', '/tmp/tilt-artifacts')
+        self.max_bytes = max_bytes or int(os.getenv('TILT_ARTIFACT_MAX_BYTES', DEFAULT_MAX_BYTES))
+        self._lock = threading.Lock()
+        self._puts = 0
+        # Artifacts that must survive pruning, by owner (e.g. spilled session history)
+        self._pins: Dict[str, Set[str]] = {}
+
+    def _directory(self, artifact_id: str) -> str:
+        return os.path.join(self.root, artifact_id[:2])
+
+    def find(self, artifact_id: str) -> Optional[Tuple[str, str]]:
+        """(path, media type) of a stored artifact, or None."""
+        if not ARTIFACT_ID_PATTERN.match(artifact_id):
+            return None
+        directory = self._directory(artifact_id)
+        for extension, media_type in _EXTENSIONS.items():
+            path = os.path.join(directory, f"{artifact_id}.{extension}")
+            if os.path.exists(path):
+                return path, media_type
+        path = os.path.join(directory, f"{artifact_id}.bin")
+        return (path, "application/octet-stream") if os.path.exists(path) else None
+
+    def put(self, data: bytes) -> str:
+        """Store `data` if it is new and return its id."""
+        artifact_id = hashlib.sha256(data).hexdigest()
+        _, extension = sniff_media_type(data)
+        directory = self._directory(artifact_id)
+        path = os.path.join(directory, f"{artifact_id}.{extension}")
+        try:
+            # A repeated write counts as recent use, so pruning keeps artifacts still in circulation
+            os.utime(path)
+            return artifact_id
+        except FileNotFoundError:
+            pass
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return artifact_id
+
+    def put_base64(self, encoded: str) -> str:
+        return self.put(base64.b64decode(encoded))
+
+    def read_base64(self, artifact_id: str) -> Tuple[str, str]:
+        """(base64 data, media type) of a stored artifact; MissingArtifactError if it is missing."""
+        found = self.find(artifact_id)
+        if not found:
+            raise MissingArtifactError(artifact_id)
+        path, media_type = found
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode(), media_type
+
+    def pin(self, owner: str, artifact_ids: Iterable[str]):
+        """Keep artifacts out of pruning until `owner` unpins them."""
+        with self._lock:
+            self._pins.setdefault(owner, set()).update(artifact_ids)
+
+    def unpin(self, owner: str):
+        with self._lock:
+            self._pins.pop(owner, None)
+
+    def prune(self):
+        """Delete the least recently written or reused artifacts until the store is under `max_bytes`."""
+        with self._lock:
+            pinned = set().union(*self._pins.values())
+        files = []
+        total = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.split(".", 1)[0] in pinned:
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        logger.info(f"Pruned artifact store to {total / 1024 ** 2:.0f} MiB")
+
+    async def thumbnail(self, artifact_id: str, width: int) -> Optional[str]:
+        """Path of a PNG thumbnail `width` pixels wide, rendered once with ImageMagick."""
+        found = self.find(artifact_id)
+        if not found:
+            return None
+        path = os.path.join(self._directory(artifact_id), f"{artifact_id}.thumb{width}.png")
+        if os.path.exists(path):
+            return path
+        temporary = f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        process = await asyncio.create_subprocess_exec(
+            "convert", found[0], "-thumbnail", f"{width}x", f"png:{temporary}",
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"Thumbnail failed: {stderr.decode(errors='replace').strip()}")
+        os.replace(temporary, path)
+        return path
+
+    # Message conversion
+
+    def externalize_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Copy of `messages` with base64 image blocks replaced by artifact references.
+        Only the containers on the way to an image are copied.
+        """
+        return [self._map_message(message, self._externalize_image) for message in messages]
+
+    def resolve_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Copy of `messages` with artifact references turned back into base64 images."""
+        return [self._map_message(message, self._resolve_image) for message in messages]
+
+    def referenced_ids(self, messages: List[Dict[str, Any]]) -> Set[str]:
+        """Ids of the artifacts referenced by image blocks in `messages`."""
+        artifact_ids: Set[str] = set()
+
+        def collect(block: Dict[str, Any]) -> Dict[str, Any]:
+            source = block.get("source") or {}
+            if source.get("type") == "artifact":
+                artifact_ids.add(source["artifact_id"])
+            return block
+
+        for message in messages:
+            self._map_message(message, collect)
+        return artifact_ids
+
+    def _externalize_image(self, block: Dict[str, Any]) -> Dict[str, Any]:
+        source = block.get("source") or {}
+        if source.get("type") != "base64":
+            return block
+        artifact_id = self.put_base64(source["data"])
+        return {**block, "source": {
+            "type": "artifact",
+            "artifact_id": artifact_id,
+            "media_type": source.get("media_type"),
+        }}
+
+    def _resolve_image(self, block: Dict[str, Any]) -> Dict[str, Any]:
+        source = block.get("source") or {}
+        if source.get("type") != "artifact":
+            return block
+        data, media_type = self.read_base64(source["artifact_id"])
+        return {**block, "source": {
+            "type": "base64",
+            "media_type": source.get("media_type") or media_type,
+            "data": data,
+        }}
+
+    def _map_message(self, message: Dict[str, Any], convert) -> Dict[str, Any]:
+        content = message.get("content")
+        if not isinstance(content, list):
+            return message
+        return {**message, "content": [self._map_block(block, convert) for block in content]}
+
+    def _map_block(self, block: Any, convert) -> Any:
+        if not isinstance(block, dict):
+            return block
+        if block.get("type") == "image":
+            return convert(block)
+        if block.get("type") == "tool_result" and isinstance(block.get("content"), list):
+            return {**block, "content": [self._map_block(item, convert) for item in block["content"]]}
+        return block
+
+
+def artifact_url(artifact_id: str) -> str:
+    return f"/api/v1/artifacts/{artifact_id}"
+
+
+# Global store shared by the routes in this process
+artifact_store = ArtifactStore()
@@ -0,0 +1,212 @@
+"""
+Shared async MongoDB access.
+
+One Motor client per process with a bounded connection pool and short timeouts, plus
+small repository functions for the collections the agent uses (tasks, tests, settings,
+interrupts and panel preferences). Callers await these instead of building their own
+`MongoClient` and making blocking calls from the event loop.
+"""
+
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union
+
+from bson import ObjectId
+
+from .metrics import time_mongodb
+
+logger = logging.getLogger(__name__)
+
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+DATABASE_NAME = 'tilt'
+
+# MongoDB runs next to the agent, so fail fast instead of hanging a request for 30s
+CLIENT_OPTIONS: Dict[str, Any] = {
+    'maxPoolSize': int(os.getenv('TILT_MONGODB_POOL_SIZE', '50')),
+    'minPoolSize': 1,
+    'maxIdleTimeMS': 300_000,
+    'serverSelectionTimeoutMS': 5_000,
+    'connectTimeoutMS': 5_000,
+    'socketTimeoutMS': 30_000,
+    'waitQueueTimeoutMS': 10_000,
+    'appname': 'tilt-agent',
+}
+
+Id = Union[str, ObjectId]
+Sort = Sequence[Tuple[str, int]]
+
+_client = None
+
+
+def get_client():
+    """The process-wide `AsyncIOMotorClient`, created on first use."""
+    global _client
+    if _client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        _client = AsyncIOMotorClient(MONGODB_URI, **CLIENT_OPTIONS)
+    return _client
+
+
+def get_database():
+    return get_client()[DATABASE_NAME]
+
+
+def close_client():
+    """Close the shared client; the next call to `get_client` opens a new one."""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def _object_id(value: Id) -> ObjectId:
+    return value if isinstance(value, ObjectId) else ObjectId(value)
+
+
+# Tasks
+
+async def find_tasks(
+    query: Optional[Dict[str, Any]] = None,
+    sort: Sort = (('created_at', 1),),
+) -> List[Dict[str, Any]]:
+    with time_mongodb('tasks', 'find'):
+        return await get_database().tasks.find(query or {}).sort(list(sort)).to_list(length=None)
+
+
+async def iter_tasks(
+    query: Dict[str, Any],
+    projection: Optional[Dict[str, Any]] = None,
+    limit: int = 0,
+    sort: Sort = (('created_at', 1), ('_id', 1)),
+    batch_size: int = 100,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Stream matching tasks in batches instead of loading them all into memory."""
+    cursor = get_database().tasks.find(query, projection).sort(list(sort)).limit(limit).batch_size(batch_size)
+    async for task in cursor:
+        yield task
+
+
+async def ensure_task_indexes():
+    """Indexes behind the task list filters and keyset pagination, and the runner's queue query."""
+    from pymongo import ASCENDING
+
+    tasks = get_database().tasks
+    with time_mongodb('tasks', 'create_indexes'):
+        await tasks.create_index([('created_at', ASCENDING), ('_id', ASCENDING)], name='created_at_id')
+        await tasks.create_index(
+            [('status', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)], name='status_created_at_id'
+        )
+
+
+async def find_task(task_id: Id) -> Optional[Dict[str, Any]]:
+    with time_mongodb('tasks', 'find_one'):
+        return await get_database().tasks.find_one({'_id': _object_id(task_id)})
+
+
+async def find_first_task(query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Oldest task matching `query`."""
+    with time_mongodb('tasks', 'find_one'):
+        return await get_database().tasks.find_one(query, sort=[('created_at', 1)])
+
+
+async def insert_task(document: Dict[str, Any]) -> str:
+    with time_mongodb('tasks', 'insert_one'):
+        result = await get_database().tasks.insert_one(document)
+    return str(result.inserted_id)
+
+
+async def update_task(task_id: Id, update: Dict[str, Any]) -> bool:
+    """Apply an update document (`$set`, `$unset`, ...). Returns whether the task changed."""
+    with time_mongodb('tasks', 'update_one'):
+        result = await get_database().tasks.update_one({'_id': _object_id(task_id)}, update)
+    return result.modified_count > 0
+
+
+async def delete_task(task_id: Id) -> bool:
+    with time_mongodb('tasks', 'delete_one'):
+        result = await get_database().tasks.delete_one({'_id': _object_id(task_id)})
+    return result.deleted_count > 0
+
+
+# Tests
+
+async def find_test(test_id: Id) -> Optional[Dict[str, Any]]:
+    with time_mongodb('tests', 'find_one'):
+        return await get_database().tests.find_one({'_id': _object_id(test_id)})
+
+
+async def update_test(
+    test_id: Id,
+    update: Dict[str, Any],
+    array_filters: Optional[List[Dict[str, Any]]] = None,
+) -> bool:
+    with time_mongodb('tests', 'update_one'):
+        result = await get_database().tests.update_one(
+            {'_id': _object_id(test_id)}, update, array_filters=array_filters
+        )
+    return result.modified_count > 0
+
+
+# Settings
+
+async def get_setting(key: str) -> Optional[Any]:
+    """Value of a `{key, value}` settings document, or None."""
+    with time_mongodb('settings', 'find_one'):
+        document = await get_database().settings.find_one({'key': key})
+    return document.get('value') if document else None
+
+
+async def set_setting(key: str, value: Any):
+    with time_mongodb('settings', 'replace_one'):
+        await get_database().settings.replace_one({'key': key}, {'key': key, 'value': value}, upsert=True)
+
+
+# Interrupts
+
+async def insert_interrupt(test_id: str, message: str, timestamp: Optional[str] = None) -> Dict[str, Any]:
+    """Store an unprocessed interrupt and return the stored document, including `_id`."""
+    now = datetime.now(timezone.utc)
+    document = {
+        'test_id': test_id,
+        'message': message,
+        'timestamp': timestamp or now.isoformat(),
+        'created_at': now,
+        'processed': False,
+    }
+    with time_mongodb('interrupts', 'insert_one'):
+        await get_database().interrupts.insert_one(document)
+    return document
+
+
+async def find_unprocessed_interrupts(test_id: str) -> List[Dict[str, Any]]:
+    with time_mongodb('interrupts', 'find'):
+        cursor = get_database().interrupts.find({'test_id': test_id, 'processed': False}).sort('created_at', 1)
+        return await cursor.to_list(length=None)
+
+
+async def mark_interrupts_processed(interrupt_ids: Sequence[Id]) -> int:
+    if not interrupt_ids:
+        return 0
+    with time_mongodb('interrupts', 'update_many'):
+        result = await get_database().interrupts.update_many(
+            {'_id': {'$in': [_object_id(interrupt_id) for interrupt_id in interrupt_ids]}},
+            {'$set': {'processed': True}}
+        )
+    return result.modified_count
+
+
+# Panel preferences (a single document holding the latest layout)
+
+async def get_panel_preferences() -> Optional[Dict[str, Any]]:
+    with time_mongodb('panel_preferences', 'find_one'):
+        return await get_database().panel_preferences.find_one(sort=[('updated_at', -1)])
+
+
+async def save_panel_preferences(preferences: Dict[str, Any]) -> bool:
+    """Replace the stored preferences. Returns True when the document was created."""
+    document = {'preferences': preferences, 'updated_at': datetime.now(timezone.utc)}
+    with time_mongodb('panel_preferences', 'replace_one'):
+        result = await get_database().panel_preferences.replace_one({}, document, upsert=True)
+    return result.upserted_id is not None
@@ -0,0 +1,249 @@
+"""
+Pool of isolated virtual desktops for running several agents on one host.
+
+Each pool display is its own Xvfb server plus a Chromium with a separate profile and
+DevTools port. A chat stream or task leases a display for its run. While the lease is
+held, `current_display` points at it, so the tools built in that context (computer,
+bash, the DevTools inspectors) drive that desktop instead of the DISPLAY_NUM/WIDTH/HEIGHT
+one from the environment. The pool is off by default (TILT_DISPLAY_POOL_SIZE=0), which
+keeps the container's single shared desktop.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Display numbers and DevTools ports well clear of the shared desktop (:1, 9222)
+BASE_DISPLAY_NUM = int(os.getenv('TILT_DISPLAY_BASE', '10'))
+BASE_DEVTOOLS_PORT = int(os.getenv('TILT_DEVTOOLS_BASE_PORT', '9300'))
+DEFAULT_DEVTOOLS_PORT = 9222
+PROFILE_ROOT = os.getenv('TILT_DISPLAY_PROFILE_DIR', '/tmp/tilt-displays')
+# Seconds a run waits for a free display before failing
+LEASE_TIMEOUT = float(os.getenv('TILT_DISPLAY_LEASE_TIMEOUT', '300'))
+STARTUP_TIMEOUT = 15.0
+
+# The display leased by the current run, or None on the shared desktop
+current_display: ContextVar[Optional["Display"]] = ContextVar("current_display", default=None)
+
+
+def devtools_url() -> str:
+    """Chromium DevTools endpoint for the current run's desktop."""
+    display = current_display.get()
+    port = display.devtools_port if display else DEFAULT_DEVTOOLS_PORT
+    return f"http://localhost:{port}"
+
+
+async def _wait_until(check, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not await check():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{what} did not start within {timeout:.0f}s")
+        await asyncio.sleep(0.1)
+
+
+async def _stop_process(process: Optional[asyncio.subprocess.Process]):
+    if process is None or process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+@dataclass
+class Display:
+    """One pool desktop: an Xvfb server and the Chromium running on it."""
+    index: int
+    display_num: int
+    width: int
+    height: int
+    devtools_port: int
+    leased_by: Optional[str] = None
+    leased_at: Optional[float] = None
+    leases: int = 0
+    _xvfb: Optional[asyncio.subprocess.Process] = field(default=None, repr=False)
+    _browser: Optional[asyncio.subprocess.Process] = field(default=None, repr=False)
+
+    @property
+    def profile_dir(self) -> str:
+        return os.path.join(PROFILE_ROOT, f"display-{self.display_num}")
+
+    @property
+    def running(self) -> bool:
+        return self._xvfb is not None and self._xvfb.returncode is None
+
+    def env(self) -> Dict[str, str]:
+        """Environment for processes that should run on this desktop."""
+        return {
+            **os.environ,
+            "DISPLAY": f":{self.display_num}",
+            "DISPLAY_NUM": str(self.display_num),
+            "WIDTH": str(self.width),
+            "HEIGHT": str(self.height),
+        }
+
+    async def start(self):
+        """Start Xvfb and Chromium if they are not running (e.g. after a crash)."""
+        if not self.running:
+            self._xvfb = await asyncio.create_subprocess_exec(
+                "Xvfb", f":{self.display_num}", "-ac", "-screen", "0", f"{self.width}x{self.height}x24",
+                "-retro", "-dpi", "96", "-nolisten", "tcp",
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            )
+            socket_path = f"/tmp/.X11-unix/X{self.display_num}"
+
+            async def xvfb_ready():
+                return os.path.exists(socket_path)
+
+            await _wait_until(xvfb_ready, STARTUP_TIMEOUT, f"Xvfb :{self.display_num}")
+        if self._browser is None or self._browser.returncode is not None:
+            await self._start_browser()
+
+    async def _start_browser(self):
+        # Every browser start gets an empty profile so no cookies or storage leak between runs
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self._browser = await asyncio.create_subprocess_exec(
+            os.getenv('BROWSER_BINARY', 'chromium-browser'),
+            "--no-first-run", "--incognito", f"--remote-debugging-port={self.devtools_port}",
+            f"--user-data-dir={self.profile_dir}", f"--window-size={self.width},{self.height}",
+            "--no-sandbox", "--disable-dev-shm-usage", "--disable-features=VizDisplayCompositor", "--disable-dbus",
+            env=self.env(), stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+
+        async def devtools_ready():
+            try:
+                _, writer = await asyncio.open_connection("localhost", self.devtools_port)
+            except OSError:
+                return False
+            writer.close()
+            return True
+
+        await _wait_until(devtools_ready, STARTUP_TIMEOUT, f"Chromium on :{self.display_num}")
+
+    async def reset_browser(self):
+        """Restart Chromium with a fresh profile, leaving Xvfb up."""
+        await _stop_process(self._browser)
+        self._browser = None
+        if self.running:
+            await self._start_browser()
+
+    async def stop(self):
+        await _stop_process(self._browser)
+        await _stop_process(self._xvfb)
+        self._browser = self._xvfb = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'index': self.index,
+            'display': f":{self.display_num}",
+            'width': self.width,
+            'height': self.height,
+            'devtools_port': self.devtools_port,
+            'running': self.running,
+            'leased_by': self.leased_by,
+            'leased_at': self.leased_at,
+            'leases': self.leases,
+        }
+
+
+class DisplayPool:
+    """Fixed set of displays handed out one run at a time, started on first lease."""
+
+    def __init__(self, size: Optional[int] = None, width: Optional[int] = None, height: Optional[int] = None):
+        self.size = size if size is not None else int(os.getenv('TILT_DISPLAY_POOL_SIZE', '0'))
+        width = width or int(os.getenv('WIDTH') or 1024)
+        height = height or int(os.getenv('HEIGHT') or 768)
+        self.displays: List[Display] = [
+            Display(
+                index=index,
+                display_num=BASE_DISPLAY_NUM + index,
+                width=width,
+                height=height,
+                devtools_port=BASE_DEVTOOLS_PORT + index,
+            )
+            for index in range(self.size)
+        ]
+        # Created on first use so it binds to the running event loop
+        self._free: Optional[asyncio.Queue] = None
+        # Recycle tasks in flight; the loop only keeps weak references to tasks
+        self._recycling: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def _free_displays(self) -> asyncio.Queue:
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for display in self.displays:
+                self._free.put_nowait(display)
+        return self._free
+
+    @asynccontextmanager
+    async def lease(self, owner: str) -> AsyncIterator[Optional[Display]]:
+        """
+        Hold a display for the duration of a run and make it the `current_display`.
+        Yields None when the pool is disabled, leaving tools on the shared desktop.
+        """
+        if not self.enabled:
+            yield None
+            return
+        free = self._free_displays()
+        try:
+            display = await asyncio.wait_for(free.get(), timeout=LEASE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"No free display after {LEASE_TIMEOUT:.0f}s, all {self.size} are leased") from None
+        try:
+            await display.start()
+        except BaseException:
+            free.put_nowait(display)
+            raise
+        display.leased_by = owner
+        display.leased_at = time.time()
+        display.leases += 1
+        logger.info(f"Leased display :{display.display_num} to {owner}")
+        token = current_display.set(display)
+        try:
+            yield display
+        finally:
+            current_display.reset(token)
+            display.leased_by = display.leased_at = None
+            # Recycled in the background so a cancelled run still returns its display
+            task = asyncio.create_task(self._recycle(display), name=f"recycle-display:{display.display_num}")
+            self._recycling.add(task)
+            task.add_done_callback(self._recycling.discard)
+
+    async def _recycle(self, display: Display):
+        try:
+            await display.reset_browser()
+        except Exception as e:
+            logger.warning(f"Could not reset the browser on display :{display.display_num}: {e}")
+            await display.stop()
+        finally:
+            self._free_displays().put_nowait(display)
+
+    async def shutdown(self):
+        for display in self.displays:
+            await display.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': self.size,
+            'free': self._free.qsize() if self._free is not None else self.size,
+            'displays': [display.to_dict() for display in self.displays],
+        }
+
+
+# Global pool shared by the chat routes and the task runner in this process
+display_pool = DisplayPool()
@@ -0,0 +1,265 @@
+"""
+Low-overhead host resource sampling for step timings.
+
+A daemon thread reads /proc once per second for the API process, Chromium, the X
+server and MongoDB (CPU%, RSS, I/O bytes) plus host CPU and available memory. When a
+step finishes, one more sample closes its window, the samples taken during it are
+summarised onto its `StepTiming`, and the step is flagged when the host was saturated.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger('timing')
+
+SAMPLE_INTERVAL_SECONDS = 1.0
+# Samples kept (at one per second), enough for long steps
+MAX_SAMPLES = 1800
+# How often process lists are refreshed; Chromium spawns and reaps renderers constantly
+DISCOVERY_INTERVAL_SECONDS = 5.0
+
+# Process groups matched by /proc/<pid>/comm; the API process is always this process
+PROCESS_GROUPS: Dict[str, Tuple[str, ...]] = {
+    "chromium": ("chromium", "chrome", "chromium-browse"),
+    "xvfb": ("Xvfb", "Xorg"),
+    "mongodb": ("mongod",),
+}
+
+# Saturation thresholds
+HOST_CPU_SATURATED_PERCENT = 90.0
+MEMORY_AVAILABLE_LOW_PERCENT = 10.0
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+@dataclass
+class GroupSample:
+    cpu_percent: float
+    rss_bytes: int
+    read_bytes: int
+    write_bytes: int
+    processes: int
+
+
+@dataclass
+class HostSample:
+    timestamp: float
+    host_cpu_percent: float
+    memory_available_percent: float
+    groups: Dict[str, GroupSample]
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _process_counters(pid: int) -> Optional[Tuple[int, int, int, int]]:
+    """(cpu ticks, rss bytes, read bytes, write bytes) for one process, or None if it is gone."""
+    stat = _read(f"/proc/{pid}/stat")
+    statm = _read(f"/proc/{pid}/statm")
+    if not stat or not statm:
+        return None
+    # Fields after the parenthesised command name; utime and stime are fields 14 and 15
+    fields = stat.rsplit(")", 1)[1].split()
+    ticks = int(fields[11]) + int(fields[12])
+    rss = int(statm.split()[1]) * _PAGE_SIZE
+    read_bytes = write_bytes = 0
+    io = _read(f"/proc/{pid}/io")
+    if io:
+        for line in io.splitlines():
+            key, _, value = line.partition(":")
+            if key == "read_bytes":
+                read_bytes = int(value)
+            elif key == "write_bytes":
+                write_bytes = int(value)
+    return ticks, rss, read_bytes, write_bytes
+
+
+def _host_cpu_times() -> Optional[Tuple[int, int]]:
+    """(busy ticks, total ticks) across all CPUs."""
+    stat = _read("/proc/stat")
+    if not stat:
+        return None
+    values = [int(value) for value in stat.splitlines()[0].split()[1:]]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    return sum(values) - idle, sum(values)
+
+
+def _memory_available_percent() -> float:
+    meminfo = _read("/proc/meminfo") or ""
+    values = {}
+    for line in meminfo.splitlines():
+        key, _, rest = line.partition(":")
+        values[key] = int(rest.split()[0]) if rest.split() else 0
+    total = values.get("MemTotal")
+    return 100.0 * values.get("MemAvailable", 0) / total if total else 100.0
+
+
+class HostSampler:
+    """Samples /proc on a daemon thread and summarises windows of samples for steps."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.available = os.path.exists("/proc/self/stat")
+        self._lock = threading.Lock()
+        # Serialises sample(), which the thread and step ends both call; it updates the deltas
+        self._sample_lock = threading.Lock()
+        self._samples: Deque[HostSample] = deque(maxlen=MAX_SAMPLES)
+        self._thread: Optional[threading.Thread] = None
+        self._pids: Dict[str, List[int]] = {}
+        self._discovered_at = 0.0
+        self._previous: Dict[int, Tuple[int, int, int, int]] = {}
+        self._previous_host: Optional[Tuple[int, int]] = None
+        self._previous_time: Optional[float] = None
+
+    def ensure_started(self):
+        """Start sampling on first use; a no-op without /proc or with TILT_HOST_SAMPLING=0."""
+        if self._thread or not self.available or os.getenv('TILT_HOST_SAMPLING', '1') == '0':
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name="host-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._record()
+            time.sleep(self.interval)
+
+    def _record(self):
+        try:
+            with self._sample_lock:
+                sample = self.sample()
+        except Exception as e:
+            logger.debug(f"Host sampling failed: {e}")
+            return
+        if sample:
+            with self._lock:
+                self._samples.append(sample)
+
+    def _discover(self):
+        pids: Dict[str, List[int]] = {"api": [os.getpid()]}
+        pids.update({group: [] for group in PROCESS_GROUPS})
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            comm = (_read(f"/proc/{entry}/comm") or "").strip()
+            for group, names in PROCESS_GROUPS.items():
+                if comm in names:
+                    pids[group].append(int(entry))
+        self._pids = pids
+        self._discovered_at = time.perf_counter()
+
+    def sample(self) -> Optional[HostSample]:
+        """Take one sample; CPU% is relative to the previous call, so the first returns None."""
+        now = time.perf_counter()
+        if now - self._discovered_at >= DISCOVERY_INTERVAL_SECONDS:
+            self._discover()
+
+        counters: Dict[int, Tuple[int, int, int, int]] = {}
+        for pids in self._pids.values():
+            for pid in pids:
+                values = _process_counters(pid)
+                if values:
+                    counters[pid] = values
+        host = _host_cpu_times()
+
+        sample = None
+        if self._previous_time is not None and host and self._previous_host:
+            elapsed = now - self._previous_time
+            groups = {}
+            for group, pids in self._pids.items():
+                cpu_ticks = rss = read_bytes = write_bytes = alive = 0
+                for pid in pids:
+                    if pid not in counters:
+                        continue
+                    ticks, pid_rss, pid_read, pid_write = counters[pid]
+                    previous = self._previous.get(pid, (ticks, pid_rss, pid_read, pid_write))
+                    cpu_ticks += ticks - previous[0]
+                    read_bytes += max(0, pid_read - previous[2])
+                    write_bytes += max(0, pid_write - previous[3])
+                    rss += pid_rss
+                    alive += 1
+                groups[group] = GroupSample(
+                    # 100% is one fully used core, as in top
+                    cpu_percent=100.0 * cpu_ticks / _CLOCK_TICKS / elapsed if elapsed else 0.0,
+                    rss_bytes=rss,
+                    read_bytes=read_bytes,
+                    write_bytes=write_bytes,
+                    processes=alive,
+                )
+            busy = host[0] - self._previous_host[0]
+            total = host[1] - self._previous_host[1]
+            sample = HostSample(
+                timestamp=now,
+                host_cpu_percent=100.0 * busy / total if total else 0.0,
+                memory_available_percent=_memory_available_percent(),
+                groups=groups,
+            )
+
+        self._previous = counters
+        self._previous_host = host
+        self._previous_time = now
+        return sample
+
+    def summarize(self, start: float, end: float) -> Optional[Dict[str, Any]]:
+        """
+        Resource usage between two perf_counter() times: mean/max CPU%, peak RSS and I/O
+        per process group, plus whether the host was saturated. Short steps use the
+        sample that covers them.
+        """
+        if self._thread is not None and time.perf_counter() - end < self.interval:
+            # The interval since the last sample is not covered yet; close it now
+            self._record()
+        with self._lock:
+            samples = list(self._samples)
+        # A sample at time t covers the interval before it, so include the first one after `end`
+        window = [sample for sample in samples if start < sample.timestamp < end]
+        window += [sample for sample in samples if sample.timestamp >= end][:1]
+        if not window:
+            return None
+
+        groups = {}
+        for group in window[-1].groups:
+            group_samples = [sample.groups[group] for sample in window if group in sample.groups]
+            cpu = [group_sample.cpu_percent for group_sample in group_samples]
+            groups[group] = {
+                'cpu_percent_mean': round(sum(cpu) / len(cpu), 1),
+                'cpu_percent_max': round(max(cpu), 1),
+                'rss_bytes_max': max(group_sample.rss_bytes for group_sample in group_samples),
+                'read_bytes': sum(group_sample.read_bytes for group_sample in group_samples),
+                'write_bytes': sum(group_sample.write_bytes for group_sample in group_samples),
+                'processes': max(group_sample.processes for group_sample in group_samples)
+            }
+
+        host_cpu = [sample.host_cpu_percent for sample in window]
+        memory_available_min = min(sample.memory_available_percent for sample in window)
+        saturation = []
+        if max(host_cpu) >= HOST_CPU_SATURATED_PERCENT:
+            saturation.append("host_cpu")
+        if memory_available_min <= MEMORY_AVAILABLE_LOW_PERCENT:
+            saturation.append("memory")
+        return {
+            'samples': len(window),
+            'host_cpu_percent_mean': round(sum(host_cpu) / len(host_cpu), 1),
+            'host_cpu_percent_max': round(max(host_cpu), 1),
+            'memory_available_percent_min': round(memory_available_min, 1),
+            'saturated': bool(saturation),
+            'saturation': saturation,
+            'groups': groups
+        }
+
+
+# Global sampler shared by every collector in this process
+host_sampler = HostSampler()
@@ -0,0 +1,157 @@
+"""
+In-process delivery of user interrupts to running agent loops.
+
+`/agent/interrupt` publishes each message onto an asyncio queue keyed by test or
+session id, and the sampling loop that claimed the key drains its queue without
+blocking. Keys no loop in this process has claimed get no queue: their interrupts wait
+in MongoDB for the next run's backfill. MongoDB stays the durable record; a change stream covers the case where the API service
+and the loop that owns a test live in different processes.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from . import db
+from .notifications import notification_hub
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING_PER_KEY = 100
+SEEN_IDS_LIMIT = 1000
+
+
+@dataclass
+class Interrupt:
+    """A chat message sent by the user to a running agent."""
+    key: str
+    message: str
+    interrupt_id: Optional[str] = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class InterruptHub:
+    """Per-key queues of pending interrupts, shared by the routes and the loop."""
+
+    def __init__(self):
+        self._queues: Dict[str, asyncio.Queue] = {}
+        # Ids queued locally, so the change stream does not re-publish them
+        self._seen_ids: deque = deque(maxlen=SEEN_IDS_LIMIT)
+        # Ids already announced to notification subscribers
+        self._announced_ids: deque = deque(maxlen=SEEN_IDS_LIMIT)
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def claim(self, key: str):
+        """Start queueing interrupts for `key`; called by the loop that owns it."""
+        if key not in self._queues:
+            self._queues[key] = asyncio.Queue(maxsize=MAX_PENDING_PER_KEY)
+
+    def publish(self, interrupt: Interrupt) -> bool:
+        """
+        Queue an interrupt for the loop that claimed its key. Returns False for duplicates,
+        a full queue, or a key no loop in this process owns.
+        """
+        if interrupt.interrupt_id and interrupt.interrupt_id in self._seen_ids:
+            return False
+        self._announce(interrupt)
+        queue = self._queues.get(interrupt.key)
+        if queue is None:
+            return False
+        try:
+            queue.put_nowait(interrupt)
+        except asyncio.QueueFull:
+            logger.warning(f"Interrupt queue for {interrupt.key} is full, dropping message")
+            return False
+        # Marked only once queued, so a dropped interrupt can still come back through backfill
+        if interrupt.interrupt_id:
+            self._seen_ids.append(interrupt.interrupt_id)
+        return True
+
+    def _announce(self, interrupt: Interrupt):
+        if interrupt.interrupt_id:
+            if interrupt.interrupt_id in self._announced_ids:
+                return
+            self._announced_ids.append(interrupt.interrupt_id)
+        notification_hub.publish(
+            interrupt.key, "interrupt",
+            interrupt_id=interrupt.interrupt_id,
+            message=interrupt.message,
+            created_at=interrupt.created_at.isoformat(),
+        )
+
+    def drain(self, key: str) -> List[Interrupt]:
+        """Return every pending interrupt for a key without waiting."""
+        queue = self._queues.get(key)
+        if queue is None:
+            return []
+        interrupts = []
+        while True:
+            try:
+                interrupts.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return interrupts
+
+    def discard(self, key: str):
+        """
+        Forget the queue for a key once its run has finished. Interrupts still queued stay
+        unprocessed in MongoDB, so their ids are released for the next run's backfill.
+        """
+        queue = self._queues.pop(key, None)
+        if queue is None:
+            return
+        while not queue.empty():
+            interrupt = queue.get_nowait()
+            if interrupt.interrupt_id in self._seen_ids:
+                self._seen_ids.remove(interrupt.interrupt_id)
+
+    async def backfill(self, key: str):
+        """Load interrupts stored while no loop in this process owned the key."""
+        try:
+            documents = await db.find_unprocessed_interrupts(key)
+        except Exception as e:
+            logger.warning(f"Could not backfill interrupts for {key}: {e}")
+            return
+        for document in documents:
+            self.publish(_interrupt_from_document(document))
+
+    def watch_mongodb(self) -> asyncio.Task:
+        """
+        Publish interrupts inserted by other processes using a MongoDB change stream.
+        Must be called from the event loop; the stream is consumed by a background task.
+        """
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch(), name="interrupt-change-stream")
+        return self._watch_task
+
+    async def _watch(self):
+        try:
+            pipeline = [{"$match": {"operationType": "insert"}}]
+            async with db.get_database().interrupts.watch(pipeline) as stream:
+                async for change in stream:
+                    self.publish(_interrupt_from_document(change["fullDocument"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Change streams need a replica set; a standalone server only gets in-process delivery
+            logger.info(f"Interrupt change stream unavailable, using in-process delivery only: {e}")
+
+
+def _interrupt_from_document(document: Dict[str, Any]) -> Interrupt:
+    return Interrupt(
+        key=document["test_id"],
+        message=document["message"],
+        interrupt_id=str(document["_id"]),
+        created_at=document.get("created_at") or datetime.now(timezone.utc),
+    )
+
+
+async def mark_interrupts_processed(interrupt_ids: List[str]):
+    """Flag delivered interrupts as processed in MongoDB."""
+    await db.mark_interrupts_processed(interrupt_ids)
+
+
+# Global hub shared by the API routes and every sampling loop in this process
+interrupt_hub = InterruptHub()
@@ -2,19 +2,22 @@
 Agentic sampling loop that calls the Anthropic API and local implementation of anthropic-defined computer use tools.
 """
 
+import asyncio
 import logging
 import os
 import platform
-from collections.abc import Callable
+import time
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import StrEnum
-from typing import Any, cast
+from typing import Any, Literal, cast
 
 import httpx
 from anthropic import (
-    Anthropic,
-    AnthropicBedrock,
-    AnthropicVertex,
+    AsyncAnthropic,
+    AsyncAnthropicBedrock,
+    AsyncAnthropicVertex,
     APIError,
     APIResponseValidationError,
     APIStatusError,
@@ -37,7 +40,13 @@ from .tools import (
     ToolResult,
     ToolVersion,
 )
-from .timing_utils import timing_collector, time_operation
+from .displays import current_display, devtools_url
+from .interrupts import interrupt_hub, mark_interrupts_processed
+from .notifications import notification_hub
+from .routing import ModelRouter, ModelTier
+from .timing_utils import current_collector, time_operation
+from .metrics import observe_model_call
+from .tracing import span
 
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
 
@@ -48,6 +57,62 @@ class APIProvider(StrEnum):
     VERTEX = "vertex"
 
 
+@dataclass(frozen=True)
+class TextDelta:
+    """Assistant text, or a user interrupt echoed back into the conversation (`echo`)."""
+    text: str
+    echo: bool = False
+    type: Literal["text"] = "text"
+
+
+@dataclass(frozen=True)
+class ThinkingDelta:
+    """An extended thinking block from the assistant."""
+    block: dict[str, Any]
+    type: Literal["thinking"] = "thinking"
+
+
+@dataclass(frozen=True)
+class ToolUse:
+    """The assistant asked for a tool to be run."""
+    id: str
+    name: str
+    input: dict[str, Any]
+    type: Literal["tool_use"] = "tool_use"
+
+
+@dataclass(frozen=True)
+class ToolResultEvent:
+    """A tool finished running."""
+    tool_use_id: str
+    tool_name: str
+    result: ToolResult
+    type: Literal["tool_result"] = "tool_result"
+
+
+@dataclass(frozen=True)
+class Usage:
+    """Token usage reported for one model call."""
+    model: str
+    input_tokens: int
+    output_tokens: int
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    tier: str | None = None
+    latency: float | None = None
+    type: Literal["usage"] = "usage"
+
+
+@dataclass(frozen=True)
+class Done:
+    """The assistant finished without asking for more tools."""
+    messages: list[BetaMessageParam] = field(default_factory=list)
+    type: Literal["done"] = "done"
+
+
+LoopEvent = TextDelta | ThinkingDelta | ToolUse | ToolResultEvent | Usage | Done
+
+
 # This system prompt is optimized for the Docker environment in this repository and
 # specific tool combinations enabled.
 # We encourage modifying this system prompt to ensure the model has context for the
@@ -110,9 +175,69 @@ async def sampling_loop(
     tool_version: ToolVersion,
     thinking_budget: int | None = None,
     token_efficient_tools_beta: bool = False,
+    interrupt_key: str | None = None,
 ):
+    """
+    Callback-style wrapper around `sampling_events`, returning the final messages.
+    """
+    async for event in sampling_events(
+        model=model,
+        provider=provider,
+        system_prompt_suffix=system_prompt_suffix,
+        messages=messages,
+        api_response_callback=api_response_callback,
+        api_key=api_key,
+        only_n_most_recent_images=only_n_most_recent_images,
+        max_tokens=max_tokens,
+        tool_version=tool_version,
+        thinking_budget=thinking_budget,
+        token_efficient_tools_beta=token_efficient_tools_beta,
+        interrupt_key=interrupt_key,
+    ):
+        if isinstance(event, TextDelta):
+            output_callback({"type": "text", "text": event.text})
+        elif isinstance(event, ThinkingDelta):
+            output_callback(cast(BetaContentBlockParam, event.block))
+        elif isinstance(event, ToolUse):
+            output_callback({"type": "tool_use", "id": event.id, "name": event.name, "input": event.input})
+        elif isinstance(event, ToolResultEvent):
+            tool_output_callback(event.result, event.tool_use_id)
+        elif isinstance(event, Done):
+            # Keep iterating so the generator (and its spans) close in this task
+            messages = event.messages
+    return messages
+
+
+async def sampling_events(
+    *,
+    model: str,
+    provider: APIProvider,
+    system_prompt_suffix: str,
+    messages: list[BetaMessageParam],
+    api_key: str,
+    only_n_most_recent_images: int | None = None,
+    max_tokens: int = 4096,
+    tool_version: ToolVersion,
+    thinking_budget: int | None = None,
+    token_efficient_tools_beta: bool = False,
+    interrupt_key: str | None = None,
+    api_response_callback: Callable[
+        [httpx.Request, httpx.Response | object | None, Exception | None], None
+    ] | None = None,
+    tool_collection: ToolCollection | None = None,
+    router: ModelRouter | None = None,
+) -> AsyncIterator[LoopEvent]:
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+
+    Progress is yielded as typed events that the consumer pulls, so a slow consumer
+    pauses the loop instead of letting buffered output grow. The final event is
+    always `Done` carrying the full message list.
+
+    `interrupt_key` is the test or session id whose user interrupts this loop owns.
+    Pass `tool_collection` to keep tool state (bash session, network capture) warm
+    across several calls, and `router` to send each turn to a fast or strong model
+    instead of always using `model`.
     """
     # Setup tool logging
     os.makedirs('/home/tilt/logs', exist_ok=True)
@@ -122,6 +247,226 @@ async def sampling_loop(
     tool_logger.addHandler(tool_handler)
     tool_logger.setLevel(logging.INFO)
     
+    tool_group = TOOL_GROUPS_BY_VERSION[tool_version]
+    # Tools built here belong to this run and are closed with it; shared ones are the caller's
+    owns_tools = tool_collection is None
+    if tool_collection is None:
+        tool_collection = await prepare_tool_collection(tool_version)
+    
+    system_prompt = SYSTEM_PROMPT
+    if display := current_display.get():
+        # Runs on a pool display start GUI apps there, not on the shared desktop
+        system_prompt = system_prompt.replace("DISPLAY=:1", f"DISPLAY=:{display.display_num}")
+    system = BetaTextBlockParam(
+        type="text",
+        text=f"{system_prompt}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
+    )
+
+    if interrupt_key:
+        interrupt_hub.claim(interrupt_key)
+    try:
+        if interrupt_key:
+            # Pick up interrupts stored before this loop started listening
+            await interrupt_hub.backfill(interrupt_key)
+
+        turn_number = 0
+        while True:
+            turn_number += 1
+            with span("step", "step", turn=turn_number) as turn_span:
+                # Deliver any chat messages the user pushed for this run
+                try:
+                    chat_messages = await _check_for_chat_messages(interrupt_key)
+            
+                    if chat_messages:
+                        tool_logger.info(f"PROCESSING {len(chat_messages)} PENDING CHAT MESSAGES")
+                        # Add user messages to conversation
+                        for chat_msg in chat_messages:
+                            messages.append({
+                                "role": "user", 
+                                "content": chat_msg
+                            })
+                            tool_logger.info(f"ADDED USER CHAT MESSAGE: {chat_msg}")
+                    
+                            # Also echo it so it appears in the UI
+                            yield TextDelta(text=f"**User sent:** {chat_msg}", echo=True)
+                except Exception as e:
+                    tool_logger.error(f"Error checking chat messages: {e}")
+        
+                enable_prompt_caching = False
+                betas = [tool_group.beta_flag] if tool_group.beta_flag else []
+                if token_efficient_tools_beta:
+                    betas.append("token-efficient-tools-2025-02-19")
+                image_truncation_threshold = only_n_most_recent_images or 0
+                if provider == APIProvider.ANTHROPIC:
+                    client = AsyncAnthropic(api_key=api_key, max_retries=4)
+                    enable_prompt_caching = True
+                elif provider == APIProvider.VERTEX:
+                    client = AsyncAnthropicVertex()
+                elif provider == APIProvider.BEDROCK:
+                    client = AsyncAnthropicBedrock()
+
+                if enable_prompt_caching:
+                    betas.append(PROMPT_CACHING_BETA_FLAG)
+                    _inject_prompt_caching(messages)
+                    # Because cached reads are 10% of the price, we don't think it's
+                    # ever sensible to break the cache by truncating images
+                    only_n_most_recent_images = 0
+                    # Use type ignore to bypass TypedDict check until SDK types are updated
+                    system["cache_control"] = {"type": "ephemeral"}  # type: ignore
+
+                if only_n_most_recent_images:
+                    _maybe_filter_to_n_most_recent_images(
+                        messages,
+                        only_n_most_recent_images,
+                        min_removal_threshold=image_truncation_threshold,
+                    )
+                tier = router.choose(messages) if router else None
+                turn_model = router.model_for(tier) if router else model
+
+                extra_body = {}
+                if thinking_budget and tier != ModelTier.FAST:
+                    # Ensure we only send the required fields for thinking
+                    extra_body = {
+                        "thinking": {"type": "enabled", "budget_tokens": thinking_budget}
+                    }
+
+                # Call the API
+                # we use raw_response to provide debug information. Your
+                # implementation may be able call the SDK directly with:
+                # `response = client.messages.create(...)` instead.
+                call_started = time.perf_counter()
+                try:
+                    with time_operation(current_collector(), "anthropic_call", model=turn_model, tier=tier.value if tier else None):
+                        raw_response = await client.beta.messages.with_raw_response.create(
+                            max_tokens=max_tokens,
+                            messages=messages,
+                            model=turn_model,
+                            system=[system],
+                            tools=tool_collection.to_params(),
+                            betas=betas,
+                            extra_body=extra_body,
+                        )
+                except (APIStatusError, APIResponseValidationError) as e:
+                    if api_response_callback:
+                        api_response_callback(e.request, e.response, e)
+                    raise Exception(f"Anthropic API error: {e.status_code} - {e.message}")
+                except APIError as e:
+                    if api_response_callback:
+                        api_response_callback(e.request, e.body, e)
+                    raise Exception(f"Anthropic API error: {str(e)}")
+
+                if api_response_callback:
+                    api_response_callback(
+                        raw_response.http_response.request, raw_response.http_response, None
+                    )
+
+                with time_operation(current_collector(), "anthropic_response"):
+                    response = await raw_response.parse()
+
+                call_latency = time.perf_counter() - call_started
+                turn_span.set_attribute("model", turn_model)
+                turn_span.set_attribute("input_tokens", response.usage.input_tokens)
+                turn_span.set_attribute("output_tokens", response.usage.output_tokens)
+                if router:
+                    router.record(tier, call_latency, response.usage.input_tokens, response.usage.output_tokens)
+                usage = Usage(
+                    model=turn_model,
+                    input_tokens=response.usage.input_tokens,
+                    output_tokens=response.usage.output_tokens,
+                    cache_creation_input_tokens=getattr(response.usage, "cache_creation_input_tokens", None) or 0,
+                    cache_read_input_tokens=getattr(response.usage, "cache_read_input_tokens", None) or 0,
+                    tier=tier.value if tier else None,
+                    latency=call_latency,
+                )
+                observe_model_call(
+                    usage.model,
+                    usage.tier,
+                    call_latency,
+                    usage.input_tokens,
+                    usage.output_tokens,
+                    usage.cache_creation_input_tokens,
+                    usage.cache_read_input_tokens,
+                )
+                yield usage
+
+                response_params = _response_to_params(response)
+                messages.append(
+                    {
+                        "role": "assistant",
+                        "content": response_params,
+                    }
+                )
+
+                tool_result_content: list[BetaToolResultBlockParam] = []
+                turn_results: list[ToolResult] = []
+                for content_block in response_params:
+                    if content_block["type"] == "text":
+                        yield TextDelta(text=content_block["text"])
+                    elif content_block["type"] == "thinking":
+                        yield ThinkingDelta(block=cast(dict[str, Any], content_block))
+                    elif content_block["type"] == "tool_use":
+                        tool_name = content_block["name"]
+                        tool_input = cast(dict[str, Any], content_block["input"])
+                        tool_id = content_block["id"]
+                        yield ToolUse(id=tool_id, name=tool_name, input=tool_input)
+                
+                        # Log tool execution start
+                        tool_logger.info(f"TOOL CALL START - Tool: {tool_name}, ID: {tool_id}")
+                        tool_logger.info(f"Tool Input: {tool_input}")
+                
+                        try:
+                            with time_operation(current_collector(), f"tool_{tool_name}", tool_name=tool_name):
+                                result = await tool_collection.run(
+                                    name=tool_name,
+                                    tool_input=tool_input,
+                                )
+                    
+                            # Log tool execution result
+                            tool_logger.info(f"TOOL CALL SUCCESS - Tool: {tool_name}, ID: {tool_id}")
+                            if result.output:
+                                tool_logger.info(f"Tool Output: {result.output}")
+                            if result.error:
+                                tool_logger.error(f"Tool Error: {result.error}")
+                            if hasattr(result, 'base64_image') and result.base64_image:
+                                tool_logger.info(f"Tool returned image data (base64 length: {len(result.base64_image)})")
+                        
+                        except Exception as e:
+                            tool_logger.error(f"TOOL CALL EXCEPTION - Tool: {tool_name}, ID: {tool_id}, Exception: {str(e)}")
+                            raise
+                
+                        tool_result_content.append(
+                            _make_api_tool_result(result, content_block["id"])
+                        )
+                        turn_results.append(result)
+                        yield ToolResultEvent(tool_use_id=tool_id, tool_name=tool_name, result=result)
+
+                if router:
+                    router.observe(
+                        assistant_text=" ".join(block["text"] for block in response_params if block["type"] == "text"),
+                        tool_calls=[(block["name"], cast(dict[str, Any], block["input"])) for block in response_params if block["type"] == "tool_use"],
+                        tool_results=turn_results,
+                    )
+
+                if not tool_result_content:
+                    yield Done(messages=messages)
+                    return
+
+                messages.append({"content": tool_result_content, "role": "user"})
+    finally:
+        if interrupt_key:
+            # Also on errors and cancellation; anything still queued stays unprocessed
+            # in MongoDB for the next run
+            interrupt_hub.discard(interrupt_key)
+        if owns_tools:
+            await asyncio.to_thread(tool_collection.close)
+
+
+async def prepare_tool_collection(tool_version: ToolVersion) -> ToolCollection:
+    """
+    Build the tools for a run, wire up cross-tool references and start network monitoring.
+    Callers that run several conversations on one desktop can build this once and reuse it.
+    """
+    tool_logger = logging.getLogger('tools')
     tool_group = TOOL_GROUPS_BY_VERSION[tool_version]
     tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
     
@@ -144,7 +489,7 @@ async def sampling_loop(
             # Check if Chrome is running with remote debugging
             def check_chrome_debugging():
                 try:
-                    result = subprocess.run(['curl', '-s', 'http://localhost:9222/json'], 
+                    result = subprocess.run(['curl', '-s', f'{devtools_url()}/json'], 
                                           capture_output=True, timeout=2)
                     return result.returncode == 0
                 except:
@@ -171,152 +516,8 @@ async def sampling_loop(
                 
         except Exception as e:
             tool_logger.warning(f"Exception during network monitoring auto-start: {str(e)}")
-    
-    system = BetaTextBlockParam(
-        type="text",
-        text=f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
-    )
-
-    while True:
-        # Check for pending chat messages from user
-        try:
-            tool_logger.info("Checking for pending chat messages...")
-            chat_messages = await _check_for_chat_messages()
-            tool_logger.info(f"Chat message check completed. Found: {len(chat_messages) if chat_messages else 0} messages")
-            
-            if chat_messages:
-                tool_logger.info(f"PROCESSING {len(chat_messages)} PENDING CHAT MESSAGES")
-                # Add user messages to conversation
-                for chat_msg in chat_messages:
-                    messages.append({
-                        "role": "user", 
-                        "content": chat_msg
-                    })
-                    tool_logger.info(f"ADDED USER CHAT MESSAGE: {chat_msg}")
-                    print(f"[CHAT] User message added to conversation: {chat_msg}")
-                    
-                    # Also send to output callback so it appears in the UI
-                    output_callback({
-                        "type": "text",
-                        "text": f"**User sent:** {chat_msg}"
-                    })
-        except Exception as e:
-            tool_logger.error(f"Error checking chat messages: {e}")
-            print(f"[CHAT ERROR] {e}")
-        
-        enable_prompt_caching = False
-        betas = [tool_group.beta_flag] if tool_group.beta_flag else []
-        if token_efficient_tools_beta:
-            betas.append("token-efficient-tools-2025-02-19")
-        image_truncation_threshold = only_n_most_recent_images or 0
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key, max_retries=4)
-            enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
-
-        if enable_prompt_caching:
-            betas.append(PROMPT_CACHING_BETA_FLAG)
-            _inject_prompt_caching(messages)
-            # Because cached reads are 10% of the price, we don't think it's
-            # ever sensible to break the cache by truncating images
-            only_n_most_recent_images = 0
-            # Use type ignore to bypass TypedDict check until SDK types are updated
-            system["cache_control"] = {"type": "ephemeral"}  # type: ignore
-
-        if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(
-                messages,
-                only_n_most_recent_images,
-                min_removal_threshold=image_truncation_threshold,
-            )
-        extra_body = {}
-        if thinking_budget:
-            # Ensure we only send the required fields for thinking
-            extra_body = {
-                "thinking": {"type": "enabled", "budget_tokens": thinking_budget}
-            }
-
-        # Call the API
-        # we use raw_response to provide debug information. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        try:
-            with time_operation(timing_collector, "anthropic_call"):
-                raw_response = client.beta.messages.with_raw_response.create(
-                    max_tokens=max_tokens,
-                    messages=messages,
-                    model=model,
-                    system=[system],
-                    tools=tool_collection.to_params(),
-                    betas=betas,
-                    extra_body=extra_body,
-                )
-        except (APIStatusError, APIResponseValidationError) as e:
-            api_response_callback(e.request, e.response, e)
-            raise Exception(f"Anthropic API error: {e.status_code} - {e.message}")
-        except APIError as e:
-            api_response_callback(e.request, e.body, e)
-            raise Exception(f"Anthropic API error: {str(e)}")
-
-        api_response_callback(
-            raw_response.http_response.request, raw_response.http_response, None
-        )
-
-        with time_operation(timing_collector, "anthropic_response"):
-            response = raw_response.parse()
-
-        response_params = _response_to_params(response)
-        messages.append(
-            {
-                "role": "assistant",
-                "content": response_params,
-            }
-        )
-
-        tool_result_content: list[BetaToolResultBlockParam] = []
-        for content_block in response_params:
-            output_callback(content_block)
-            if content_block["type"] == "tool_use":
-                tool_name = content_block["name"]
-                tool_input = cast(dict[str, Any], content_block["input"])
-                tool_id = content_block["id"]
-                
-                # Log tool execution start
-                tool_logger.info(f"TOOL CALL START - Tool: {tool_name}, ID: {tool_id}")
-                tool_logger.info(f"Tool Input: {tool_input}")
-                
-                try:
-                    with time_operation(timing_collector, f"tool_{tool_name}", tool_name=tool_name):
-                        result = await tool_collection.run(
-                            name=tool_name,
-                            tool_input=tool_input,
-                        )
-                    
-                    # Log tool execution result
-                    tool_logger.info(f"TOOL CALL SUCCESS - Tool: {tool_name}, ID: {tool_id}")
-                    if result.output:
-                        tool_logger.info(f"Tool Output: {result.output}")
-                    if result.error:
-                        tool_logger.error(f"Tool Error: {result.error}")
-                    if hasattr(result, 'base64_image') and result.base64_image:
-                        tool_logger.info(f"Tool returned image data (base64 length: {len(result.base64_image)})")
-                        
-                except Exception as e:
-                    tool_logger.error(f"TOOL CALL EXCEPTION - Tool: {tool_name}, ID: {tool_id}, Exception: {str(e)}")
-                    raise
-                
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block["id"])
-                )
-                tool_output_callback(result, content_block["id"])
 
-        if not tool_result_content:
-            return messages
-
-        messages.append({"content": tool_result_content, "role": "user"})
+    return tool_collection
 
 
 def _maybe_filter_to_n_most_recent_images(
@@ -458,50 +659,25 @@ def _maybe_prepend_system_tool_result(result: ToolResult, result_text: str):
     return result_text
 
 
-async def _check_for_chat_messages():
-    """Check for pending chat messages from user and return them"""
-    try:
-        from pymongo import MongoClient
-        
-        print("[CHAT DEBUG] Connecting to MongoDB...")
-        # Connect to MongoDB
-        client = MongoClient("mongodb://localhost:27017/")
-        db = client.tilt
-        interrupts_collection = db.interrupts
-        print("[CHAT DEBUG] Connected to MongoDB successfully")
-        
-        # Get ALL unprocessed messages (since we don't have test ID context here yet)
-        # This is simple but works - we'll process any pending chat messages
-        print("[CHAT DEBUG] Querying for unprocessed messages...")
-        messages = list(interrupts_collection.find({
-            "processed": False
-        }).sort("created_at", 1))
-        
-        print(f"[CHAT DEBUG] Found {len(messages)} total unprocessed messages in database")
-        
-        if not messages:
-            print("[CHAT DEBUG] No pending messages found")
-            return []
-        
-        for i, msg in enumerate(messages):
-            print(f"[CHAT DEBUG] Message {i+1}: test_id={msg.get('test_id')}, message='{msg.get('message')}', processed={msg.get('processed')}")
-        
-        print(f"[CHAT DEBUG] Marking {len(messages)} messages as processed")
-        
-        # Mark messages as processed
-        message_ids = [msg["_id"] for msg in messages]
-        interrupts_collection.update_many(
-            {"_id": {"$in": message_ids}},
-            {"$set": {"processed": True}}
-        )
-        
-        # Return just the message text
-        result = [msg["message"] for msg in messages]
-        print(f"[CHAT DEBUG] Returning {len(result)} messages: {result}")
-        return result
-        
-    except Exception as e:
-        print(f"[CHAT DEBUG] Error checking for chat messages: {e}")
-        import traceback
-        traceback.print_exc()
+async def _check_for_chat_messages(interrupt_key: str | None) -> list[str]:
+    """Drain pending chat messages for this run from the interrupt hub without blocking."""
+    if not interrupt_key:
         return []
+
+    interrupts = interrupt_hub.drain(interrupt_key)
+    if not interrupts:
+        return []
+    for interrupt in interrupts:
+        notification_hub.publish(
+            interrupt_key, "interrupt_delivered", relay_id=interrupt.interrupt_id,
+            interrupt_id=interrupt.interrupt_id, message=interrupt.message,
+        )
+
+    delivered_ids = [interrupt.interrupt_id for interrupt in interrupts if interrupt.interrupt_id]
+    if delivered_ids:
+        try:
+            await mark_interrupts_processed(delivered_ids)
+        except Exception as e:
+            logging.getLogger('tools').warning(f"Failed to mark interrupts processed: {e}")
+
+    return [interrupt.message for interrupt in interrupts]
@@ -0,0 +1,176 @@
+"""
+Prometheus metrics for the agent loop, tools and API service.
+
+Everything registers on the default registry, which `/metrics` exposes in the text
+format so a local Prometheus can scrape each container.
+"""
+
+import time
+import weakref
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from .tracing import current_span, span
+
+# Latency buckets (seconds) spanning fast tool calls to slow model turns
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# PNG screenshot sizes (bytes)
+SCREENSHOT_BYTES_BUCKETS = (50_000, 100_000, 250_000, 500_000, 1_000_000, 2_000_000, 4_000_000, 8_000_000)
+
+STEPS = Counter(
+    "tilt_agent_steps_total",
+    "Completed agent steps",
+    ["outcome"],
+)
+STEP_DURATION = Histogram(
+    "tilt_agent_step_duration_seconds",
+    "Wall time of an agent step",
+    buckets=LATENCY_BUCKETS,
+)
+TOOL_CALLS = Counter(
+    "tilt_tool_calls_total",
+    "Tool calls by tool name and outcome",
+    ["tool", "outcome"],
+)
+TOOL_DURATION = Histogram(
+    "tilt_tool_duration_seconds",
+    "Tool call latency",
+    ["tool"],
+    buckets=LATENCY_BUCKETS,
+)
+SCREENSHOT_DURATION = Histogram(
+    "tilt_screenshot_duration_seconds",
+    "Time to capture, scale and encode a screenshot",
+    buckets=LATENCY_BUCKETS,
+)
+SCREENSHOT_BYTES = Histogram(
+    "tilt_screenshot_bytes",
+    "Size of captured screenshots before base64 encoding",
+    buckets=SCREENSHOT_BYTES_BUCKETS,
+)
+MODEL_LATENCY = Histogram(
+    "tilt_model_latency_seconds",
+    "Messages API call latency",
+    ["model", "tier"],
+    buckets=LATENCY_BUCKETS,
+)
+MODEL_TOKENS = Counter(
+    "tilt_model_tokens_total",
+    "Tokens used by Messages API calls",
+    ["model", "kind"],
+)
+SSE_CLIENTS = Gauge(
+    "tilt_sse_clients",
+    "Connected chat stream clients",
+)
+WS_CLIENTS = Gauge(
+    "tilt_ws_clients",
+    "Connected chat WebSocket clients",
+)
+SSE_QUEUE_DEPTH = Gauge(
+    "tilt_sse_queue_depth",
+    "Events buffered for chat stream clients, summed over streams",
+)
+SSE_EVENTS_COALESCED = Counter(
+    "tilt_sse_events_coalesced_total",
+    "Stream events merged into a queued one or stripped of a superseded screenshot",
+    ["type"],
+)
+SSE_EVENTS_DROPPED = Counter(
+    "tilt_sse_events_dropped_total",
+    "Stream events dropped because the client stopped reading",
+    ["type"],
+)
+# Live chat stream queues (anything with qsize()); the depth gauge sums them at scrape time
+_sse_queues: "weakref.WeakSet" = weakref.WeakSet()
+SSE_QUEUE_DEPTH.set_function(lambda: sum(queue.qsize() for queue in list(_sse_queues)))
+
+MONGODB_OP_DURATION = Histogram(
+    "tilt_mongodb_op_duration_seconds",
+    "MongoDB operation latency",
+    ["collection", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+MONGODB_OP_ERRORS = Counter(
+    "tilt_mongodb_op_errors_total",
+    "Failed MongoDB operations",
+    ["collection", "operation"],
+)
+HTTP_REQUESTS = Counter(
+    "tilt_http_requests_total",
+    "API requests by route and status code",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "tilt_http_request_duration_seconds",
+    "API request latency until the response starts",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def track_sse_queue(queue):
+    """Include a stream's outbound queue in tilt_sse_queue_depth until it is garbage collected."""
+    _sse_queues.add(queue)
+
+
+def observe_step(duration: float, error_occurred: bool):
+    STEPS.labels(outcome="error" if error_occurred else "ok").inc()
+    STEP_DURATION.observe(duration)
+
+
+def observe_tool_call(tool_name: str, duration: float, outcome: str):
+    """`outcome` is 'ok', 'error' (the tool reported an error) or 'exception'."""
+    TOOL_CALLS.labels(tool=tool_name, outcome=outcome).inc()
+    TOOL_DURATION.labels(tool=tool_name).observe(duration)
+
+
+def observe_screenshot(size_bytes: int):
+    SCREENSHOT_BYTES.observe(size_bytes)
+
+
+def observe_model_call(
+    model: str,
+    tier: Optional[str],
+    latency: float,
+    input_tokens: int,
+    output_tokens: int,
+    cache_creation_input_tokens: int = 0,
+    cache_read_input_tokens: int = 0,
+):
+    MODEL_LATENCY.labels(model=model, tier=tier or "default").observe(latency)
+    for kind, tokens in (
+        ("input", input_tokens),
+        ("output", output_tokens),
+        ("cache_creation_input", cache_creation_input_tokens),
+        ("cache_read_input", cache_read_input_tokens),
+    ):
+        if tokens:
+            MODEL_TOKENS.labels(model=model, kind=kind).inc(tokens)
+
+
+@contextmanager
+def time_mongodb(collection: str, operation: str):
+    """
+    Time a MongoDB operation as a latency histogram sample, and as a span when it runs
+    inside a traced run. Calls outside a run (polling, routes, the telemetry writer) would
+    otherwise each start a trace of their own.
+    """
+    start_time = time.perf_counter()
+    traced = current_span() is not None
+    try:
+        with span(f"mongodb.{operation}", "mongodb", collection=collection) if traced else nullcontext():
+            yield
+    except Exception:
+        MONGODB_OP_ERRORS.labels(collection=collection, operation=operation).inc()
+        raise
+    finally:
+        MONGODB_OP_DURATION.labels(collection=collection, operation=operation).observe(time.perf_counter() - start_time)
+
+
+def render_latest() -> tuple[bytes, str]:
+    """Current metrics in the Prometheus text exposition format, with its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,129 @@
+"""
+Push notifications per test id for UIs watching a run.
+
+`NotificationHub` fans events out to every subscriber of a test id: interrupts as they
+are queued, acknowledgements when the loop picks them up, and run status changes. The
+events are raised in-process by the interrupt hub, the sampling loop, the chat routes and
+the task runner. With several API workers, a MongoDB change stream on interrupts and
+tasks relays acknowledgements and status changes made by other processes.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING_PER_SUBSCRIBER = 100
+RECENT_EVENTS_LIMIT = 1000
+
+
+class NotificationHub:
+    """Bounded per-subscriber queues of notification dicts, keyed by test id."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        # Events raised here, so the change stream does not relay them a second time
+        self._recent: deque = deque(maxlen=RECENT_EVENTS_LIMIT)
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def subscribe(self, key: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=MAX_PENDING_PER_SUBSCRIBER)
+        self._subscribers.setdefault(key, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, key: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(key)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[key]
+
+    def subscriber_count(self, key: Optional[str] = None) -> int:
+        if key is not None:
+            return len(self._subscribers.get(key, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, key: Optional[str], event_type: str, relay_id: Optional[str] = None, **fields: Any):
+        """
+        Send an event to the key's subscribers. Never blocks; a full subscriber loses its
+        oldest event. `relay_id` identifies the same change when the stream reports it.
+        """
+        if not key:
+            return
+        if relay_id and self._watching():
+            self._recent.append((event_type, relay_id))
+        self._send(key, {"type": event_type, **fields})
+
+    def publish_status(self, key: Optional[str], status: str, task: bool = False, **fields: Any):
+        """
+        A run for `key` changed state. `task` marks a stored task's status, which the change
+        stream reports too; chat run statuses are never stored, so they carry no relay marker.
+        """
+        relay_id = f"{key}:{status}" if task else None
+        self.publish(key, "status", relay_id=relay_id, status=status, **fields)
+
+    def _send(self, key: str, event: Dict[str, Any]):
+        subscribers = self._subscribers.get(key)
+        if not subscribers:
+            return
+        event = {**event, "test_id": key, "timestamp": datetime.now(timezone.utc).isoformat()}
+        for queue in list(subscribers):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def _watching(self) -> bool:
+        return self._watch_task is not None and not self._watch_task.done()
+
+    def watch_mongodb(self) -> asyncio.Task:
+        """
+        Relay acknowledgements and task status changes written by other processes.
+        Must be called from the event loop; the stream is consumed by a background task.
+        """
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch(), name="notification-change-stream")
+        return self._watch_task
+
+    async def _watch(self):
+        pipeline = [{"$match": {
+            "operationType": "update",
+            "ns.coll": {"$in": ["interrupts", "tasks"]},
+        }}]
+        try:
+            async with db.get_database().watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    self._relay(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Change streams need a replica set; a standalone server only gets in-process events
+            logger.info(f"Notification change stream unavailable, using in-process events only: {e}")
+
+    def _relay(self, change: Dict[str, Any]):
+        updated = change.get("updateDescription", {}).get("updatedFields", {})
+        document = change.get("fullDocument") or {}
+        document_id = str(change["documentKey"]["_id"])
+        if change["ns"]["coll"] == "interrupts" and updated.get("processed") is True:
+            self._relay_event(document.get("test_id"), "interrupt_delivered", document_id, interrupt_id=document_id)
+        elif change["ns"]["coll"] == "tasks" and "status" in updated:
+            status = updated["status"]
+            self._relay_event(document_id, "status", f"{document_id}:{status}", status=status)
+
+    def _relay_event(self, key: Optional[str], event_type: str, relay_id: str, **fields: Any):
+        marker = (event_type, relay_id)
+        if marker in self._recent:
+            # Already sent when this process made the change
+            self._recent.remove(marker)
+            return
+        if key:
+            self._send(key, {"type": event_type, **fields})
+
+
+# Global hub shared by the routes, the sampling loop and the task runner in this process
+notification_hub = NotificationHub()
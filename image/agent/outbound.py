@@ -0,0 +1,120 @@
+"""
+Per-client outbound buffer for chat streams.
+
+Events wait here between the sampling loop and a client's connection. The buffer holds
+a bounded number of events and keeps them small for slow clients instead of only
+pausing the loop: once it is full, consecutive assistant text blocks merge into one
+event (as separate paragraphs), and of the screenshots still waiting only the newest
+keeps its image. When a client stops reading altogether
+the loop waits up to TILT_SSE_STALL_SECONDS for room, then drops events until the client
+catches up. `done` and `error` events are always delivered.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_EVENTS = 16
+# Idle time before a keepalive comment keeps proxies from closing the stream
+KEEPALIVE_SECONDS = float(os.getenv('TILT_SSE_KEEPALIVE_SECONDS', '15'))
+STALL_SECONDS = float(os.getenv('TILT_SSE_STALL_SECONDS', '60'))
+# Event types that are never dropped, merged or held back by a full buffer
+ESSENTIAL_TYPES = frozenset({"done", "error"})
+
+
+class OutboundBuffer:
+    """Bounded, coalescing queue of event payloads for one stream client."""
+
+    def __init__(self, max_events: int = DEFAULT_MAX_EVENTS, stall_seconds: Optional[float] = None):
+        self.max_events = max_events
+        self.stall_seconds = STALL_SECONDS if stall_seconds is None else stall_seconds
+        self.coalesced = 0
+        self.dropped = 0
+        self._events: Deque[Dict[str, Any]] = deque()
+        self._closed = False
+        # Set after a put gave up waiting; cleared when the client reads again
+        self._stalled = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def qsize(self) -> int:
+        return len(self._events)
+
+    async def put(self, event: Dict[str, Any]):
+        """Queue an event, waiting for room (or dropping it) when the client is behind."""
+        essential = event.get("type") in ESSENTIAL_TYPES
+        if event.get("base64_image") and len(self._events) >= self.max_events:
+            self._drop_pending_images()
+        while True:
+            if essential or len(self._events) < self.max_events:
+                break
+            # Only a client that has fallen behind gets text blocks merged
+            if self._merge(event):
+                return
+            if self._stalled:
+                self._drop(event)
+                return
+            self._writable.clear()
+            try:
+                await asyncio.wait_for(self._writable.wait(), self.stall_seconds)
+            except asyncio.TimeoutError:
+                logger.warning(f"Stream client has not read for {self.stall_seconds:.0f}s, dropping events")
+                self._stalled = True
+                self._drop(event)
+                return
+        self._events.append(event)
+        self._readable.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Next event, or None once the buffer is closed and empty. Raises asyncio.TimeoutError."""
+        while not self._events:
+            if self._closed:
+                return None
+            self._readable.clear()
+            await asyncio.wait_for(self._readable.wait(), timeout)
+        event = self._events.popleft()
+        self._stalled = False
+        self._writable.set()
+        return event
+
+    def close(self):
+        """No more events; readers get None after draining what is queued."""
+        self._closed = True
+        self._readable.set()
+
+    def _merge(self, event: Dict[str, Any]) -> bool:
+        """Append a text block to the text block still waiting at the tail, as a new paragraph."""
+        if event.get("type") != "message" or not self._events:
+            return False
+        last = self._events[-1]
+        if last.get("type") != "message" or last.get("role") != event.get("role"):
+            return False
+        # Interrupt echoes are the user's words and stay separate from assistant text
+        if last.get("echo") or event.get("echo"):
+            return False
+        if not isinstance(last.get("content"), str) or not isinstance(event.get("content"), str):
+            return False
+        last["content"] += "\n\n" + event["content"]
+        self.coalesced += 1
+        metrics.SSE_EVENTS_COALESCED.labels(type="message").inc()
+        return True
+
+    def _drop_pending_images(self):
+        """A newer screenshot is coming; older unsent ones keep their text but lose the image."""
+        for pending in self._events:
+            if pending.get("base64_image"):
+                pending["base64_image"] = None
+                pending["image_dropped"] = True
+                self.coalesced += 1
+                metrics.SSE_EVENTS_COALESCED.labels(type="screenshot").inc()
+
+    def _drop(self, event: Dict[str, Any]):
+        self.dropped += 1
+        metrics.SSE_EVENTS_DROPPED.labels(type=event.get("type", "unknown")).inc()
@@ -0,0 +1,193 @@
+"""
+On-demand sampling profiler for the API process.
+
+A background thread samples the stacks of every thread with `sys._current_frames()`
+for a fixed duration, so it sees the event loop, `asyncio.to_thread` workers and the
+change-stream/telemetry threads without instrumenting them. Results export as
+speedscope JSON or as a pstats file (`python -m pstats profile.pstats`).
+"""
+
+import asyncio
+import marshal
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_INTERVAL = 0.01
+MAX_DURATION_SECONDS = 120
+# Deepest stack recorded per sample, innermost frames kept
+MAX_STACK_DEPTH = 256
+
+# (filename, first line, function name), the same key pstats uses
+FrameKey = Tuple[str, int, str]
+
+# Prefix of asyncio task names that carry a run id, e.g. "run:3f2a..."
+RUN_TASK_PREFIXES = ("run:", "stream:")
+
+
+@contextmanager
+def name_current_task(label: str):
+    """Rename the running asyncio task for the duration, so profiles can be filtered by run."""
+    task = asyncio.current_task()
+    if task is None:
+        yield
+        return
+    previous = task.get_name()
+    task.set_name(label)
+    try:
+        yield
+    finally:
+        task.set_name(previous)
+
+
+@dataclass
+class Profile:
+    """Stack samples per thread, each sample root-first with the wall time it stands for."""
+    interval: float
+    started_at: float
+    duration: float = 0.0
+    run_id: Optional[str] = None
+    samples: Dict[str, List[Tuple[Tuple[FrameKey, ...], float]]] = field(default_factory=lambda: defaultdict(list))
+
+    @property
+    def sample_count(self) -> int:
+        return sum(len(thread_samples) for thread_samples in self.samples.values())
+
+    def to_speedscope(self) -> Dict[str, Any]:
+        frame_index: Dict[FrameKey, int] = {}
+        frames: List[Dict[str, Any]] = []
+        profiles = []
+        for thread_name, thread_samples in self.samples.items():
+            stacks, weights = [], []
+            for stack, weight in thread_samples:
+                indices = []
+                for key in stack:
+                    if key not in frame_index:
+                        frame_index[key] = len(frames)
+                        frames.append({"name": key[2], "file": key[0], "line": key[1]})
+                    indices.append(frame_index[key])
+                stacks.append(indices)
+                weights.append(weight)
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": stacks,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": f"tilt-agent {self.run_id or 'all threads'} ({self.duration:.1f}s)",
+            "activeProfileIndex": 0,
+            "exporter": "agent.profiler",
+        }
+
+    def to_pstats(self) -> bytes:
+        """
+        Marshalled pstats data built from the samples: call counts are sample counts,
+        tottime is time as the innermost frame and cumtime is time anywhere on the stack.
+        """
+        self_time: Dict[FrameKey, float] = defaultdict(float)
+        total_time: Dict[FrameKey, float] = defaultdict(float)
+        hits: Counter = Counter()
+        callers: Dict[FrameKey, Counter] = defaultdict(Counter)
+        for thread_samples in self.samples.values():
+            for stack, weight in thread_samples:
+                if not stack:
+                    continue
+                self_time[stack[-1]] += weight
+                for key in set(stack):
+                    total_time[key] += weight
+                    hits[key] += 1
+                for caller, callee in zip(stack, stack[1:]):
+                    callers[callee][caller] += 1
+        stats = {
+            key: (hits[key], hits[key], self_time.get(key, 0.0), total_time[key], dict(callers.get(key, {})))
+            for key in total_time
+        }
+        return marshal.dumps(stats)
+
+
+class SamplingProfiler:
+    """Samples all threads of this process; one capture at a time."""
+
+    def __init__(self):
+        self._busy = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._busy.locked()
+
+    def capture(
+        self,
+        duration: float,
+        interval: float = DEFAULT_INTERVAL,
+        run_id: Optional[str] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        loop_thread_id: Optional[int] = None,
+    ) -> Profile:
+        """
+        Sample for `duration` seconds (blocking; run it off the event loop).
+        With `run_id`, only event-loop samples taken while a task named for that run
+        is executing are kept.
+        """
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("A profile capture is already running")
+        try:
+            return self._capture(min(duration, MAX_DURATION_SECONDS), interval, run_id, loop, loop_thread_id)
+        finally:
+            self._busy.release()
+
+    def _capture(self, duration, interval, run_id, loop, loop_thread_id) -> Profile:
+        own_thread = threading.get_ident()
+        profile = Profile(interval=interval, started_at=time.time(), run_id=run_id)
+        started = last = time.perf_counter()
+        deadline = started + duration
+        while True:
+            time.sleep(interval)
+            now = time.perf_counter()
+            weight, last = now - last, now
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                if run_id is not None and not self._in_run(run_id, thread_id, loop, loop_thread_id):
+                    continue
+                profile.samples[thread_names.get(thread_id, str(thread_id))].append((_stack(frame), weight))
+            if now >= deadline:
+                break
+        profile.duration = time.perf_counter() - started
+        return profile
+
+    @staticmethod
+    def _in_run(run_id, thread_id, loop, loop_thread_id) -> bool:
+        if loop is None or thread_id != loop_thread_id:
+            return False
+        try:
+            task = asyncio.current_task(loop)
+        except RuntimeError:
+            return False
+        name = task.get_name() if task else ""
+        return any(name == f"{prefix}{run_id}" for prefix in RUN_TASK_PREFIXES)
+
+
+def _stack(frame) -> Tuple[FrameKey, ...]:
+    keys = []
+    while frame is not None and len(keys) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        keys.append((code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    keys.reverse()
+    return tuple(keys)
+
+
+# Global profiler for the debug endpoint
+profiler = SamplingProfiler()
@@ -0,0 +1,157 @@
+"""
+Per-turn routing between a fast model tier and a strong model tier.
+
+Trivial turns (taking a screenshot, confirming a page loaded, following up on a
+routine action that worked) go to the fast model; everything else, and every turn
+shortly after a failure or a sign of confusion, goes to the strong model.
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any, Dict, List, Optional
+
+from anthropic.types.beta import BetaMessageParam
+
+from .tools import ToolResult
+
+logger = logging.getLogger(__name__)
+
+# Instructions that need no real reasoning
+TRIVIAL_STEP_PATTERN = re.compile(
+    r"^\s*(take a screenshot|screenshot|wait\b|scroll (up|down)|verify (that )?the page (has )?loaded|"
+    r"go back|refresh|press (enter|escape|tab))",
+    re.IGNORECASE,
+)
+
+# Assistant phrasing that suggests it is lost
+CONFUSION_PATTERN = re.compile(
+    r"\b(not sure|unable to|can't find|cannot find|could not find|couldn't find|unclear|"
+    r"doesn't seem|does not seem|didn't work|did not work|let me try (again|a different)|i apologi[sz]e)\b",
+    re.IGNORECASE,
+)
+
+# Computer actions that are cheap to follow up on when they succeed
+ROUTINE_ACTIONS = {"screenshot", "wait", "scroll", "mouse_move", "cursor_position"}
+
+# Turns to stay on the strong tier after an escalation
+ESCALATION_TURNS = 2
+
+
+class ModelTier(StrEnum):
+    FAST = "fast"
+    STRONG = "strong"
+
+
+@dataclass
+class TierStats:
+    """Latency and token usage accumulated for one tier."""
+    calls: int = 0
+    total_latency: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'total_latency': self.total_latency,
+            'average_latency': self.total_latency / self.calls if self.calls else None,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens
+        }
+
+
+class ModelRouter:
+    """
+    Chooses the model for each turn of one run from cheap signals.
+
+    Switching models invalidates the prompt cache for that turn, so the router only
+    drops to the fast tier when the previous turn gives it a reason to.
+    """
+
+    def __init__(self, fast_model: str, strong_model: str, escalation_turns: int = ESCALATION_TURNS):
+        self.models = {ModelTier.FAST: fast_model, ModelTier.STRONG: strong_model}
+        self.escalation_turns = escalation_turns
+        self._stats = {tier: TierStats() for tier in ModelTier}
+        self._escalated_turns_left = 0
+        self._last_action_routine = False
+        self._last_tool_calls: List[tuple[str, str]] = []
+        self.escalations = 0
+
+    @classmethod
+    def from_env(cls, strong_model: str) -> Optional["ModelRouter"]:
+        """Build a router when ANTHROPIC_FAST_MODEL is configured, otherwise return None."""
+        fast_model = os.getenv('ANTHROPIC_FAST_MODEL')
+        if not fast_model or fast_model == strong_model:
+            return None
+        return cls(fast_model=fast_model, strong_model=strong_model)
+
+    def model_for(self, tier: ModelTier) -> str:
+        return self.models[tier]
+
+    def choose(self, messages: List[BetaMessageParam]) -> ModelTier:
+        """Pick the tier for the next model call."""
+        if self._escalated_turns_left > 0:
+            self._escalated_turns_left -= 1
+            return ModelTier.STRONG
+        if len(messages) <= 1:
+            step_text = _step_text(messages)
+            return ModelTier.FAST if TRIVIAL_STEP_PATTERN.match(step_text) else ModelTier.STRONG
+        return ModelTier.FAST if self._last_action_routine else ModelTier.STRONG
+
+    def observe(
+        self,
+        assistant_text: str,
+        tool_calls: List[tuple[str, Dict[str, Any]]],
+        tool_results: List[ToolResult],
+    ):
+        """Update routing signals from the turn that just finished."""
+        failed = any(result.error for result in tool_results)
+        confused = bool(CONFUSION_PATTERN.search(assistant_text or ""))
+        routine = bool(tool_calls) and all(
+            name == "computer" and tool_input.get("action") in ROUTINE_ACTIONS
+            for name, tool_input in tool_calls
+        )
+        # Repeating the exact same click or command is a sign of being stuck; repeated screenshots are not
+        call_keys = [(name, repr(sorted(tool_input.items()))) for name, tool_input in tool_calls]
+        repeated = bool(call_keys) and not routine and call_keys == self._last_tool_calls
+        self._last_tool_calls = call_keys
+
+        if failed or confused or repeated:
+            self.escalations += 1
+            self._escalated_turns_left = self.escalation_turns
+            self._last_action_routine = False
+            logger.info(f"Escalating to strong tier (failed={failed}, confused={confused}, repeated={repeated})")
+            return
+
+        self._last_action_routine = routine
+
+    def record(self, tier: ModelTier, latency: float, input_tokens: int, output_tokens: int):
+        stats = self._stats[tier]
+        stats.calls += 1
+        stats.total_latency += latency
+        stats.input_tokens += input_tokens
+        stats.output_tokens += output_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-tier latency and usage for this run."""
+        return {
+            'models': {tier.value: model for tier, model in self.models.items()},
+            'escalations': self.escalations,
+            'tiers': {tier.value: stats.to_dict() for tier, stats in self._stats.items()}
+        }
+
+
+def _step_text(messages: List[BetaMessageParam]) -> str:
+    """The instruction of the opening user turn, preferring a segmented step's 'Current step:' line."""
+    if not messages:
+        return ""
+    content = messages[0].get("content")
+    text = content if isinstance(content, str) else next(
+        (block.get("text", "") for block in content or [] if isinstance(block, dict) and block.get("type") == "text"),
+        "",
+    )
+    current = re.search(r"^Current step:\s*(.*)$", text, re.MULTILINE)
+    return current.group(1) if current else text
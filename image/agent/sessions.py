@@ -0,0 +1,219 @@
+"""
+Server-side conversation sessions for /chat/stream.
+
+With a `session_id` the client sends only its new turn and receives only the messages
+the run added; the history lives here. Sessions are held in memory up to a byte budget.
+Past it, the oldest turns of the least recently used sessions are spilled to a JSONL
+file per session, with images moved into the artifact store, and read back when the
+session runs again. Idle sessions expire.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+DEFAULT_MEMORY_BYTES = 256 * 1024 ** 2
+DEFAULT_TTL_SECONDS = 6 * 3600
+MAX_SESSIONS = 1000
+# Most recent messages a session keeps in memory when it is spilled
+HOT_MESSAGES = 10
+
+
+def estimate_size(value: Any) -> int:
+    """Rough in-memory size of a message structure, dominated by strings (base64 images)."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_size(item) for item in value.values()) + 64
+    if isinstance(value, list):
+        return sum(estimate_size(item) for item in value) + 32
+    return 16
+
+
+@dataclass
+class ConversationSession:
+    """History of one conversation: spilled messages on disk followed by hot ones in memory."""
+    session_id: str
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    spilled_count: int = 0
+    size_bytes: int = 0
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    runs: int = 0
+    # Held while a stream runs so two runs cannot interleave the same history
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    # Held by history, commit and spill, which run in worker threads
+    io_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def message_count(self) -> int:
+        return self.spilled_count + len(self.messages)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.session_id,
+            'message_count': self.message_count,
+            'spilled_messages': self.spilled_count,
+            'memory_bytes': self.size_bytes,
+            'runs': self.runs,
+            'busy': self.lock.locked(),
+            'created_at': self.created_at,
+            'last_used': self.last_used,
+        }
+
+
+class SessionStore:
+    """Memory-bounded sessions keyed by id, spilling cold turns to disk."""
+
+    def __init__(
+        self,
+        spill_dir: Optional[str] = None,
+        memory_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+    ):
+        self.spill_dir = spill_dir or os.getenv('TILT_SESSION_DIR', '/tmp/tilt-sessions')
+        self.memory_bytes = memory_bytes or int(os.getenv('TILT_SESSION_MEMORY_BYTES', DEFAULT_MEMORY_BYTES))
+        self.ttl_seconds = ttl_seconds or float(os.getenv('TILT_SESSION_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+        self._sessions: Dict[str, ConversationSession] = {}
+        self._lock = threading.Lock()
+
+    def _spill_path(self, session_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{session_id}.jsonl")
+
+    def get_or_create(self, session_id: str) -> ConversationSession:
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError("session_id must be 1-64 letters, digits, '-' or '_'")
+        self.expire()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                if len(self._sessions) >= MAX_SESSIONS:
+                    raise ValueError("Too many open sessions")
+                session = ConversationSession(session_id)
+                self._sessions[session_id] = session
+            session.last_used = time.time()
+            return session
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def history(self, session: ConversationSession) -> List[Dict[str, Any]]:
+        """Full history: spilled messages read back from disk, then the hot ones."""
+        from .artifacts import MissingArtifactError, artifact_store
+
+        with session.io_lock:
+            if not session.spilled_count:
+                return list(session.messages)
+            with open(self._spill_path(session.session_id)) as f:
+                spilled = [json.loads(line) for line in f]
+            hot = list(session.messages)
+        try:
+            return artifact_store.resolve_messages(spilled) + hot
+        except MissingArtifactError as e:
+            raise ValueError(
+                f"Session {session.session_id} history is incomplete (image {e.artifact_id} was deleted); "
+                "delete the session and start a new one"
+            ) from None
+
+    def commit(self, session: ConversationSession, messages: List[Dict[str, Any]]):
+        """Store the history after a run; `messages` is the full conversation the loop returned."""
+        with session.io_lock:
+            session.messages = messages[session.spilled_count:]
+            session.size_bytes = estimate_size(session.messages)
+            session.last_used = time.time()
+            session.runs += 1
+        # The committing run still holds the lock, but owns the history and may spill it
+        self._enforce_budget(committing=session)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        if session.spilled_count:
+            from .artifacts import artifact_store
+
+            artifact_store.unpin(_pin_owner(session_id))
+        try:
+            os.remove(self._spill_path(session_id))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def expire(self):
+        """Drop sessions idle for longer than the TTL."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [
+                session_id for session_id, session in self._sessions.items()
+                if session.last_used < cutoff and not session.lock.locked()
+            ]
+        for session_id in expired:
+            self.delete(session_id)
+
+    def _enforce_budget(self, committing: Optional[ConversationSession] = None):
+        with self._lock:
+            sessions = sorted(self._sessions.values(), key=lambda session: session.last_used)
+        total = sum(session.size_bytes for session in sessions)
+        for session in sessions:
+            if total <= self.memory_bytes:
+                break
+            # Other running sessions are committed (and spilled if needed) when they finish
+            if session.lock.locked() and session is not committing:
+                continue
+            # A session being read or committed in another thread is left for the next pass
+            if not session.io_lock.acquire(blocking=False):
+                continue
+            try:
+                if len(session.messages) <= HOT_MESSAGES:
+                    continue
+                before = session.size_bytes
+                self._spill(session)
+                total -= before - session.size_bytes
+            finally:
+                session.io_lock.release()
+
+    def _spill(self, session: ConversationSession):
+        """Append all but the last HOT_MESSAGES hot messages to the session's spill file. Caller holds `io_lock`."""
+        from .artifacts import artifact_store
+
+        cold = session.messages[:-HOT_MESSAGES]
+        spilled = artifact_store.externalize_messages(cold)
+        # The spill file is the only copy of these images' references; pruning must keep them
+        artifact_store.pin(_pin_owner(session.session_id), artifact_store.referenced_ids(spilled))
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with open(self._spill_path(session.session_id), "a") as f:
+            for message in spilled:
+                f.write(json.dumps(message) + "\n")
+        session.messages = session.messages[-HOT_MESSAGES:]
+        session.spilled_count += len(cold)
+        session.size_bytes = estimate_size(session.messages)
+        logger.info(f"Spilled {len(cold)} messages of session {session.session_id} to disk")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            'sessions': len(sessions),
+            'memory_bytes': sum(session.size_bytes for session in sessions),
+            'memory_budget_bytes': self.memory_bytes,
+            'spilled_messages': sum(session.spilled_count for session in sessions),
+        }
+
+
+def _pin_owner(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+# Global store shared by the chat routes in this process
+session_store = SessionStore()
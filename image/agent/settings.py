@@ -0,0 +1,178 @@
+"""
+In-process cache for the settings read on every request.
+
+`SettingsService` serves the Anthropic API key, the model and provider, and the panel
+preferences from memory. The API key and panels are loaded from MongoDB on first use and
+reloaded after a write through this service, a change reported by the MongoDB change
+stream, or TILT_SETTINGS_TTL_SECONDS as a bound on staleness when change streams are
+unavailable. Panel preference updates are written behind: the cache changes at once and
+the latest layout reaches MongoDB after TILT_PANEL_WRITE_DELAY_SECONDS, so a burst of
+drags costs one write.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+API_KEY_SETTING = "anthropic_key"
+DEFAULT_TTL_SECONDS = 60.0
+DEFAULT_PANEL_WRITE_DELAY = 0.5
+
+
+@dataclass(frozen=True)
+class ModelSettings:
+    """Model and provider for chat runs, fixed for the life of the process."""
+    model: str
+    provider: str
+
+    @classmethod
+    def from_env(cls) -> "ModelSettings":
+        return cls(
+            model=os.getenv('ANTHROPIC_MODEL', 'claude-sonnet-4-20250514'),
+            provider=os.getenv('API_PROVIDER', 'anthropic'),
+        )
+
+
+@dataclass
+class _Cached:
+    value: Any
+    loaded_at: float
+
+
+class SettingsService:
+    """Cached settings with invalidation on writes and on changes from other processes."""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, panel_write_delay: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.getenv('TILT_SETTINGS_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+        self.panel_write_delay = panel_write_delay if panel_write_delay is not None else float(
+            os.getenv('TILT_PANEL_WRITE_DELAY_SECONDS', DEFAULT_PANEL_WRITE_DELAY))
+        self.model_settings = ModelSettings.from_env()
+        self._api_key: Optional[_Cached] = None
+        self._panels: Optional[_Cached] = None
+        # Latest panel layout not yet written to MongoDB
+        self._pending_panels: Optional[Dict[str, Any]] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        # Created on first use so it binds to the running event loop
+        self._load_lock: Optional[asyncio.Lock] = None
+
+    def _fresh(self, cached: Optional[_Cached]) -> bool:
+        return cached is not None and time.monotonic() - cached.loaded_at < self.ttl_seconds
+
+    def _lock(self) -> asyncio.Lock:
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        return self._load_lock
+
+    async def get_api_key(self) -> Optional[str]:
+        """The stored API key. A missing key is not cached, so one stored elsewhere is picked up."""
+        if self._fresh(self._api_key):
+            return self._api_key.value
+        # Concurrent requests after an invalidation share one read
+        async with self._lock():
+            if not self._fresh(self._api_key):
+                api_key = await db.get_setting(API_KEY_SETTING)
+                if api_key is None:
+                    return None
+                self._api_key = _Cached(api_key, time.monotonic())
+            return self._api_key.value
+
+    async def set_api_key(self, api_key: str):
+        await db.set_setting(API_KEY_SETTING, api_key)
+        self._api_key = _Cached(api_key, time.monotonic())
+
+    async def get_panel_preferences(self) -> Optional[Dict[str, Any]]:
+        """The stored panel layout, or None when there is none. Raises if MongoDB is unreachable."""
+        if self._pending_panels is not None:
+            return self._pending_panels
+        if self._fresh(self._panels):
+            return self._panels.value
+        async with self._lock():
+            if not self._fresh(self._panels):
+                document = await db.get_panel_preferences()
+                preferences = document.get("preferences", {}) if document else None
+                self._panels = _Cached(preferences, time.monotonic())
+            return self._panels.value
+
+    async def save_panel_preferences(self, preferences: Dict[str, Any]) -> bool:
+        """Write the layout now and cache it. Returns True when the document was created."""
+        upserted = await db.save_panel_preferences(preferences)
+        self._panels = _Cached(preferences, time.monotonic())
+        return upserted
+
+    def update_panel_preferences(self, preferences: Dict[str, Any]):
+        """Cache the layout and write it to MongoDB shortly, keeping only the latest of a burst."""
+        self._pending_panels = preferences
+        self._panels = _Cached(preferences, time.monotonic())
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later(), name="panel-preferences-flush")
+
+    async def _flush_later(self):
+        # Updates that arrive during a write are picked up by the next pass
+        while self._pending_panels is not None:
+            await asyncio.sleep(self.panel_write_delay)
+            if not await self.flush():
+                break
+
+    async def flush(self) -> bool:
+        """Write a pending panel layout now; it stays pending if MongoDB is unreachable."""
+        preferences = self._pending_panels
+        if preferences is None:
+            return True
+        try:
+            await db.save_panel_preferences(preferences)
+        except Exception as e:
+            logger.warning(f"Failed to write panel preferences, keeping them pending: {e}")
+            return False
+        if self._pending_panels is preferences:
+            self._pending_panels = None
+        return True
+
+    def invalidate(self, setting: Optional[str] = None):
+        """Drop cached values ("api_key", "panels", or all) so the next read reloads them."""
+        if setting in (None, "api_key"):
+            self._api_key = None
+        if setting in (None, "panels"):
+            self._panels = None
+
+    def watch_mongodb(self) -> asyncio.Task:
+        """
+        Invalidate when another process changes the settings or panel preferences.
+        Must be called from the event loop; the stream is consumed by a background task.
+        """
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch(), name="settings-change-stream")
+        return self._watch_task
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": ["settings", "panel_preferences"]}}}]
+        try:
+            async with db.get_database().watch(pipeline) as stream:
+                async for change in stream:
+                    self.invalidate("panels" if change["ns"]["coll"] == "panel_preferences" else "api_key")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Change streams need a replica set; a standalone server relies on the TTL instead
+            logger.info(f"Settings change stream unavailable, cached settings expire after {self.ttl_seconds:.0f}s: {e}")
+
+    async def close(self):
+        """Stop watching and write any pending panel layout."""
+        if self._watch_task:
+            self._watch_task.cancel()
+            self._watch_task = None
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+
+# Global service shared by the routes, the task runner and the utils in this process
+settings_service = SettingsService()
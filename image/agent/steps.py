@@ -0,0 +1,246 @@
+"""
+Step-segmented execution for multi-step tests.
+
+Each instruction step runs as its own short conversation that starts from a compact
+summary of the earlier steps plus the latest screenshot, so step 9 does not pay for
+the screenshots and tokens of steps 1-8.
+"""
+
+import asyncio
+import re
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Literal, Optional
+
+from anthropic.types.beta import BetaMessageParam
+
+from .loop import (
+    APIProvider,
+    Done,
+    LoopEvent,
+    TextDelta,
+    ToolResultEvent,
+    Usage,
+    prepare_tool_collection,
+    sampling_events,
+)
+from .routing import ModelRouter
+from .timing_utils import current_collector
+from .tracing import span
+from .tools import ToolVersion
+
+# Characters of each step's final message carried forward into the state summary
+STEP_SUMMARY_CHARS = 400
+
+STEP_PROMPT_SUFFIX = """You are executing ONE step of a multi-step test. Earlier steps have already been performed; the summary and screenshot show where they left off.
+Only perform the current step. When it is done, end your final message with a line that is exactly `STEP PASSED` or `STEP FAILED: <reason>`."""
+
+_VERDICT_PATTERN = re.compile(r"STEP (PASSED|FAILED)(?::\s*(.*))?", re.IGNORECASE)
+
+StepStatus = Literal["passed", "failed", "error", "skipped"]
+
+
+@dataclass
+class StepResult:
+    """Outcome and cost of one instruction step."""
+    index: int
+    instruction: str
+    status: StepStatus
+    summary: str = ""
+    error: Optional[str] = None
+    duration: float = 0.0
+    tool_calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization."""
+        return {
+            'index': self.index,
+            'instruction': self.instruction,
+            'status': self.status,
+            'summary': self.summary,
+            'error': self.error,
+            'duration': self.duration,
+            'tool_calls': self.tool_calls,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens
+        }
+
+
+@dataclass(frozen=True)
+class StepStarted:
+    """A new instruction step is about to run."""
+    index: int
+    instruction: str
+    type: Literal["step_start"] = "step_start"
+
+
+@dataclass(frozen=True)
+class StepFinished:
+    """An instruction step finished, with its verdict and timing."""
+    result: StepResult
+    type: Literal["step_result"] = "step_result"
+
+
+@dataclass(frozen=True)
+class StepsDone:
+    """Every step has been run (or skipped after a failure)."""
+    results: List[StepResult] = field(default_factory=list)
+    messages: List[BetaMessageParam] = field(default_factory=list)
+    type: Literal["steps_done"] = "steps_done"
+
+    @property
+    def passed(self) -> bool:
+        return all(result.status == "passed" for result in self.results)
+
+
+SegmentedEvent = LoopEvent | StepStarted | StepFinished | StepsDone
+
+
+def build_step_messages(
+    instruction: str,
+    index: int,
+    total: int,
+    previous: List[StepResult],
+    screenshot: Optional[str],
+) -> List[BetaMessageParam]:
+    """Build the opening user turn for one step from the carried-forward state."""
+    lines = [f"Test step {index + 1} of {total}."]
+    if previous:
+        lines.append("Completed steps:")
+        for result in previous:
+            lines.append(f"{result.index + 1}. [{result.status}] {result.instruction} - {result.summary}")
+    lines.append(f"Current step: {instruction}")
+
+    content: List[Dict[str, Any]] = [{"type": "text", "text": "\n".join(lines)}]
+    if screenshot:
+        content.append({
+            "type": "image",
+            "source": {"type": "base64", "media_type": "image/png", "data": screenshot},
+        })
+    return [{"role": "user", "content": content}]
+
+
+def parse_step_verdict(final_text: str) -> tuple[StepStatus, Optional[str]]:
+    """Read the STEP PASSED / STEP FAILED marker from the step's final message."""
+    matches = list(_VERDICT_PATTERN.finditer(final_text or ""))
+    if not matches:
+        # No explicit verdict: treat a step that finished cleanly as passed
+        return "passed", None
+    verdict = matches[-1]
+    if verdict.group(1).upper() == "PASSED":
+        return "passed", None
+    return "failed", (verdict.group(2) or "Step reported failure").strip()
+
+
+def _summarize(final_text: str) -> str:
+    text = _VERDICT_PATTERN.sub("", final_text or "").strip()
+    text = " ".join(text.split())
+    if len(text) > STEP_SUMMARY_CHARS:
+        text = text[:STEP_SUMMARY_CHARS] + "..."
+    return text
+
+
+async def run_segmented_steps(
+    *,
+    instructions: List[str],
+    model: str,
+    provider: APIProvider,
+    system_prompt_suffix: str,
+    api_key: str,
+    tool_version: ToolVersion,
+    only_n_most_recent_images: int | None = None,
+    max_tokens: int = 4096,
+    thinking_budget: int | None = None,
+    token_efficient_tools_beta: bool = False,
+    interrupt_key: str | None = None,
+    stop_on_failure: bool = True,
+    router: ModelRouter | None = None,
+) -> AsyncIterator[SegmentedEvent]:
+    """
+    Run each instruction as a bounded sub-conversation sharing one set of tools.
+
+    Inner loop events are passed through (except each step's own `Done`), wrapped by
+    `StepStarted` / `StepFinished`, and the run ends with a single `StepsDone`.
+    """
+    tool_collection = await prepare_tool_collection(tool_version)
+    suffix = f"{system_prompt_suffix}\n\n{STEP_PROMPT_SUFFIX}" if system_prompt_suffix else STEP_PROMPT_SUFFIX
+
+    try:
+        results: List[StepResult] = []
+        screenshot: Optional[str] = None
+        step_messages: List[BetaMessageParam] = []
+        halted = False
+
+        for index, instruction in enumerate(instructions):
+            if halted:
+                result = StepResult(index=index, instruction=instruction, status="skipped")
+                results.append(result)
+                yield StepFinished(result=result)
+                continue
+
+            yield StepStarted(index=index, instruction=instruction)
+            current_collector().start_step(index + 1)
+            started = time.perf_counter()
+            result = StepResult(index=index, instruction=instruction, status="passed")
+            final_text = ""
+
+            with span("instruction_step", "step", index=index, instruction=instruction[:200]) as step_span:
+                step_messages = build_step_messages(instruction, index, len(instructions), results, screenshot)
+                try:
+                    async for event in sampling_events(
+                        model=model,
+                        provider=provider,
+                        system_prompt_suffix=suffix,
+                        messages=step_messages,
+                        api_key=api_key,
+                        only_n_most_recent_images=only_n_most_recent_images,
+                        max_tokens=max_tokens,
+                        tool_version=tool_version,
+                        thinking_budget=thinking_budget,
+                        token_efficient_tools_beta=token_efficient_tools_beta,
+                        interrupt_key=interrupt_key,
+                        tool_collection=tool_collection,
+                        router=router,
+                    ):
+                        if isinstance(event, Done):
+                            step_messages = event.messages
+                            continue
+                        if isinstance(event, TextDelta):
+                            # The verdict is in the assistant's last text, never in an echoed interrupt
+                            if not event.echo:
+                                final_text = event.text
+                        elif isinstance(event, ToolResultEvent):
+                            result.tool_calls += 1
+                            if event.result.base64_image:
+                                screenshot = event.result.base64_image
+                        elif isinstance(event, Usage):
+                            result.input_tokens += event.input_tokens
+                            result.output_tokens += event.output_tokens
+                        yield event
+                except Exception as e:
+                    result.status = "error"
+                    result.error = str(e)
+                else:
+                    result.status, result.error = parse_step_verdict(final_text)
+
+                step_span.set_attribute("status", result.status)
+
+            result.summary = _summarize(final_text)
+            result.duration = time.perf_counter() - started
+            current_collector().finish_current_step(
+                error_occurred=result.status != "passed",
+                error_message=result.error,
+            )
+            results.append(result)
+            yield StepFinished(result=result)
+
+            if result.status != "passed" and stop_on_failure:
+                halted = True
+
+        yield StepsDone(results=results, messages=step_messages)
+    finally:
+        # The shell and network capture must not outlive the run (or its leased display)
+        await asyncio.to_thread(tool_collection.close)
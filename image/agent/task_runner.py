@@ -1,15 +1,16 @@
-import os
 import asyncio
 import logging
+import uuid
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any, List
-from pymongo import MongoClient
-from pymongo.collection import Collection
-from bson import ObjectId
-from .timing_utils import timing_collector
+from . import db
+from .timing_utils import current_collector, run_timing
 
 logger = logging.getLogger(__name__)
 
+# Strong model for queued tasks; ANTHROPIC_FAST_MODEL enables fast-tier routing
+TASK_MODEL = "claude-3-5-sonnet-20241022"
+
 
 class TaskModel:
     def __init__(self, data: Dict[str, Any]):
@@ -27,6 +28,8 @@ class TaskModel:
         self.result = data.get('result')
         self.error = data.get('error')
         self.metadata = data.get('metadata', {})
+        # 'conversation' runs all instructions in one conversation, 'segmented' runs one per step
+        self.execution_mode = data.get('execution_mode', 'conversation')
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -41,7 +44,8 @@ class TaskModel:
             'completed_at': self.completed_at,
             'result': self.result,
             'error': self.error,
-            'metadata': self.metadata
+            'metadata': self.metadata,
+            'execution_mode': self.execution_mode
         }
     
     def get_formatted_instructions(self) -> str:
@@ -71,34 +75,52 @@ class TaskModel:
                     formatted_instructions += f" with arguments: {arguments}"
             
         return formatted_instructions
+    
+    def get_instruction_steps(self) -> List[str]:
+        """Get instructions as a list of steps, with any tool hint folded into the last step"""
+        steps = self.instructions if isinstance(self.instructions, list) else [self.instructions]
+        steps = [step for step in steps if step and step.strip()]
+        if not steps:
+            return []
+        
+        hint = TaskModel({**self.to_dict(), 'instructions': ''}).get_formatted_instructions().strip()
+        if hint:
+            steps[-1] = f"{steps[-1]}\n\n{hint}"
+        return steps
+    
+    def get_tags(self) -> List[str]:
+        """Telemetry tags: explicit metadata tags plus the task's source"""
+        tags = list(self.metadata.get('tags') or [])
+        if self.metadata.get('source'):
+            tags.append(self.metadata['source'])
+        return tags
+    
+    @property
+    def is_segmented(self) -> bool:
+        """Whether this task runs each instruction step as its own sub-conversation"""
+        return self.execution_mode == 'segmented' and len(self.get_instruction_steps()) > 1
 
 
 class MongoDBConnection:
-    def __init__(self, connection_string: str = 'mongodb://localhost:27017/'):
-        self.client = MongoClient(connection_string)
-        self.db = self.client.tilt
-        self.tasks_collection: Collection = self.db.tasks
-        
-    def get_next_task(self) -> Optional[TaskModel]:
+    """Task queries for the runner, backed by the shared async client in `db`"""
+    
+    async def get_next_task(self) -> Optional[TaskModel]:
         """Get the next pending task that hasn't been completed"""
-        task_data = self.tasks_collection.find_one(
-            {
-                "$and": [
-                    {"status": "pending"},
-                    {"completed_at": {"$exists": False}},  # Exclude tasks that have been completed
-                    {"$or": [
-                        {"started_at": {"$exists": False}},  # Never started
-                        {"started_at": None}  # Explicitly null
-                    ]}
-                ]
-            },
-            sort=[("created_at", 1)]
-        )
+        task_data = await db.find_first_task({
+            "$and": [
+                {"status": "pending"},
+                {"completed_at": {"$exists": False}},  # Exclude tasks that have been completed
+                {"$or": [
+                    {"started_at": {"$exists": False}},  # Never started
+                    {"started_at": None}  # Explicitly null
+                ]}
+            ]
+        })
         if task_data:
             return TaskModel(task_data)
         return None
     
-    def update_task_status(self, task_id: str, status: str, **kwargs) -> bool:
+    async def update_task_status(self, task_id: str, status: str, **kwargs) -> bool:
         """Update task status and additional fields"""
         update_data: Dict[str, Any] = {"status": status}
         
@@ -110,59 +132,59 @@ class MongoDBConnection:
         # Add any additional fields
         update_data.update(kwargs)
         
-        result = self.tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
-            {"$set": update_data}
-        )
-        return result.modified_count > 0
+        updated = await db.update_task(task_id, {"$set": update_data})
+        if updated:
+            from .notifications import notification_hub
+            
+            notification_hub.publish_status(task_id, status, task=True)
+        return updated
     
-    def save_task_result(self, task_id: str, result: Any, error: Optional[str] = None) -> bool:
+    async def save_task_result(self, task_id: str, result: Any, error: Optional[str] = None) -> bool:
         """Save task execution result"""
         status = "error" if error else "completed"
-        return self.update_task_status(
+        return await self.update_task_status(
             task_id=task_id,
             status=status,
             result=result,
             error=error
         )
     
-    def get_task_by_id(self, task_id: str) -> Optional[TaskModel]:
+    async def get_task_by_id(self, task_id: str) -> Optional[TaskModel]:
         """Get task by ID"""
-        task_data = self.tasks_collection.find_one({"_id": ObjectId(task_id)})
+        task_data = await db.find_task(task_id)
         if task_data:
             return TaskModel(task_data)
         return None
     
-    def get_all_tasks(self, status: Optional[str] = None) -> List[TaskModel]:
+    async def get_all_tasks(self, status: Optional[str] = None) -> List[TaskModel]:
         """Get all tasks, optionally filtered by status"""
         query = {}
         if status:
             query["status"] = status
             
-        tasks = []
-        for task_data in self.tasks_collection.find(query).sort("created_at", 1):
-            tasks.append(TaskModel(task_data))
-        return tasks
-    
-    def close(self):
-        """Close the MongoDB connection"""
-        self.client.close()
+        return [TaskModel(task_data) for task_data in await db.find_tasks(query)]
 
 
 class TaskRunner:
-    def __init__(self, mongodb_uri: str = 'mongodb://localhost:27017/'):
-        self.db = MongoDBConnection(mongodb_uri)
+    def __init__(self):
+        self.db = MongoDBConnection()
         self.is_running = False
         self.pause_after_completion = True  # Default to pause for inspection
         
     async def run_continuous(self):
         """Continuously process tasks from MongoDB"""
+        from .displays import display_pool
+        
         self.is_running = True
+        # With a display pool, run one task per display instead of one at a time
+        if display_pool.size > 1 and not self.pause_after_completion:
+            await self._run_parallel(display_pool.size)
+            return
         logger.info("Starting continuous task processing...")
         
         while self.is_running:
             try:
-                task = self.db.get_next_task()
+                task = await self.db.get_next_task()
                 if task:
                     logger.info(f"Processing task {task.task_id}: {task.instructions[:50]}...")
                     await self.process_task(task)
@@ -179,20 +201,82 @@ class TaskRunner:
                 logger.error(f"Error in task processing loop: {e}")
                 await asyncio.sleep(10)
     
+    async def _run_parallel(self, parallel: int):
+        """Keep up to `parallel` tasks running, each on its own leased display"""
+        logger.info(f"Starting continuous task processing, {parallel} tasks at a time...")
+        running: set = set()
+        
+        while self.is_running:
+            try:
+                if len(running) >= parallel:
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    self._log_failures(done)
+                    continue
+                task = await self.db.get_next_task()
+                if not task:
+                    await asyncio.sleep(5)
+                    continue
+                logger.info(f"Processing task {task.task_id}: {task.instructions[:50]}...")
+                # Claim the task before the next query so it is not picked up twice
+                await self.db.update_task_status(task.task_id, "running")
+                running.add(asyncio.create_task(self.process_task(task), name=f"task:{task.task_id}"))
+            except Exception as e:
+                logger.error(f"Error in task processing loop: {e}")
+                await asyncio.sleep(10)
+        
+        if running:
+            done, _ = await asyncio.wait(running)
+            self._log_failures(done)
+    
+    def _log_failures(self, done: set):
+        """Report tasks that raised; process_task lets failures of the run itself propagate"""
+        for finished in done:
+            if finished.cancelled():
+                continue
+            error = finished.exception()
+            if error:
+                logger.error(f"{finished.get_name()} failed: {error}", exc_info=error)
+    
     async def process_task(self, task: TaskModel):
+        """Process a single task inside its own trace, on a pool display when one is configured"""
+        from .displays import display_pool
+        from .profiler import name_current_task
+        from .telemetry import record_run
+        from .tracing import span, tracer
+        
+        run_id = uuid.uuid4().hex
+        try:
+            with run_timing(run_id, test_id=task.task_id), name_current_task(f"run:{run_id}"), \
+                    span("run", "run", trace_id=run_id, test_id=task.task_id, steps=len(task.get_instruction_steps()) if task.is_segmented else 0):
+                leased = False
+                try:
+                    async with display_pool.lease(f"task:{task.task_id}"):
+                        leased = True
+                        await self._process_task(task)
+                except Exception as e:
+                    # _process_task records its own errors; only a failed lease is recorded here
+                    if leased:
+                        raise
+                    logger.error(f"Could not get a display for task {task.task_id}: {e}")
+                    await self.db.save_task_result(task.task_id, None, str(e))
+        finally:
+            # Export once the run span has closed, even if the task raised
+            await asyncio.to_thread(tracer.write_run, run_id)
+            record_run(run_id, test_id=task.task_id, tags=task.get_tags())
+    
+    async def _process_task(self, task: TaskModel):
         """Process a single task"""
-        # Start timing for this step
-        step_timing = timing_collector.start_step(int(task.task_id.split('-')[-1] if '-' in task.task_id else hash(task.task_id) % 1000))
+        timing_collector = current_collector()
+        # Segmented tasks time each instruction step instead of the whole task
+        if not task.is_segmented:
+            timing_collector.start_step(int(task.task_id.split('-')[-1] if '-' in task.task_id else hash(task.task_id) % 1000))
         
         try:
             # Mark task as running
-            self.db.update_task_status(task.task_id, "running")
-            
-            # Set the current task ID in environment for MongoDBReporter tool
-            os.environ['CURRENT_TASK_ID'] = task.task_id
+            await self.db.update_task_status(task.task_id, "running")
             
             # Import here to avoid circular imports
-            from .loop import sampling_loop, APIProvider
+            from .loop import sampling_events, APIProvider, Done, TextDelta, ToolResultEvent, ToolUse, Usage
             
             # Set up API provider
             api_provider = APIProvider.ANTHROPIC
@@ -207,13 +291,6 @@ class TaskRunner:
                 }
             ]
             
-            # Define callbacks for the sampling loop
-            def output_callback(content_block):
-                logger.debug(f"Output callback: {content_block}")
-            
-            def tool_output_callback(tool_result, tool_name):
-                logger.debug(f"Tool output callback - {tool_name}: {tool_result}")
-            
             def api_response_callback(request, response, error):
                 if error:
                     logger.error(f"API response error: {error}")
@@ -223,36 +300,58 @@ class TaskRunner:
             # Get API key from MongoDB
             from .utils import get_api_key_from_mongodb, validate_api_key
             
-            api_key = get_api_key_from_mongodb()
+            api_key = await get_api_key_from_mongodb()
             if not api_key:
                 raise ValueError("No API key found in MongoDB database - please store your Anthropic API key in the 'settings' collection with key 'anthropic_key'")
             
             if not validate_api_key(api_key):
                 raise ValueError("Invalid API key format found in MongoDB")
             
+            system_prompt_suffix = "You are an autonomous task execution agent. When displaying captured data from tools (especially network requests and JSON structures), show the complete raw data in code blocks exactly as captured, without interpretation or summarization. Use the mongodb_reporter tool to report progress and results."
+            
+            if task.is_segmented:
+                await self._process_segmented_task(task, api_key, system_prompt_suffix)
+                return
+            
             # Run the sampling loop
+            from .routing import ModelRouter
+            router = ModelRouter.from_env(TASK_MODEL)
+            result_messages = messages
             try:
-                result_messages = await sampling_loop(
-                    model="claude-3-5-sonnet-20241022",
+                async for event in sampling_events(
+                    model=TASK_MODEL,
                     provider=api_provider,
-                    system_prompt_suffix="You are an autonomous task execution agent. When displaying captured data from tools (especially network requests and JSON structures), show the complete raw data in code blocks exactly as captured, without interpretation or summarization. Use the mongodb_reporter tool to report progress and results.",
+                    system_prompt_suffix=system_prompt_suffix,
                     messages=messages,
-                    output_callback=output_callback,
-                    tool_output_callback=tool_output_callback,
                     api_response_callback=api_response_callback,
                     api_key=api_key,
                     tool_version="computer_use_20250124",
                     only_n_most_recent_images=10,
-                    max_tokens=8192
-                )
+                    max_tokens=8192,
+                    interrupt_key=task.task_id,
+                    router=router
+                ):
+                    if isinstance(event, TextDelta):
+                        logger.debug(f"Assistant output: {event.text}")
+                    elif isinstance(event, ToolUse):
+                        logger.debug(f"Tool use - {event.name}: {event.input}")
+                    elif isinstance(event, ToolResultEvent):
+                        logger.debug(f"Tool result - {event.tool_name}: {event.result}")
+                    elif isinstance(event, Usage):
+                        logger.debug(f"Token usage - input: {event.input_tokens}, output: {event.output_tokens}")
+                    elif isinstance(event, Done):
+                        result_messages = event.messages
             except Exception as loop_error:
                 logger.error(f"Sampling loop error: {loop_error}")
                 raise
+            finally:
+                if router:
+                    logger.info(f"Model routing for task {task.task_id}: {router.stats()}")
             
             # Save successful result (if not already saved by MongoDBReporter)
-            current_task = self.db.get_task_by_id(task.task_id)
+            current_task = await self.db.get_task_by_id(task.task_id)
             if current_task and current_task.status == "running":
-                self.db.save_task_result(task.task_id, {
+                await self.db.save_task_result(task.task_id, {
                     "messages": result_messages,
                     "completed_at": datetime.now(timezone.utc).isoformat()
                 })
@@ -261,18 +360,61 @@ class TaskRunner:
             
         except Exception as e:
             logger.error(f"Error processing task {task.task_id}: {e}")
-            self.db.save_task_result(task.task_id, None, str(e))
+            await self.db.save_task_result(task.task_id, None, str(e))
             # Finish timing with error
-            timing_collector.finish_current_step(error_occurred=True, error_message=str(e))
+            if not task.is_segmented:
+                timing_collector.finish_current_step(error_occurred=True, error_message=str(e))
         else:
             # Finish timing successfully
-            timing_collector.finish_current_step()
+            if not task.is_segmented:
+                timing_collector.finish_current_step()
         finally:
-            # Clean up environment variable
-            os.environ.pop('CURRENT_TASK_ID', None)
             # Log timing statistics
             timing_collector.log_statistics()
     
+    async def _process_segmented_task(self, task: TaskModel, api_key: str, system_prompt_suffix: str):
+        """Run each instruction step as a bounded sub-conversation and record per-step results"""
+        from .loop import APIProvider
+        from .routing import ModelRouter
+        from .steps import StepFinished, StepsDone, run_segmented_steps
+        
+        router = ModelRouter.from_env(TASK_MODEL)
+        done: Optional[StepsDone] = None
+        async for event in run_segmented_steps(
+            instructions=task.get_instruction_steps(),
+            model=TASK_MODEL,
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix=system_prompt_suffix,
+            api_key=api_key,
+            tool_version="computer_use_20250124",
+            only_n_most_recent_images=10,
+            max_tokens=8192,
+            interrupt_key=task.task_id,
+            router=router
+        ):
+            if isinstance(event, StepFinished):
+                result = event.result
+                logger.info(f"Task {task.task_id} step {result.index + 1} {result.status} in {result.duration:.3f}s")
+            elif isinstance(event, StepsDone):
+                done = event
+        
+        steps = [result.to_dict() for result in done.results] if done else []
+        failed = next((result for result in done.results if result.status != "passed"), None) if done else None
+        
+        # Save result (if not already saved by MongoDBReporter)
+        current_task = await self.db.get_task_by_id(task.task_id)
+        if current_task and current_task.status == "running":
+            error = f"Step {failed.index + 1} {failed.status}: {failed.error or failed.instruction}" if failed else None
+            await self.db.save_task_result(task.task_id, {
+                "steps": steps,
+                "messages": done.messages if done else [],
+                "completed_at": datetime.now(timezone.utc).isoformat()
+            }, error)
+        
+        logger.info(f"Task {task.task_id} finished {len(steps)} steps")
+        if router:
+            logger.info(f"Model routing for task {task.task_id}: {router.stats()}")
+    
     def stop(self):
         """Stop the task runner"""
         self.is_running = False
@@ -286,7 +428,3 @@ class TaskRunner:
         """Continue processing next task (used after pause)"""
         if not self.is_running:
             await self.run_continuous()
-        
-    def __del__(self):
-        if hasattr(self, 'db'):
-            self.db.close()
\ No newline at end of file
@@ -0,0 +1,296 @@
+"""
+Durable step and span telemetry.
+
+At the end of each run its steps, spans and a run summary are queued and written in
+batches to the `telemetry` time-series collection (expired by TTL). Rollups per test
+and per tag per day are precomputed into `telemetry_rollups` with `$merge`, so trend
+queries never scan raw records.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from .db import DATABASE_NAME, MONGODB_URI
+from .metrics import time_mongodb
+
+logger = logging.getLogger('timing')
+
+TELEMETRY_COLLECTION = "telemetry"
+ROLLUP_COLLECTION = "telemetry_rollups"
+
+# Raw records are kept this long; rollups are kept indefinitely
+DEFAULT_TTL_DAYS = 30
+
+FLUSH_INTERVAL_SECONDS = 5
+BATCH_SIZE = 500
+# Records buffered while MongoDB is unreachable before new ones are dropped
+MAX_PENDING_RECORDS = 20000
+
+# Rollups for today and yesterday are refreshed this often by the writer thread
+ROLLUP_INTERVAL_SECONDS = 600
+ROLLUP_DIMENSIONS = ("test", "tag")
+
+
+def telemetry_enabled() -> bool:
+    return os.getenv('TILT_TELEMETRY', '1') != '0'
+
+
+class TelemetryWriter:
+    """Buffers telemetry records and writes them to MongoDB in batches from a daemon thread."""
+
+    def __init__(self, connection_string: Optional[str] = None):
+        # Same server as the rest of the agent, through a separate synchronous client for the writer thread
+        self.connection_string = connection_string or MONGODB_URI
+        self.ttl_days = int(os.getenv('TILT_TELEMETRY_TTL_DAYS', DEFAULT_TTL_DAYS))
+        self.dropped = 0
+        self.written = 0
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._client = None
+        self._collection_ready = False
+        self._last_rollup = 0.0
+
+    def enqueue(self, records: List[Dict[str, Any]]):
+        """Queue records for the next batch, starting the writer thread on first use."""
+        with self._lock:
+            room = MAX_PENDING_RECORDS - len(self._pending)
+            if room < len(records):
+                self.dropped += len(records) - max(room, 0)
+                records = records[:max(room, 0)]
+            self._pending.extend(records)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+        if len(self._pending) >= BATCH_SIZE:
+            self._wake.set()
+
+    def stop(self):
+        """Flush what is buffered and stop the writer thread."""
+        self._stopping = True
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.monotonic() - self._last_rollup >= ROLLUP_INTERVAL_SECONDS:
+                    self._last_rollup = time.monotonic()
+                    compute_rollups(self.database(), days=2)
+            except Exception as e:
+                logger.warning(f"Telemetry write failed, will retry: {e}")
+            if self._stopping:
+                return
+
+    def database(self):
+        if self._client is None:
+            from pymongo import MongoClient
+
+            self._client = MongoClient(self.connection_string)
+        db = self._client[DATABASE_NAME]
+        if not self._collection_ready:
+            ensure_telemetry_collection(db, self.ttl_days)
+            self._collection_ready = True
+        return db
+
+    def flush(self) -> int:
+        """Write every buffered record; records stay buffered if the write fails."""
+        total = 0
+        while True:
+            with self._lock:
+                batch = [self._pending.popleft() for _ in range(min(BATCH_SIZE, len(self._pending)))]
+            if not batch:
+                return total
+            try:
+                collection = self.database()[TELEMETRY_COLLECTION]
+                with time_mongodb(TELEMETRY_COLLECTION, "insert_many"):
+                    collection.insert_many(batch, ordered=False)
+            except Exception:
+                with self._lock:
+                    self._pending.extendleft(reversed(batch))
+                raise
+            total += len(batch)
+            self.written += len(batch)
+
+
+def ensure_telemetry_collection(db, ttl_days: int = DEFAULT_TTL_DAYS):
+    """Create the time-series collection with its TTL, and the rollup index, if missing."""
+    from pymongo.errors import CollectionInvalid
+
+    try:
+        db.create_collection(
+            TELEMETRY_COLLECTION,
+            timeseries={"timeField": "ts", "metaField": "meta", "granularity": "seconds"},
+            expireAfterSeconds=ttl_days * 86400,
+        )
+        logger.info(f"Created time-series collection {TELEMETRY_COLLECTION} (TTL {ttl_days} days)")
+    except CollectionInvalid:
+        pass
+    db[ROLLUP_COLLECTION].create_index([("dimension", 1), ("key", 1), ("day", 1)])
+    db[ROLLUP_COLLECTION].create_index([("day", 1)])
+
+
+def build_run_records(
+    run_id: str,
+    test_id: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Step, span and run-summary records for a finished run, from its collector and trace."""
+    from .timing_utils import collector_registry
+    from .tracing import tracer
+
+    meta = {"run_id": run_id, "test_id": test_id, "tags": sorted(set(tags or []))}
+    now_wall, now_perf = time.time(), time.perf_counter()
+    records: List[Dict[str, Any]] = []
+
+    collector = collector_registry.get(run_id)
+    steps = collector.get_step_history() if collector else []
+    for step in steps:
+        if step['total_duration'] is None:
+            continue
+        records.append({
+            "ts": datetime.fromtimestamp(now_wall - (now_perf - step['start_time']), timezone.utc),
+            "meta": {**meta, "kind": "step"},
+            "step_number": step['step_number'],
+            "duration": step['total_duration'],
+            "screenshot_duration": step['screenshot_duration'],
+            "anthropic_call_duration": step['anthropic_call_duration'],
+            "tool_execution_duration": step['tool_execution_duration'],
+            "tool_calls": len(step['tool_calls']),
+            "error": step['error_occurred'],
+            "resources": step['resources']
+        })
+
+    input_tokens = output_tokens = screenshot_bytes = 0
+    run_span = None
+    for span in tracer.spans(run_id):
+        if span.end_ns is None:
+            continue
+        input_tokens += span.attributes.get("input_tokens", 0) if span.category == "step" else 0
+        output_tokens += span.attributes.get("output_tokens", 0) if span.category == "step" else 0
+        if span.category == "screenshot":
+            screenshot_bytes += span.attributes.get("bytes", 0)
+        if span.category == "run":
+            run_span = span
+        records.append({
+            "ts": datetime.fromtimestamp(span.start_ns / 1e9, timezone.utc),
+            "meta": {**meta, "kind": "span", "category": span.category, "name": span.name},
+            "duration": span.duration,
+            "error": span.error
+        })
+
+    records.append({
+        "ts": datetime.now(timezone.utc),
+        "meta": {**meta, "kind": "run"},
+        "duration": run_span.duration if run_span else None,
+        "steps": len(steps),
+        "failed_steps": sum(1 for step in steps if step['error_occurred']),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "screenshot_bytes": screenshot_bytes,
+        "error": run_span.error if run_span else None
+    })
+    return records
+
+
+def record_run(run_id: str, test_id: Optional[str] = None, tags: Optional[List[str]] = None):
+    """Queue a finished run's telemetry for persistence. Never raises."""
+    if not telemetry_enabled():
+        return
+    try:
+        telemetry_writer.enqueue(build_run_records(run_id, test_id, tags))
+    except Exception as e:
+        logger.warning(f"Could not record telemetry for run {run_id}: {e}")
+
+
+def _rollup_pipelines(dimension: str, since: datetime) -> List[List[Dict[str, Any]]]:
+    """Aggregations that merge step and run statistics into per-day rollup documents."""
+    if dimension == "test":
+        key_field, select = "$meta.test_id", [{"$match": {"meta.test_id": {"$ne": None}}}]
+    else:
+        key_field, select = "$meta.tags", [{"$unwind": "$meta.tags"}]
+
+    def pipeline(kind: str, accumulators: Dict[str, Any], fields: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {"$match": {"meta.kind": kind, "ts": {"$gte": since}}},
+            *select,
+            {"$group": {"_id": {"day": {"$dateTrunc": {"date": "$ts", "unit": "day"}}, "key": key_field}, **accumulators}},
+            {"$project": {
+                "_id": {"dimension": dimension, "key": "$_id.key", "day": "$_id.day"},
+                "dimension": dimension,
+                "key": "$_id.key",
+                "day": "$_id.day",
+                **fields,
+            }},
+            {"$set": {"updated_at": "$$NOW"}},
+            {"$merge": {"into": ROLLUP_COLLECTION, "on": "_id", "whenMatched": "merge", "whenNotMatched": "insert"}},
+        ]
+
+    steps = pipeline(
+        "step",
+        {
+            "steps": {"$sum": 1},
+            "failed_steps": {"$sum": {"$cond": ["$error", 1, 0]}},
+            "avg_step_time": {"$avg": "$duration"},
+            "step_time": {"$percentile": {"input": "$duration", "p": [0.5, 0.95], "method": "approximate"}},
+        },
+        {
+            "steps": 1,
+            "failed_steps": 1,
+            "avg_step_time": 1,
+            "p50_step_time": {"$arrayElemAt": ["$step_time", 0]},
+            "p95_step_time": {"$arrayElemAt": ["$step_time", 1]},
+        },
+    )
+    runs = pipeline(
+        "run",
+        {
+            "runs": {"$sum": 1},
+            "failed_runs": {"$sum": {"$cond": [{"$gt": ["$failed_steps", 0]}, 1, 0]}},
+            "input_tokens": {"$sum": "$input_tokens"},
+            "output_tokens": {"$sum": "$output_tokens"},
+            "screenshot_bytes": {"$sum": "$screenshot_bytes"},
+            "run_time": {"$percentile": {"input": "$duration", "p": [0.5, 0.95], "method": "approximate"}},
+        },
+        {
+            "runs": 1,
+            "failed_runs": 1,
+            "input_tokens": 1,
+            "output_tokens": 1,
+            "screenshot_bytes": 1,
+            "p50_run_time": {"$arrayElemAt": ["$run_time", 0]},
+            "p95_run_time": {"$arrayElemAt": ["$run_time", 1]},
+        },
+    )
+    return [steps, runs]
+
+
+def compute_rollups(db, days: int = 2) -> Dict[str, Any]:
+    """Recompute the per-test and per-tag daily rollups for the last `days` days (whole days)."""
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today - timedelta(days=max(days, 1) - 1)
+    started = time.perf_counter()
+    for dimension in ROLLUP_DIMENSIONS:
+        for pipeline in _rollup_pipelines(dimension, since):
+            with time_mongodb(TELEMETRY_COLLECTION, "rollup"):
+                db[TELEMETRY_COLLECTION].aggregate(pipeline)
+    duration = time.perf_counter() - started
+    logger.info(f"Recomputed telemetry rollups since {since.date()} in {duration:.3f}s")
+    return {"since": since, "duration": duration}
+
+
+# Global writer shared by the API service and task runner in this process
+telemetry_writer = TelemetryWriter()
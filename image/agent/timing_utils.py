@@ -3,13 +3,38 @@ Timing utilities for diagnosing agent performance and step execution times.
 """
 
 import time
+import math
 import logging
+from array import array
+from collections import OrderedDict, deque
 from contextlib import contextmanager
-from typing import Dict, List, Optional, Any
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, field
 from threading import Lock
 import json
 
+from . import metrics
+from .host_sampler import host_sampler
+from .tracing import span
+
+# Completed steps kept for /timing/history; aggregates live in the histograms
+MAX_STEP_HISTORY = 1000
+
+# Histogram buckets grow by 5% from 0.1ms to ~3h, so percentiles are within ~2.5%
+HISTOGRAM_MIN_VALUE = 1e-4
+HISTOGRAM_GROWTH = 1.05
+HISTOGRAM_BUCKETS = 400
+
+# Sliding windows are assembled from one-minute slices, up to an hour back
+WINDOW_SLICE_SECONDS = 60
+WINDOW_SLICES = 60
+
+PERCENTILES = (50, 95, 99)
+
+# Finished per-run collectors kept for /timing queries by run id
+MAX_RUN_COLLECTORS = 200
+
 @dataclass
 class TimingRecord:
     """A single timing measurement."""
@@ -47,6 +72,9 @@ class StepTiming:
     error_occurred: bool = False
     error_message: Optional[str] = None
     
+    # Host CPU/RSS/IO during the step, from the host sampler
+    resources: Optional[Dict[str, Any]] = None
+    
     def finish(self) -> float:
         """Mark the step as finished and return total duration."""
         self.end_time = time.perf_counter()
@@ -67,33 +95,208 @@ class StepTiming:
             'automation_duration': self.automation_duration,
             'tool_calls': self.tool_calls,
             'error_occurred': self.error_occurred,
-            'error_message': self.error_message
+            'error_message': self.error_message,
+            'resources': self.resources
         }
 
-class TimingCollector:
-    """Central collector for all timing data."""
+class LogHistogram:
+    """
+    Fixed-size histogram with logarithmic buckets.
+
+    Memory does not depend on how many values are recorded, and percentiles are a
+    single pass over the buckets.
+    """
+    
+    _log_growth = math.log(HISTOGRAM_GROWTH)
+    
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * HISTOGRAM_BUCKETS))
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    @staticmethod
+    def bucket_for(value: float) -> int:
+        if value <= HISTOGRAM_MIN_VALUE:
+            return 0
+        index = int(math.log(value / HISTOGRAM_MIN_VALUE) / LogHistogram._log_growth) + 1
+        return min(index, HISTOGRAM_BUCKETS - 1)
+    
+    @staticmethod
+    def bucket_value(index: int) -> float:
+        """Representative (geometric middle) value of a bucket."""
+        if index == 0:
+            return HISTOGRAM_MIN_VALUE
+        return HISTOGRAM_MIN_VALUE * HISTOGRAM_GROWTH ** (index - 0.5)
+    
+    def record(self, value: float):
+        self.counts[self.bucket_for(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+    
+    def merge(self, other: "LogHistogram"):
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """Approximate q-th percentile (0-100), clamped to the observed range."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+    
+    def to_dict(self) -> Dict[str, Any]:
+        if not self.count:
+            return {'count': 0}
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'max': self.max,
+            'total': self.total
+        }
+        for q in PERCENTILES:
+            summary[f'p{q}'] = self.percentile(q)
+        return summary
+
+
+class WindowedHistogram:
+    """An all-time histogram plus one-minute slices for sliding-window queries."""
     
     def __init__(self):
+        self.all_time = LogHistogram()
+        self._slices: Deque[Tuple[int, LogHistogram]] = deque(maxlen=WINDOW_SLICES)
+    
+    def record(self, value: float, now: Optional[float] = None):
+        self.all_time.record(value)
+        slice_id = int((now if now is not None else time.monotonic()) // WINDOW_SLICE_SECONDS)
+        if not self._slices or self._slices[-1][0] != slice_id:
+            self._slices.append((slice_id, LogHistogram()))
+        self._slices[-1][1].record(value)
+    
+    def snapshot(self, window: Optional[float] = None, now: Optional[float] = None) -> LogHistogram:
+        """All-time histogram, or the merge of the slices inside the last `window` seconds."""
+        if window is None:
+            return self.all_time
+        oldest = int(((now if now is not None else time.monotonic()) - window) // WINDOW_SLICE_SECONDS)
+        merged = LogHistogram()
+        for slice_id, histogram in self._slices:
+            if slice_id >= oldest:
+                merged.merge(histogram)
+        return merged
+
+
+class TimingCollector:
+    """
+    Timing data for one run, or the aggregate of all runs.
+
+    A run's collector forwards completed steps and every measurement to its `parent`
+    (the process-wide aggregate), but never shares its current step with other runs.
+    """
+    
+    def __init__(
+        self,
+        max_history: int = MAX_STEP_HISTORY,
+        run_id: Optional[str] = None,
+        test_id: Optional[str] = None,
+        parent: Optional["TimingCollector"] = None,
+    ):
+        self.run_id = run_id
+        self.test_id = test_id
+        self.parent = parent
+        self.started_at = time.time()
         self._lock = Lock()
         self._current_step: Optional[StepTiming] = None
-        self._step_history: List[StepTiming] = []
+        self._step_history: Deque[StepTiming] = deque(maxlen=max_history)
         self._active_timings: Dict[str, TimingRecord] = {}
+        # One histogram per metric: step, screenshot, anthropic_call, tool:<name>, ...
+        self._histograms: Dict[str, WindowedHistogram] = {}
+        self._longest_step: Optional[Tuple[int, float]] = None
         self.logger = logging.getLogger('timing')
     
+    def _observe(self, metric: str, duration: float):
+        """Record a duration on a metric's histogram. Caller holds the lock."""
+        histogram = self._histograms.get(metric)
+        if histogram is None:
+            histogram = self._histograms[metric] = WindowedHistogram()
+        histogram.record(duration)
+        if self.parent:
+            self.parent._absorb_measurement(metric, duration)
+    
+    def _archive_step(self, step: StepTiming):
+        """Add a finished step to history and the step histogram. Caller holds the lock."""
+        self._step_history.append(step)
+        if step.total_duration is not None:
+            self._observe("step", step.total_duration)
+            if self._longest_step is None or step.total_duration > self._longest_step[1]:
+                self._longest_step = (step.step_number, step.total_duration)
+    
+    def _complete_step(self, step: StepTiming):
+        """Archive a finished step of this collector. Called without the lock; sampling reads /proc."""
+        step.resources = host_sampler.summarize(step.start_time, step.end_time)
+        if step.resources and step.resources['saturated']:
+            self.logger.warning(f"Step {step.step_number} ran on a saturated host: {step.resources['saturation']}")
+        if step.total_duration is not None:
+            metrics.observe_step(step.total_duration, step.error_occurred)
+        # The parent's step histogram is fed through _observe, so it only gets the history entry
+        with self._lock:
+            self._archive_step(step)
+        if self.parent:
+            self.parent._absorb_step(step)
+    
+    def _absorb_measurement(self, metric: str, duration: float):
+        with self._lock:
+            self._observe(metric, duration)
+    
+    def _absorb_step(self, step: StepTiming):
+        with self._lock:
+            self._step_history.append(step)
+            if step.total_duration is not None and (
+                self._longest_step is None or step.total_duration > self._longest_step[1]
+            ):
+                self._longest_step = (step.step_number, step.total_duration)
+    
+    def reset(self):
+        """Clear all timing data in place, so every holder of this collector sees the reset."""
+        with self._lock:
+            self._current_step = None
+            self._step_history.clear()
+            self._active_timings.clear()
+            self._histograms.clear()
+            self._longest_step = None
+    
     def start_step(self, step_number: int) -> StepTiming:
         """Start timing a new step."""
+        host_sampler.ensure_started()
+        unfinished = None
         with self._lock:
             if self._current_step and not self._current_step.end_time:
                 # Finish previous step if not completed
                 self._current_step.finish()
-                self._step_history.append(self._current_step)
+                unfinished = self._current_step
             
             self._current_step = StepTiming(
                 step_number=step_number,
                 start_time=time.perf_counter()
             )
-            self.logger.info(f"Started timing step {step_number}")
-            return self._current_step
+            step = self._current_step
+        if unfinished:
+            self._complete_step(unfinished)
+        self.logger.info(f"Started timing step {step_number}")
+        return step
     
     def finish_current_step(self, error_occurred: bool = False, error_message: Optional[str] = None) -> Optional[StepTiming]:
         """Finish timing the current step."""
@@ -104,85 +307,103 @@ class TimingCollector:
             self._current_step.error_occurred = error_occurred
             self._current_step.error_message = error_message
             duration = self._current_step.finish()
-            
-            self._step_history.append(self._current_step)
             step = self._current_step
             self._current_step = None
-            
-            self.logger.info(f"Finished step {step.step_number} in {duration:.3f}s")
-            return step
+        
+        self._complete_step(step)
+        self.logger.info(f"Finished step {step.step_number} in {duration:.3f}s")
+        return step
     
     def time_screenshot(self, duration: float):
         """Record screenshot timing for current step."""
-        if self._current_step:
-            self._current_step.screenshot_duration = duration
-            self.logger.debug(f"Screenshot took {duration:.3f}s")
+        metrics.SCREENSHOT_DURATION.observe(duration)
+        with self._lock:
+            self._observe("screenshot", duration)
+            if self._current_step:
+                self._current_step.screenshot_duration = duration
+        self.logger.debug(f"Screenshot took {duration:.3f}s")
     
     def time_anthropic_call(self, duration: float):
         """Record Anthropic API call timing for current step."""
-        if self._current_step:
-            self._current_step.anthropic_call_duration = duration
-            self.logger.debug(f"Anthropic call took {duration:.3f}s")
+        with self._lock:
+            self._observe("anthropic_call", duration)
+            if self._current_step:
+                self._current_step.anthropic_call_duration = duration
+        self.logger.debug(f"Anthropic call took {duration:.3f}s")
     
     def time_anthropic_response(self, duration: float):
         """Record Anthropic response processing timing for current step."""
-        if self._current_step:
-            self._current_step.anthropic_response_duration = duration
-            self.logger.debug(f"Anthropic response processing took {duration:.3f}s")
+        with self._lock:
+            self._observe("anthropic_response", duration)
+            if self._current_step:
+                self._current_step.anthropic_response_duration = duration
+        self.logger.debug(f"Anthropic response processing took {duration:.3f}s")
     
     def time_tool_execution(self, duration: float, tool_name: str):
         """Record tool execution timing for current step."""
-        if self._current_step:
-            self._current_step.tool_execution_duration = (
-                self._current_step.tool_execution_duration or 0
-            ) + duration
-            self._current_step.tool_calls.append(tool_name)
-            self.logger.debug(f"Tool {tool_name} took {duration:.3f}s")
+        with self._lock:
+            self._observe("tool", duration)
+            self._observe(f"tool:{tool_name}", duration)
+            if self._current_step:
+                self._current_step.tool_execution_duration = (
+                    self._current_step.tool_execution_duration or 0
+                ) + duration
+                self._current_step.tool_calls.append(tool_name)
+        self.logger.debug(f"Tool {tool_name} took {duration:.3f}s")
     
     def time_automation(self, duration: float):
         """Record automation action timing for current step."""
-        if self._current_step:
-            self._current_step.automation_duration = (
-                self._current_step.automation_duration or 0
-            ) + duration
-            self.logger.debug(f"Automation action took {duration:.3f}s")
+        with self._lock:
+            self._observe("automation", duration)
+            if self._current_step:
+                self._current_step.automation_duration = (
+                    self._current_step.automation_duration or 0
+                ) + duration
+        self.logger.debug(f"Automation action took {duration:.3f}s")
+    
+    def get_percentiles(self, window: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Count, mean, min, max and p50/p95/p99 for every metric, over all time or the
+        last `window` seconds (at one-minute granularity, up to an hour).
+        """
+        with self._lock:
+            return {
+                metric: histogram.snapshot(window).to_dict()
+                for metric, histogram in self._histograms.items()
+            }
     
-    def get_statistics(self) -> Dict[str, Any]:
+    def get_statistics(self, window: Optional[float] = None) -> Dict[str, Any]:
         """Get comprehensive timing statistics."""
+        percentiles = self.get_percentiles(window)
+        step = percentiles.get("step", {'count': 0})
+        if not step['count']:
+            return {"total_steps": 0, "percentiles": percentiles}
+        
+        stats = {
+            "total_steps": step['count'],
+            "average_step_time": step['mean'],
+            "min_step_time": step['min'],
+            "max_step_time": step['max'],
+            "total_time": step['total'],
+            "p50_step_time": step['p50'],
+            "p95_step_time": step['p95'],
+            "p99_step_time": step['p99'],
+            "percentiles": percentiles
+        }
         with self._lock:
-            if not self._step_history:
-                return {"total_steps": 0}
-            
-            durations = [step.total_duration for step in self._step_history if step.total_duration]
-            
-            if not durations:
-                return {"total_steps": len(self._step_history)}
-            
-            stats = {
-                "total_steps": len(self._step_history),
-                "average_step_time": sum(durations) / len(durations),
-                "min_step_time": min(durations),
-                "max_step_time": max(durations),
-                "total_time": sum(durations),
-                "longest_step": {
-                    "step_number": max(self._step_history, key=lambda s: s.total_duration or 0).step_number,
-                    "duration": max(durations)
+            # Longest step is tracked over the collector's lifetime
+            if self._longest_step:
+                stats["longest_step"] = {
+                    "step_number": self._longest_step[0],
+                    "duration": self._longest_step[1]
                 }
-            }
-            
-            # Average sub-timings
-            screenshot_times = [s.screenshot_duration for s in self._step_history if s.screenshot_duration]
-            anthropic_times = [s.anthropic_call_duration for s in self._step_history if s.anthropic_call_duration]
-            tool_times = [s.tool_execution_duration for s in self._step_history if s.tool_execution_duration]
-            
-            if screenshot_times:
-                stats["avg_screenshot_time"] = sum(screenshot_times) / len(screenshot_times)
-            if anthropic_times:
-                stats["avg_anthropic_time"] = sum(anthropic_times) / len(anthropic_times)
-            if tool_times:
-                stats["avg_tool_time"] = sum(tool_times) / len(tool_times)
-            
-            return stats
+        
+        # Average sub-timings
+        for metric, key in (("screenshot", "avg_screenshot_time"), ("anthropic_call", "avg_anthropic_time"), ("tool", "avg_tool_time")):
+            if percentiles.get(metric, {}).get('count'):
+                stats[key] = percentiles[metric]['mean']
+        
+        return stats
     
     def get_step_history(self) -> List[Dict[str, Any]]:
         """Get all step timing history as dictionaries."""
@@ -193,29 +414,124 @@ class TimingCollector:
         """Log current timing statistics."""
         stats = self.get_statistics()
         if stats["total_steps"] > 0:
-            self.logger.info(f"Timing Statistics: {json.dumps(stats, indent=2)}")
+            stats.pop("percentiles", None)
+            label = f" for run {self.run_id}" if self.run_id else ""
+            self.logger.info(f"Timing Statistics{label}: {json.dumps(stats, indent=2)}")
+    
+    def describe(self) -> Dict[str, Any]:
+        """Identity and progress of this collector, for listing runs."""
+        with self._lock:
+            return {
+                'run_id': self.run_id,
+                'test_id': self.test_id,
+                'started_at': self.started_at,
+                'completed_steps': len(self._step_history),
+                'current_step': self._current_step.step_number if self._current_step else None
+            }
+
+
+class CollectorRegistry:
+    """Per-run collectors keyed by run id, all feeding one aggregate collector."""
+    
+    def __init__(self, aggregate: TimingCollector, max_runs: int = MAX_RUN_COLLECTORS):
+        self.aggregate = aggregate
+        self.max_runs = max_runs
+        self._lock = Lock()
+        self._runs: "OrderedDict[str, TimingCollector]" = OrderedDict()
+    
+    def create(self, run_id: str, test_id: Optional[str] = None) -> TimingCollector:
+        collector = TimingCollector(run_id=run_id, test_id=test_id, parent=self.aggregate)
+        with self._lock:
+            self._runs[run_id] = collector
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+        return collector
+    
+    def get(self, run_id: str) -> Optional[TimingCollector]:
+        with self._lock:
+            return self._runs.get(run_id)
+    
+    def find(self, run_id: Optional[str] = None, test_id: Optional[str] = None) -> List[TimingCollector]:
+        """Collectors matching a run id and/or test id, oldest first."""
+        with self._lock:
+            return [
+                collector for collector in self._runs.values()
+                if (run_id is None or collector.run_id == run_id)
+                and (test_id is None or collector.test_id == test_id)
+            ]
+    
+    def runs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            collectors = list(self._runs.values())
+        return [collector.describe() for collector in collectors]
+    
+    def reset(self):
+        """Forget every run and clear the aggregate in place."""
+        with self._lock:
+            self._runs.clear()
+        self.aggregate.reset()
+
+# Span category and collector hook for each named operation
+_OPERATION_CATEGORIES = {
+    "screenshot": "screenshot",
+    "anthropic_call": "model",
+    "anthropic_response": "model",
+    "automation": "tool",
+}
+
+_OPERATION_RECORDERS = {
+    "screenshot": lambda collector, duration, metadata: collector.time_screenshot(duration),
+    "anthropic_call": lambda collector, duration, metadata: collector.time_anthropic_call(duration),
+    "anthropic_response": lambda collector, duration, metadata: collector.time_anthropic_response(duration),
+    "automation": lambda collector, duration, metadata: collector.time_automation(duration),
+}
+
+
+def _record_tool(collector: TimingCollector, duration: float, metadata: Dict[str, Any]):
+    collector.time_tool_execution(duration, metadata["tool_name"])
+
 
 @contextmanager
 def time_operation(collector: TimingCollector, operation_name: str, **metadata):
-    """Context manager for timing operations."""
+    """Context manager for timing operations, recorded both as a span and on the collector."""
+    is_tool = operation_name.startswith("tool_")
+    if is_tool:
+        metadata.setdefault("tool_name", operation_name)
+        recorder = _record_tool
+        category = "tool"
+    else:
+        recorder = _OPERATION_RECORDERS.get(operation_name)
+        category = _OPERATION_CATEGORIES.get(operation_name, "agent")
+
     start_time = time.perf_counter()
     try:
-        yield
+        with span(operation_name, category, **metadata) as operation_span:
+            yield operation_span
     finally:
-        duration = time.perf_counter() - start_time
-        
-        # Route to appropriate collector method based on operation name
-        if operation_name == "screenshot":
-            collector.time_screenshot(duration)
-        elif operation_name == "anthropic_call":
-            collector.time_anthropic_call(duration)
-        elif operation_name == "anthropic_response":
-            collector.time_anthropic_response(duration)
-        elif operation_name.startswith("tool_"):
-            tool_name = metadata.get("tool_name", operation_name)
-            collector.time_tool_execution(duration, tool_name)
-        elif operation_name == "automation":
-            collector.time_automation(duration)
-
-# Global timing collector instance
-timing_collector = TimingCollector()
\ No newline at end of file
+        if recorder:
+            recorder(collector, time.perf_counter() - start_time, metadata)
+
+# Process-wide aggregate of every run; also used by code running outside a run
+timing_collector = TimingCollector()
+collector_registry = CollectorRegistry(timing_collector)
+
+_active_collector: ContextVar[Optional[TimingCollector]] = ContextVar('timing_collector', default=None)
+
+
+def current_collector() -> TimingCollector:
+    """The collector of the run executing in this context, or the aggregate outside a run."""
+    return _active_collector.get() or timing_collector
+
+
+@contextmanager
+def run_timing(run_id: str, test_id: Optional[str] = None):
+    """Give the code inside (and tasks it spawns) its own collector for this run."""
+    collector = collector_registry.create(run_id, test_id)
+    token = _active_collector.set(collector)
+    try:
+        yield collector
+    finally:
+        try:
+            _active_collector.reset(token)
+        except ValueError:
+            pass
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""
+Long-lived tool collections for /tools/execute.
+
+Direct tool calls that pass a `session_id` reuse one `ToolCollection` per session, so
+the bash shell, network capture and database connections stay warm between calls.
+Sessions idle for longer than TILT_TOOL_SESSION_IDLE_SECONDS are closed by a
+background sweep.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .tools import ToolCollection, ToolVersion, TOOL_GROUPS_BY_VERSION
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+DEFAULT_IDLE_SECONDS = 15 * 60
+MAX_TOOL_SESSIONS = 32
+SWEEP_INTERVAL = 60.0
+
+
+def build_tool_collection(tool_version: ToolVersion) -> ToolCollection:
+    """The tools of a version, wired together and keeping their connections until `close`."""
+    tool_group = TOOL_GROUPS_BY_VERSION[tool_version]
+    tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
+    for tool in tool_collection.tools:
+        if tool.name == "computer":
+            tool._tool_collection = tool_collection
+        elif tool.name == "mongodb_query":
+            tool.reuse_client = True
+    return tool_collection
+
+
+@dataclass
+class ToolSession:
+    """One caller's tools; calls on a session run one at a time, like turns of a conversation."""
+    session_id: str
+    tool_version: ToolVersion
+    tools: ToolCollection
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    calls: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.session_id,
+            'tool_version': self.tool_version,
+            'calls': self.calls,
+            'busy': self.lock.locked(),
+            'created_at': self.created_at,
+            'last_used': self.last_used,
+        }
+
+
+class ToolSessionRegistry:
+    """Tool sessions keyed by id, closed after sitting idle."""
+
+    def __init__(self, idle_seconds: Optional[float] = None):
+        self.idle_seconds = idle_seconds or float(os.getenv('TILT_TOOL_SESSION_IDLE_SECONDS', DEFAULT_IDLE_SECONDS))
+        self._sessions: Dict[str, ToolSession] = {}
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def session(self, session_id: str, tool_version: ToolVersion) -> AsyncIterator[ToolCollection]:
+        """Hold a session's tools for one call, creating the session on first use."""
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError("session_id must be 1-64 letters, digits, '-' or '_'")
+        self._start_sweep()
+        tool_session = self._sessions.get(session_id)
+        if tool_session and tool_session.tool_version != tool_version:
+            # A different tool version needs different tools; start over
+            if tool_session.lock.locked():
+                raise ValueError(f"Tool session {session_id} is busy with another call")
+            await self.close(session_id)
+            tool_session = None
+        if tool_session is None:
+            if len(self._sessions) >= MAX_TOOL_SESSIONS:
+                raise ValueError("Too many open tool sessions")
+            tool_session = ToolSession(session_id, tool_version, build_tool_collection(tool_version))
+            self._sessions[session_id] = tool_session
+            logger.info(f"Opened tool session {session_id} ({tool_version})")
+        async with tool_session.lock:
+            try:
+                yield tool_session.tools
+            finally:
+                tool_session.calls += 1
+                tool_session.last_used = time.time()
+
+    def get(self, session_id: str) -> Optional[ToolSession]:
+        return self._sessions.get(session_id)
+
+    def sessions(self) -> List[ToolSession]:
+        return list(self._sessions.values())
+
+    async def close(self, session_id: str) -> bool:
+        tool_session = self._sessions.pop(session_id, None)
+        if tool_session is None:
+            return False
+        try:
+            # Closing may wait on the browser connection, so keep it off the event loop
+            await asyncio.to_thread(tool_session.tools.close)
+        except Exception as e:
+            logger.warning(f"Error closing tool session {session_id}: {e}")
+        logger.info(f"Closed tool session {session_id} after {tool_session.calls} calls")
+        return True
+
+    async def close_idle(self):
+        cutoff = time.time() - self.idle_seconds
+        idle = [
+            session_id for session_id, tool_session in self._sessions.items()
+            if tool_session.last_used < cutoff and not tool_session.lock.locked()
+        ]
+        for session_id in idle:
+            await self.close(session_id)
+
+    async def close_all(self):
+        if self._sweep_task:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        for session_id in list(self._sessions):
+            await self.close(session_id)
+
+    def _start_sweep(self):
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.create_task(self._sweep(), name="tool-session-sweep")
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                await self.close_idle()
+            except Exception as e:
+                logger.warning(f"Tool session sweep failed: {e}")
+
+
+# Global registry shared by the tool routes in this process
+tool_session_registry = ToolSessionRegistry()
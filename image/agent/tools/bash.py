@@ -2,6 +2,7 @@ import asyncio
 import os
 from typing import Any, Literal
 
+from ..displays import current_display
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
 
 
@@ -19,6 +20,9 @@ class _BashSession:
     def __init__(self):
         self._started = False
         self._timed_out = False
+        # GUI apps started from the shell open on the run's leased display
+        display = current_display.get()
+        self._env = display.env() if display else None
 
     async def start(self):
         if self._started:
@@ -32,6 +36,7 @@ class _BashSession:
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
+            env=self._env,
         )
 
         self._started = True
@@ -122,6 +127,12 @@ class BashTool20250124(BaseAnthropicTool):
             "name": self.name,
         }
 
+    def close(self):
+        """Terminate the bash shell, if one was started."""
+        if self._session and self._session._started:
+            self._session.stop()
+        self._session = None
+
     async def __call__(
         self, command: str | None = None, restart: bool = False, **kwargs
     ):
@@ -1,9 +1,12 @@
 """Collection classes for managing multiple tools."""
 
+import logging
+import time
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+from ..metrics import observe_tool_call
 from .base import (
     BaseAnthropicTool,
     ToolError,
@@ -11,6 +14,8 @@ from .base import (
     ToolResult,
 )
 
+logger = logging.getLogger(__name__)
+
 
 class ToolCollection:
     """A collection of anthropic-defined tools."""
@@ -28,7 +33,26 @@ class ToolCollection:
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
+        started = time.perf_counter()
+        outcome = "exception"
         try:
-            return await tool(**tool_input)
+            result = await tool(**tool_input)
+            outcome = "error" if result.error else "ok"
+            return result
         except ToolError as e:
+            outcome = "error"
             return ToolFailure(error=e.message)
+        finally:
+            observe_tool_call(name, time.perf_counter() - started, outcome)
+
+    def close(self):
+        """Release processes and connections held by tools that have any."""
+        for tool in self.tools:
+            close = getattr(tool, "close", None)
+            if not close:
+                continue
+            # One tool failing to close must not leak the others' resources
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"Error closing tool {tool.name}: {e}")
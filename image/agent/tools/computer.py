@@ -15,19 +15,33 @@ from .run import run
 
 # Import timing utilities - use relative import
 try:
-    from ..timing_utils import timing_collector, time_operation
+    from ..timing_utils import current_collector, time_operation
+    from ..tracing import span
+    from ..metrics import observe_screenshot
+    from ..displays import current_display
 except ImportError:
     # Fallback if timing utilities aren't available
+    from contextlib import nullcontext
+    from contextvars import ContextVar
+
     class DummyCollector:
         def time_screenshot(self, duration): pass
         def time_automation(self, duration): pass
     
-    timing_collector = DummyCollector()
+    def current_collector():
+        return DummyCollector()
     
     def time_operation(collector, operation_name, **metadata):
-        from contextlib import nullcontext
         return nullcontext()
 
+    def span(name, category="agent", **attributes):
+        return nullcontext()
+
+    def observe_screenshot(size_bytes):
+        pass
+
+    current_display = ContextVar("current_display", default=None)
+
 OUTPUT_DIR = "/tmp/outputs"
 
 TYPING_DELAY_MS = 12
@@ -126,10 +140,13 @@ class BaseComputerTool:
     def __init__(self):
         super().__init__()
 
-        self.width = int(os.getenv("WIDTH") or 0)
-        self.height = int(os.getenv("HEIGHT") or 0)
+        # A display leased from the pool takes precedence over the shared desktop
+        display = current_display.get()
+        self.width = display.width if display else int(os.getenv("WIDTH") or 0)
+        self.height = display.height if display else int(os.getenv("HEIGHT") or 0)
         assert self.width and self.height, "WIDTH, HEIGHT must be set"
-        if (display_num := os.getenv("DISPLAY_NUM")) is not None:
+        display_num = str(display.display_num) if display else os.getenv("DISPLAY_NUM")
+        if display_num is not None:
             self.display_num = int(display_num)
             self._display_prefix = f"DISPLAY=:{self.display_num} "
         else:
@@ -155,11 +172,11 @@ class BaseComputerTool:
             x, y = self.validate_and_get_coordinates(coordinate)
 
             if action == "mouse_move":
-                with time_operation(timing_collector, "automation"):
+                with time_operation(current_collector(), "automation"):
                     command_parts = [self.xdotool, f"mousemove --sync {x} {y}"]
                     return await self.shell(" ".join(command_parts))
             elif action == "left_click_drag":
-                with time_operation(timing_collector, "automation"):
+                with time_operation(current_collector(), "automation"):
                     command_parts = [
                         self.xdotool,
                         f"mousedown 1 mousemove --sync {x} {y} mouseup 1",
@@ -175,11 +192,11 @@ class BaseComputerTool:
                 raise ToolError(output=f"{text} must be a string")
 
             if action == "key":
-                with time_operation(timing_collector, "automation"):
+                with time_operation(current_collector(), "automation"):
                     command_parts = [self.xdotool, f"key -- {text}"]
                     return await self.shell(" ".join(command_parts))
             elif action == "type":
-                with time_operation(timing_collector, "automation"):
+                with time_operation(current_collector(), "automation"):
                     results: list[ToolResult] = []
                     for chunk in chunks(text, TYPING_GROUP_SIZE):
                         command_parts = [
@@ -195,7 +212,8 @@ class BaseComputerTool:
                     total_chars = len(text)
                     typing_duration = (total_chars * TYPING_DELAY_MS) / 1000.0  # Convert to seconds
                     buffer_time = 0.5  # Additional buffer to ensure completion
-                    await asyncio.sleep(typing_duration + buffer_time)
+                    with span("settle", "settle", delay=typing_duration + buffer_time):
+                        await asyncio.sleep(typing_duration + buffer_time)
                     
                     screenshot_base64 = (await self.screenshot()).base64_image
                     return ToolResult(
@@ -233,7 +251,7 @@ class BaseComputerTool:
                 )
                 return result.replace(output=f"X={x},Y={y}")
             else:
-                with time_operation(timing_collector, "automation"):
+                with time_operation(current_collector(), "automation"):
                     command_parts = [self.xdotool, f"click {CLICK_BUTTONS[action]}"]
                     return await self.shell(" ".join(command_parts))
 
@@ -249,7 +267,7 @@ class BaseComputerTool:
 
     async def screenshot(self):
         """Take a screenshot of the current screen and return the base64 encoded image."""
-        with time_operation(timing_collector, "screenshot"):
+        with time_operation(current_collector(), "screenshot") as screenshot_span:
             output_dir = Path(OUTPUT_DIR)
             output_dir.mkdir(parents=True, exist_ok=True)
             path = output_dir / f"screenshot_{uuid4().hex}.png"
@@ -271,8 +289,12 @@ class BaseComputerTool:
                 )
 
             if path.exists():
+                image_bytes = path.read_bytes()
+                observe_screenshot(len(image_bytes))
+                if screenshot_span:
+                    screenshot_span.set_attribute("bytes", len(image_bytes))
                 return result.replace(
-                    base64_image=base64.b64encode(path.read_bytes()).decode()
+                    base64_image=base64.b64encode(image_bytes).decode()
                 )
             raise ToolError(f"Failed to take screenshot: {result.error}")
 
@@ -283,7 +305,8 @@ class BaseComputerTool:
 
         if take_screenshot:
             # delay to let things settle before taking a screenshot
-            await asyncio.sleep(self._screenshot_delay)
+            with span("settle", "settle", delay=self._screenshot_delay):
+                await asyncio.sleep(self._screenshot_delay)
             base64_image = (await self.screenshot()).base64_image
 
         return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
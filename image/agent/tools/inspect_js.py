@@ -5,6 +5,7 @@ import pychrome
 import warnings
 from typing import Dict, Any, Optional
 from anthropic.types.beta import BetaToolUnionParam
+from ..displays import devtools_url
 from .base import BaseAnthropicTool, ToolResult
 
 # Suppress pychrome WebSocket warnings/errors during cleanup
@@ -41,7 +42,7 @@ class JavaScriptInspectorTool(BaseAnthropicTool):
     def _get_chromium_browser(self) -> Optional[pychrome.Browser]:
         """Get Chromium browser instance."""
         try:
-            browser = pychrome.Browser(url="http://localhost:9222")
+            browser = pychrome.Browser(url=devtools_url())
             return browser
         except Exception:
             return None
@@ -6,6 +6,7 @@ import warnings
 import time
 from typing import Dict, Any, List, Optional
 from anthropic.types.beta import BetaToolUnionParam
+from ..displays import devtools_url
 from .base import BaseAnthropicTool, ToolResult
 
 # Suppress pychrome WebSocket warnings/errors during cleanup
@@ -50,7 +51,7 @@ class NetworkInspectorTool(BaseAnthropicTool):
     def _get_chromium_browser(self) -> Optional[pychrome.Browser]:
         """Get Chromium browser instance."""
         try:
-            browser = pychrome.Browser(url="http://localhost:9222")
+            browser = pychrome.Browser(url=devtools_url())
             return browser
         except Exception:
             return None
@@ -150,6 +151,11 @@ class NetworkInspectorTool(BaseAnthropicTool):
         self._captured_requests.clear()
         return {"output": f"Cleared {count} captured requests"}
     
+    def close(self):
+        """Detach from the browser tab if monitoring is running."""
+        if self._monitoring:
+            self._stop_monitoring()
+
     def _stop_monitoring(self) -> Dict[str, Any]:
         """Stop network monitoring."""
         self._monitoring = False
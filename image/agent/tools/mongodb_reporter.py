@@ -2,9 +2,9 @@ import os
 import json
 from datetime import datetime, timezone
 from typing import Literal, Any, Dict, Optional
-from pymongo import MongoClient
 from bson import ObjectId
 
+from .. import db
 from .base import BaseAnthropicTool, ToolError, ToolResult
 
 
@@ -18,12 +18,6 @@ class MongoDBReporterTool(BaseAnthropicTool):
     name: Literal["mongodb_reporter"] = "mongodb_reporter"
     api_type: Literal["computer_20241022"] = "computer_20241022"
     
-    def __init__(self):
-        super().__init__()
-        self.client = MongoClient('mongodb://localhost:27017/')
-        self.db = self.client.tilt
-        self.tests_collection = self.db.tests
-    
     async def __call__(
         self,
         action: Literal["report_progress", "report_result", "report_error", "add_metadata"],
@@ -44,7 +38,7 @@ class MongoDBReporterTool(BaseAnthropicTool):
                 return ToolResult(error="No test ID provided - test_id parameter is required")
             
             # Validate test exists
-            test = self.tests_collection.find_one({"_id": ObjectId(test_id)})
+            test = await db.find_test(test_id)
             if not test:
                 return ToolResult(error=f"Test {test_id} not found")
             
@@ -105,25 +99,22 @@ class MongoDBReporterTool(BaseAnthropicTool):
                 return ToolResult(output=f"Progress report ignored - only final results are saved to history")
             
             # Check if there's already execution data saved by the frontend
-            existing_test = self.tests_collection.find_one({"_id": ObjectId(test_id)})
+            existing_test = await db.find_test(test_id)
             
             if existing_test and existing_test.get("lastRun"):
                 # Frontend has already saved execution data - just update the status
-                update_result = self.tests_collection.update_one(
-                    {"_id": ObjectId(test_id)},
-                    {
-                        "$set": {
-                            "lastRun.status": "completed" if action == "report_result" else "error",
-                            "updated_at": timestamp
-                        }
+                updated = await db.update_test(test_id, {
+                    "$set": {
+                        "lastRun.status": "completed" if action == "report_result" else "error",
+                        "updated_at": timestamp
                     }
-                )
+                })
                 
                 # Also update the history entry status if it exists
                 if existing_test.get("history"):
                     # Update the last history entry status
-                    self.tests_collection.update_one(
-                        {"_id": ObjectId(test_id)},
+                    await db.update_test(
+                        test_id,
                         {
                             "$set": {
                                 "history.$[elem].status": "completed" if action == "report_result" else "error"
@@ -133,23 +124,20 @@ class MongoDBReporterTool(BaseAnthropicTool):
                     )
             else:
                 # No existing execution data - save a minimal completion entry  
-                update_result = self.tests_collection.update_one(
-                    {"_id": ObjectId(test_id)},
-                    {
-                        "$set": {
-                            "lastRun": history_entry,
-                            "updated_at": timestamp
-                        },
-                        "$push": {
-                            "history": {
-                                "$each": [history_entry],
-                                "$slice": -50  # Keep only last 50 runs
-                            }
+                updated = await db.update_test(test_id, {
+                    "$set": {
+                        "lastRun": history_entry,
+                        "updated_at": timestamp
+                    },
+                    "$push": {
+                        "history": {
+                            "$each": [history_entry],
+                            "$slice": -50  # Keep only last 50 runs
                         }
                     }
-                )
+                })
             
-            if update_result.modified_count > 0:
+            if updated:
                 return ToolResult(output=f"Test execution saved with history for test {test_id}")
             else:
                 return ToolResult(error=f"Failed to update test {test_id}")
@@ -196,7 +184,3 @@ Examples:
                 "required": ["action", "data"]
             }
         }
-    
-    def __del__(self):
-        if hasattr(self, 'client'):
-            self.client.close()
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""
+Hierarchical span tracing for agent runs.
+
+Spans nest through a contextvar (run -> step -> model call / tool -> subprocess,
+screenshot, settle, MongoDB op), carry attributes and the run's correlation id, and
+export as Chrome trace-event JSON (open in Perfetto or chrome://tracing) or OTLP JSON.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger('timing')
+
+# Finished spans kept in memory for export
+MAX_FINISHED_SPANS = 50000
+
+
+@dataclass
+class Span:
+    """A timed, attributed unit of work within a run."""
+    name: str
+    category: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    thread_id: int = field(default_factory=threading.get_ident)
+    _start_perf_ns: int = field(default_factory=time.perf_counter_ns, repr=False)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def finish(self):
+        # Wall-clock start plus a monotonic duration, so clock steps can't produce negative spans
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._start_perf_ns)
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Duration in seconds, or None while the span is open."""
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'category': self.category,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+def current_span() -> Optional[Span]:
+    """The innermost open span in this context, if any."""
+    return _current_span.get()
+
+
+class Tracer:
+    """Records finished spans and exports them per run."""
+
+    def __init__(self, max_spans: int = MAX_FINISHED_SPANS):
+        self._lock = threading.Lock()
+        self._finished: deque = deque(maxlen=max_spans)
+
+    @contextmanager
+    def span(self, name: str, category: str = "agent", trace_id: Optional[str] = None, **attributes) -> Iterator[Span]:
+        """
+        Open a child of the current span (or a new root when there is none).
+        `trace_id` starts a new correlation id; otherwise it is inherited from the parent.
+        """
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            category=category,
+            trace_id=trace_id or (parent.trace_id if parent else uuid.uuid4().hex),
+            parent_id=parent.span_id if parent and not trace_id else None,
+            attributes=dict(attributes),
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.finish()
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # Closed from another context (e.g. an async generator finalized elsewhere)
+                pass
+            with self._lock:
+                self._finished.append(span)
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        with self._lock:
+            return [span for span in self._finished if trace_id is None or span.trace_id == trace_id]
+
+    def trace_ids(self) -> List[str]:
+        """Correlation ids of recorded runs, oldest first."""
+        with self._lock:
+            return list(dict.fromkeys(span.trace_id for span in self._finished))
+
+    def clear(self):
+        with self._lock:
+            self._finished.clear()
+
+    def export_chrome(self, trace_id: Optional[str] = None) -> Dict[str, Any]:
+        """Chrome trace-event JSON: one complete ('X') event per span, one track per run."""
+        spans = self.spans(trace_id)
+        lanes = {tid: index + 1 for index, tid in enumerate(dict.fromkeys(span.trace_id for span in spans))}
+        events: List[Dict[str, Any]] = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": lane, "args": {"name": f"run {tid}"}}
+            for tid, lane in lanes.items()
+        ]
+        for span in spans:
+            args = {**span.attributes, "span_id": span.span_id, "parent_id": span.parent_id}
+            if span.error:
+                args["error"] = span.error
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": os.getpid(),
+                "tid": lanes[span.trace_id],
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_otlp(self, trace_id: Optional[str] = None) -> Dict[str, Any]:
+        """OTLP/JSON trace export, loadable by OpenTelemetry collectors."""
+        otlp_spans = []
+        for span in self.spans(trace_id):
+            otlp_span = {
+                "traceId": span.trace_id.ljust(32, "0")[:32],
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [
+                    {"key": "category", "value": {"stringValue": span.category}},
+                    *(_otlp_attribute(key, value) for key, value in span.attributes.items()),
+                ],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            otlp_spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "tilt-agent"}}]},
+                "scopeSpans": [{"scope": {"name": "agent.tracing"}, "spans": otlp_spans}],
+            }]
+        }
+
+    def write_run(self, trace_id: str, directory: Optional[str] = None) -> List[str]:
+        """
+        Write a run's Chrome and OTLP files to `directory` (default TILT_TRACE_DIR).
+        Does nothing when no directory is configured.
+        """
+        directory = directory or os.getenv('TILT_TRACE_DIR')
+        if not directory:
+            return []
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for suffix, payload in (("trace.json", self.export_chrome(trace_id)), ("otlp.json", self.export_otlp(trace_id))):
+            path = os.path.join(directory, f"{trace_id}.{suffix}")
+            with open(path, 'w') as f:
+                json.dump(payload, f, default=str)
+            paths.append(path)
+        logger.info(f"Wrote trace files for run {trace_id}: {paths}")
+        return paths
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+# Global tracer instance
+tracer = Tracer()
+
+
+def span(name: str, category: str = "agent", trace_id: Optional[str] = None, **attributes):
+    """Open a span on the global tracer."""
+    return tracer.span(name, category, trace_id=trace_id, **attributes)
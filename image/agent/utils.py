@@ -3,36 +3,26 @@ Utility functions for the tilt-agent system.
 """
 import logging
 from typing import Optional
-from pymongo import MongoClient
-from pymongo.collection import Collection
+
+from .settings import settings_service
 
 logger = logging.getLogger(__name__)
 
 
-def get_api_key_from_mongodb(connection_string: str = 'mongodb://localhost:27017/') -> Optional[str]:
+async def get_api_key_from_mongodb() -> Optional[str]:
     """
     Get the Anthropic API key from MongoDB instead of environment variables.
+    Served from the settings cache after the first read.
     
-    Args:
-        connection_string: MongoDB connection string
-        
     Returns:
         API key if found, None otherwise
-        
-    Raises:
-        ValueError: If no API key is found in the database
     """
     try:
-        client = MongoClient(connection_string)
-        db = client.tilt
-        
         # Look for API key in settings collection
-        settings_collection: Collection = db.settings
-        config_doc = settings_collection.find_one({"key": "anthropic_key"})
+        api_key = await settings_service.get_api_key()
         
-        if config_doc and config_doc.get("value"):
-            api_key = config_doc["value"]
-            logger.info("Successfully retrieved API key from MongoDB")
+        if api_key:
+            logger.debug("Retrieved API key from the settings cache")
             return api_key
         
         logger.error("No API key found in MongoDB")
@@ -69,13 +59,12 @@ def validate_api_key(api_key: Optional[str]) -> bool:
     return True
 
 
-def store_api_key_in_mongodb(api_key: str, connection_string: str = 'mongodb://localhost:27017/') -> bool:
+async def store_api_key_in_mongodb(api_key: str) -> bool:
     """
     Store the API key in MongoDB for future use.
     
     Args:
         api_key: The API key to store
-        connection_string: MongoDB connection string
         
     Returns:
         True if successfully stored, False otherwise
@@ -84,21 +73,13 @@ def store_api_key_in_mongodb(api_key: str, connection_string: str = 'mongodb://l
         if not validate_api_key(api_key):
             logger.error("Invalid API key format")
             return False
-            
-        client = MongoClient(connection_string)
-        db = client.tilt
         
         # Store or update the API key in settings collection
-        settings_collection: Collection = db.settings
-        settings_collection.replace_one(
-            {"key": "anthropic_key"},
-            {"key": "anthropic_key", "value": api_key},
-            upsert=True
-        )
+        await settings_service.set_api_key(api_key)
         
         logger.info("Successfully stored API key in MongoDB")
         return True
         
     except Exception as e:
         logger.error(f"Error storing API key in MongoDB: {e}")
-        return False
\ No newline at end of file
+        return False
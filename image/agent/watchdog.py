@@ -0,0 +1,194 @@
+"""
+Event-loop lag and blocking-call detection.
+
+A heartbeat task measures how late the event loop wakes it up. A monitor thread
+notices when the heartbeat stops beating for longer than the threshold and captures
+the loop thread's stack at that moment, which is the code holding the loop.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD_MS = 100
+HEARTBEAT_INTERVAL = 0.05
+MAX_BLOCKING_EVENTS = 200
+# Frames of the captured stack that identify a blocking call site
+SIGNATURE_FRAMES = 4
+
+LOOP_LAG = Histogram(
+    "tilt_event_loop_lag_seconds",
+    "How late the event loop ran a scheduled heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_BLOCKED = Counter(
+    "tilt_event_loop_blocked_total",
+    "Times the event loop was blocked past the watchdog threshold",
+)
+
+
+@dataclass
+class BlockingEvent:
+    """One stall of the event loop and the stack that was running when it was caught."""
+    started_at: float
+    stack: List[str]
+    duration: Optional[float] = None
+    task: Optional[str] = None
+
+    @property
+    def signature(self) -> str:
+        return " <- ".join(line.split("\n")[0].strip() for line in reversed(self.stack[-SIGNATURE_FRAMES:]))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'task': self.task,
+            'signature': self.signature,
+            'stack': self.stack
+        }
+
+
+@dataclass
+class _SiteStats:
+    count: int = 0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+    last_seen: float = field(default_factory=time.time)
+
+
+class LoopWatchdog:
+    """Watches one event loop for lag and blocking callbacks."""
+
+    def __init__(self, threshold: Optional[float] = None, interval: float = HEARTBEAT_INTERVAL):
+        self.threshold = threshold if threshold is not None else int(
+            os.getenv('TILT_LOOP_LAG_THRESHOLD_MS', DEFAULT_THRESHOLD_MS)
+        ) / 1000
+        self.interval = interval
+        self.max_lag = 0.0
+        self._lock = threading.Lock()
+        self._events: Deque[BlockingEvent] = deque(maxlen=MAX_BLOCKING_EVENTS)
+        self._sites: Dict[str, _SiteStats] = {}
+        self._last_beat = time.monotonic()
+        self._current: Optional[BlockingEvent] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start watching the running loop. Must be called from that loop."""
+        if self._heartbeat_task:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True).start()
+        logger.info(f"Event loop watchdog started (threshold {self.threshold * 1000:.0f}ms)")
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            with self._lock:
+                self._last_beat = now
+                if self._current is not None:
+                    self._finish_current(lag)
+
+    def _finish_current(self, lag: float):
+        """Close the stall in progress now that the loop is running again. Caller holds the lock."""
+        event = self._current
+        event.duration = lag
+        stats = self._sites.setdefault(event.signature, _SiteStats())
+        stats.count += 1
+        stats.total_duration += lag
+        stats.max_duration = max(stats.max_duration, lag)
+        stats.last_seen = time.time()
+        self._current = None
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f}ms at {event.signature}")
+
+    def _monitor(self):
+        while not self._stopped.wait(self.interval / 2):
+            with self._lock:
+                stalled = time.monotonic() - self._last_beat - self.interval
+                if stalled < self.threshold or self._current is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                event = BlockingEvent(
+                    started_at=time.time() - stalled,
+                    stack=traceback.format_stack(frame),
+                    task=self._running_task_name(),
+                )
+                self._current = event
+                self._events.append(event)
+            LOOP_BLOCKED.inc()
+
+    def _running_task_name(self) -> Optional[str]:
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            return None
+        return task.get_name() if task else None
+
+    def report(self) -> Dict[str, Any]:
+        """Recent stalls plus call sites ranked by total blocked time."""
+        with self._lock:
+            events = [event.to_dict() for event in self._events]
+            sites = sorted(
+                (
+                    {
+                        'signature': signature,
+                        'count': stats.count,
+                        'total_duration': stats.total_duration,
+                        'max_duration': stats.max_duration,
+                        'last_seen': stats.last_seen
+                    }
+                    for signature, stats in self._sites.items()
+                ),
+                key=lambda site: site['total_duration'],
+                reverse=True,
+            )
+        return {
+            'running': self._heartbeat_task is not None,
+            'threshold': self.threshold,
+            'max_lag': self.max_lag,
+            'blocked_count': len(events),
+            'sites': sites,
+            'events': events
+        }
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._sites.clear()
+            self._current = None
+            self.max_lag = 0.0
+
+
+# Global watchdog for the API service's event loop
+loop_watchdog = LoopWatchdog()
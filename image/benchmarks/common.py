@@ -0,0 +1,179 @@
+"""
+Shared helpers for the benchmark scripts: summaries, result files, baseline checks and
+the throwaway X display the benchmarks capture.
+"""
+
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def percentiles(values: Iterable[float], points=(50, 95, 99)) -> Dict[str, Any]:
+    """Count, mean, min, max and nearest-rank percentiles of a list of values."""
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    summary = {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+    for point in points:
+        rank = max(1, math.ceil(len(ordered) * point / 100))
+        summary[f"p{point}"] = ordered[rank - 1]
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def write_results(path: Optional[str], results: Dict[str, Any]):
+    """Write results as JSON to `path`, or print them when no path is given."""
+    payload = json.dumps(results, indent=2, default=str)
+    if path:
+        with open(path, "w") as f:
+            f.write(payload + "\n")
+        print(f"Wrote results to {path}")
+    else:
+        print(payload)
+
+
+def _lookup(results: Dict[str, Any], dotted: str) -> Optional[float]:
+    value: Any = results
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare_to_baseline(
+    results: Dict[str, Any],
+    baseline_path: str,
+    metrics: Dict[str, str],
+    tolerance: float,
+) -> List[str]:
+    """
+    Compare `results` with a stored baseline. `metrics` maps dotted paths to 'lower'
+    or 'higher' (the better direction). Returns one message per regression beyond
+    `tolerance` (a fraction, e.g. 0.2 for 20%).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for path, better in metrics.items():
+        current, previous = _lookup(results, path), _lookup(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = change > tolerance if better == "lower" else change < -tolerance
+        marker = "REGRESSION" if worse else "ok"
+        print(f"{marker:>10}  {path}: {previous:.4g} -> {current:.4g} ({change:+.1%})")
+        if worse:
+            regressions.append(f"{path} changed {change:+.1%} (baseline {previous:.4g}, now {current:.4g})")
+    return regressions
+
+
+def exit_on_regressions(regressions: List[str]):
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond tolerance:", file=sys.stderr)
+        for regression in regressions:
+            print(f"  - {regression}", file=sys.stderr)
+        sys.exit(1)
+
+
+TEST_PAGE = """<!doctype html>
+<html><head><title>Benchmark page</title></head>
+<body style="font-family: sans-serif; margin: 40px">
+<h1>tilt benchmark</h1>
+<p>A static page so screenshots have realistic content.</p>
+<input id="field" placeholder="Type here" style="font-size: 24px; width: 400px">
+<button onclick="document.getElementById('out').textContent = 'clicked'">Click me</button>
+<p id="out"></p>
+<table border="1">%s</table>
+</body></html>
+""" % "".join(f"<tr><td>Row {i}</td><td>{'x' * 40}</td></tr>" for i in range(30))
+
+
+def start_process(stack: ExitStack, args: List[str], **kwargs) -> subprocess.Popen:
+    """Start a process that is terminated when `stack` closes."""
+    process = subprocess.Popen(args, **kwargs)
+
+    def stop():
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    stack.callback(stop)
+    return process
+
+
+def wait_for(check, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {what}")
+
+
+def start_display(stack: ExitStack, display: int, width: int, height: int, log) -> Optional[str]:
+    """
+    Xvfb on `display` plus Chromium showing the static test page. Returns "page" when
+    the page is shown, "blank" without a browser, and None when Xvfb is not installed.
+    """
+    if not shutil.which("Xvfb"):
+        return None
+    start_process(stack, ["Xvfb", f":{display}", "-screen", "0", f"{width}x{height}x24", "-nolisten", "tcp"], stdout=log, stderr=log)
+    wait_for(lambda: os.path.exists(f"/tmp/.X11-unix/X{display}"), 10, "Xvfb")
+
+    browser = os.getenv("BROWSER_BINARY") or next(
+        (name for name in ("chromium", "chromium-browser", "google-chrome") if shutil.which(name)), None
+    )
+    if not browser:
+        return "blank"
+    page_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="bench-page-"))
+    page = os.path.join(page_dir, "index.html")
+    with open(page, "w") as f:
+        f.write(TEST_PAGE)
+    start_process(
+        stack,
+        [browser, "--no-sandbox", "--no-first-run", "--disable-dev-shm-usage", f"--user-data-dir={page_dir}/profile",
+         f"--window-size={width},{height}", "--kiosk", f"file://{page}"],
+        env={**os.environ, "DISPLAY": f":{display}"}, stdout=log, stderr=log,
+    )
+    time.sleep(2)
+    return "page"
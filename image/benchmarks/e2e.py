@@ -0,0 +1,287 @@
+"""
+End-to-end throughput benchmark for the API service.
+
+Starts a fake Messages API (scripted tool calls), Xvfb with a static test page in
+Chromium, a throwaway MongoDB, and the real API service pointed at the fake model
+through ANTHROPIC_BASE_URL and at the throwaway database through MONGODB_URI. It then drives concurrent chat streams,
+step-segmented streams and queued tasks, and reports:
+- steps/sec
+- client and per-phase server latency percentiles
+- bytes per turn
+- peak memory
+
+    cd image && python -m benchmarks.e2e --streams 8 --turns 10 --output e2e.json
+    python -m benchmarks.e2e --baseline e2e.json --tolerance 0.2   # exit 1 on regression
+
+Needs uvicorn, pymongo, httpx and mongod; Xvfb and Chromium are used when installed.
+The database on 27017 is never touched: keys and tasks go to a temporary mongod that
+is deleted on exit.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .common import (
+    compare_to_baseline,
+    environment,
+    exit_on_regressions,
+    percentiles,
+    start_display,
+    start_process,
+    wait_for,
+    write_results,
+)
+
+IMAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_API_KEY = "sk-ant-REDACTED"
+BENCHMARK_DISPLAY = 99
+
+STEP_INSTRUCTIONS = ["Open the benchmark page", "Click the button", "Type into the field"]
+
+# Metrics compared against a baseline and the direction that is better
+BASELINE_METRICS = {
+    "chat.steps_per_sec": "higher",
+    "chat.turn_latency.p95": "lower",
+    "chat.bytes_per_turn": "lower",
+    "steps.steps_per_sec": "higher",
+    "tasks.duration": "lower",
+    "service.phases.step.p95": "lower",
+    "service.phases.anthropic_call.p95": "lower",
+    "service.phases.screenshot.p95": "lower",
+    "service.peak_rss_bytes": "lower",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def port_open(port: int) -> bool:
+    with socket.socket() as sock:
+        sock.settimeout(0.5)
+        return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+def peak_rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def start_mongodb(stack: ExitStack, log) -> Optional[str]:
+    """Start a throwaway mongod on a free port with a temporary dbpath; None without mongod."""
+    if not shutil.which("mongod"):
+        return None
+    port = free_port()
+    dbpath = stack.enter_context(tempfile.TemporaryDirectory(prefix="bench-mongo-"))
+    start_process(stack, ["mongod", "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1"], stdout=log, stderr=log)
+    wait_for(lambda: port_open(port), 30, "mongod")
+    return f"mongodb://127.0.0.1:{port}/"
+
+
+def store_api_key(mongodb_uri: str):
+    """Store the dummy key the service will read in the throwaway database."""
+    from pymongo import MongoClient
+
+    with MongoClient(mongodb_uri) as client:
+        client.tilt.settings.update_one({"key": "anthropic_key"}, {"$set": {"value": BENCHMARK_API_KEY}}, upsert=True)
+
+
+async def drive_stream(client: httpx.AsyncClient, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one chat stream to completion, timing every event."""
+    started = time.perf_counter()
+    first_event = None
+    last_turn = started
+    turn_latencies: List[float] = []
+    events: Dict[str, int] = {}
+    received = 0
+    async with client.stream("POST", "/api/v1/chat/stream", json=body) as response:
+        async for line in response.aiter_lines():
+            received += len(line) + 1
+            if not line.startswith("data: "):
+                continue
+            now = time.perf_counter()
+            if first_event is None:
+                first_event = now - started
+            event_type = json.loads(line[6:]).get("type")
+            events[event_type] = events.get(event_type, 0) + 1
+            if event_type == "usage":
+                turn_latencies.append(now - last_turn)
+                last_turn = now
+    return {
+        "duration": time.perf_counter() - started,
+        "first_event": first_event,
+        "turn_latencies": turn_latencies,
+        "turns": events.get("usage", 0),
+        "bytes": received,
+        "events": events,
+    }
+
+
+async def drive_streams(base_url: str, streams: int, iterations: int, body: Dict[str, Any]) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        async def worker():
+            return [await drive_stream(client, body) for _ in range(iterations)]
+
+        started = time.perf_counter()
+        runs = [run for runs in await asyncio.gather(*(worker() for _ in range(streams))) for run in runs]
+        duration = time.perf_counter() - started
+
+    turns = sum(run["turns"] for run in runs)
+    received = sum(run["bytes"] for run in runs)
+    events: Dict[str, int] = {}
+    for run in runs:
+        for event_type, count in run["events"].items():
+            events[event_type] = events.get(event_type, 0) + count
+    return {
+        "runs": len(runs),
+        "duration": duration,
+        "turns": turns,
+        "steps_per_sec": turns / duration if duration else 0,
+        "time_to_first_event": percentiles(run["first_event"] for run in runs if run["first_event"] is not None),
+        "turn_latency": percentiles(latency for run in runs for latency in run["turn_latencies"]),
+        "run_duration": percentiles(run["duration"] for run in runs),
+        "bytes_per_turn": received / turns if turns else 0,
+        "events": events,
+    }
+
+
+def run_tasks(base_url: str, count: int, env: Dict[str, str]) -> Dict[str, Any]:
+    """Queue `count` tasks through the API and process them concurrently in a worker process."""
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        task_ids = []
+        for index in range(count):
+            response = client.post("/api/v1/tasks", json={
+                "instructions": STEP_INSTRUCTIONS,
+                "label": f"benchmark task {index + 1}",
+            }).json()
+            if response.get("task_id"):
+                task_ids.append(response["task_id"])
+        try:
+            worker = subprocess.run(
+                [sys.executable, "-m", "benchmarks.task_worker", *task_ids],
+                cwd=IMAGE_DIR, env=env, capture_output=True, text=True, timeout=1800,
+            )
+        finally:
+            for task_id in task_ids:
+                client.delete(f"/api/v1/tasks/{task_id}")
+    lines = [line for line in worker.stdout.splitlines() if line.startswith("{")]
+    if worker.returncode != 0 or not lines:
+        return {"error": (worker.stderr or worker.stdout)[-2000:]}
+    result = json.loads(lines[-1])
+    stats = result.pop("statistics")
+    result["phases"] = stats.get("percentiles", {})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=4, help="Concurrent chat streams")
+    parser.add_argument("--iterations", type=int, default=1, help="Sequential runs per stream")
+    parser.add_argument("--tasks", type=int, default=2, help="Concurrent queued tasks (0 to skip)")
+    parser.add_argument("--turns", type=int, default=10, help="Tool-using turns per scripted conversation")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="Seconds the fake model takes per turn")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--tool-version", default="computer_use_20250124")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Compare against this results JSON and exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    parser.add_argument("--log", default=os.path.join(tempfile.gettempdir(), "tilt-bench-e2e.log"))
+    args = parser.parse_args()
+
+    with ExitStack() as stack, open(args.log, "w") as log:
+        mongodb_uri = start_mongodb(stack, log)
+        if not mongodb_uri:
+            sys.exit("mongod is not installed; the benchmark needs its own throwaway MongoDB")
+        store_api_key(mongodb_uri)
+        display = start_display(stack, BENCHMARK_DISPLAY, args.width, args.height, log)
+
+        model_port, api_port = free_port(), free_port()
+        start_process(
+            stack,
+            [sys.executable, "-m", "benchmarks.fake_messages_api", "--port", str(model_port),
+             "--turns", str(args.turns), "--latency", str(args.model_latency)],
+            cwd=IMAGE_DIR, stdout=log, stderr=log,
+        )
+        env = {
+            **os.environ,
+            "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{model_port}",
+            "ANTHROPIC_MODEL": "benchmark-model",
+            "API_PROVIDER": "anthropic",
+            # The API service and the task worker only ever see the throwaway database
+            "MONGODB_URI": mongodb_uri,
+            "WIDTH": str(args.width),
+            "HEIGHT": str(args.height),
+            # Keep benchmark runs out of the persisted telemetry
+            "TILT_TELEMETRY": "0",
+        }
+        if display:
+            env["DISPLAY_NUM"] = str(BENCHMARK_DISPLAY)
+        env.pop("ANTHROPIC_FAST_MODEL", None)
+        service = start_process(
+            stack,
+            [sys.executable, "-m", "uvicorn", "agent.api_service.main:app", "--host", "127.0.0.1", "--port", str(api_port), "--log-level", "warning"],
+            cwd=IMAGE_DIR, env=env, stdout=log, stderr=log,
+        )
+        base_url = f"http://127.0.0.1:{api_port}"
+        wait_for(lambda: port_open(model_port), 30, "fake Messages API")
+        wait_for(lambda: httpx.get(f"{base_url}/api/v1/health").status_code == 200, 60, "API service")
+        httpx.delete(f"{base_url}/api/v1/timing/reset")
+
+        body = {
+            "messages": [{"role": "user", "content": "Run the scripted benchmark."}],
+            "tool_version": args.tool_version,
+            "only_n_most_recent_images": 3,
+        }
+        print(f"Driving {args.streams} chat stream(s) x {args.iterations}...")
+        chat = asyncio.run(drive_streams(base_url, args.streams, args.iterations, body))
+        print(f"Driving {args.streams} step-segmented stream(s)...")
+        steps = asyncio.run(drive_streams(base_url, args.streams, 1, {**body, "steps": STEP_INSTRUCTIONS}))
+        tasks = None
+        if args.tasks:
+            print(f"Running {args.tasks} queued task(s)...")
+            tasks = run_tasks(base_url, args.tasks, env)
+
+        statistics = httpx.get(f"{base_url}/api/v1/timing/statistics").json().get("data", {})
+        results = {
+            "benchmark": "e2e",
+            "environment": environment(),
+            "config": {**vars(args), "display": display},
+            "chat": chat,
+            "steps": steps,
+            "tasks": tasks,
+            "service": {
+                "phases": statistics.get("percentiles", {}),
+                "peak_rss_bytes": peak_rss_bytes(service.pid),
+            },
+        }
+
+    write_results(args.output, results)
+    print(f"chat: {chat['steps_per_sec']:.2f} steps/s, turn p95 {chat['turn_latency'].get('p95', 0):.3f}s, "
+          f"{chat['bytes_per_turn']:.0f} bytes/turn; service peak RSS {results['service']['peak_rss_bytes'] / 2**20:.1f} MiB")
+    if args.baseline:
+        exit_on_regressions(compare_to_baseline(results, args.baseline, BASELINE_METRICS, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+A local stand-in for the Anthropic Messages API that returns scripted tool calls.
+
+Each conversation gets `turns` assistant turns cycling through the actions of
+`SCRIPT` (restricted to the tools the request offers), then a final text turn that
+ends the run with `STEP PASSED`. Responses wait `latency` seconds to imitate model time.
+
+    python -m benchmarks.fake_messages_api --port 8901 --turns 10 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import uuid
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+# (tool name, input) cycled through by the scripted turns
+SCRIPT: List[tuple[str, Dict[str, Any]]] = [
+    ("computer", {"action": "screenshot"}),
+    ("computer", {"action": "mouse_move", "coordinate": [512, 384]}),
+    ("computer", {"action": "left_click"}),
+    ("computer", {"action": "type", "text": "benchmark"}),
+    ("bash", {"command": "echo benchmark"}),
+]
+
+# Characters per token used to estimate input usage from the request body
+CHARS_PER_TOKEN = 4
+
+
+def create_app(turns: int, latency: float) -> FastAPI:
+    app = FastAPI(title="Fake Messages API")
+    app.state.requests = 0
+
+    @app.post("/v1/messages")
+    async def create_message(request: Request):
+        body = await request.body()
+        payload = json.loads(body)
+        app.state.requests += 1
+        await asyncio.sleep(latency)
+
+        offered = {tool.get("name") for tool in payload.get("tools", [])}
+        script = [step for step in SCRIPT if step[0] in offered] or SCRIPT
+        assistant_turns = sum(1 for message in payload["messages"] if message["role"] == "assistant")
+
+        if assistant_turns < turns:
+            name, tool_input = script[assistant_turns % len(script)]
+            content = [
+                {"type": "text", "text": f"Turn {assistant_turns + 1}: using {name}."},
+                {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": name, "input": tool_input},
+            ]
+            stop_reason = "tool_use"
+        else:
+            content = [{"type": "text", "text": "Finished the scripted run.\nSTEP PASSED"}]
+            stop_reason = "end_turn"
+
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": payload.get("model", "fake-model"),
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": len(body) // CHARS_PER_TOKEN,
+                "output_tokens": 40,
+                "cache_creation_input_tokens": 0,
+                "cache_read_input_tokens": 0,
+            },
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--turns", type=int, default=10, help="Tool-using turns before the final answer")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds each response waits")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.turns, args.latency), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Microbenchmarks for the per-turn conversation helpers in agent/loop.py.
+
+Builds synthetic histories of 10 to 500 turns (assistant tool_use + user tool_result
+with a screenshot-sized base64 image) and measures time per call and peak allocation
+(tracemalloc) of:
+- _maybe_filter_to_n_most_recent_images: first pass over a full history, and the
+  steady state where only the kept images plus the new one remain
+- _inject_prompt_caching
+- _make_api_tool_result
+- _response_to_params
+
+Results are checked against benchmarks/loop_budgets.json; any case over budget exits 1.
+
+    cd image && python -m benchmarks.loop_micro
+    python -m benchmarks.loop_micro --turns 10 100 --output loop.json
+    python -m benchmarks.loop_micro --update-budgets   # after an intended change
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from .common import environment, percentiles, write_results
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loop_budgets.json")
+TURN_COUNTS = (10, 50, 100, 250, 500)
+# A 1024x768 desktop PNG is typically 150-400 KB
+SCREENSHOT_BYTES = 250_000
+# Distinct screenshots cycled through each history; the helpers never copy image data,
+# so sharing them keeps memory bounded without changing what is measured
+SCREENSHOT_POOL = 8
+# Defaults of the chat endpoint
+IMAGES_TO_KEEP = 3
+MIN_REMOVAL_THRESHOLD = 10
+# Headroom written by --update-budgets; time is noisy across machines, allocations are not
+TIME_HEADROOM = 3.0
+ALLOC_HEADROOM = 1.25
+# Floor for time budgets so sub-microsecond cases do not fail on timer noise
+TIME_FLOOR_US = 10.0
+
+
+def make_screenshots(size: int, count: int) -> List[str]:
+    rng = random.Random(0)
+    return [base64.b64encode(rng.randbytes(size)).decode() for _ in range(count)]
+
+
+def make_history(turns: int, screenshots: List[str]) -> List[Dict[str, Any]]:
+    """A conversation of `turns` tool-using turns, each with a screenshot result."""
+    from agent.loop import _make_api_tool_result
+    from agent.tools import ToolResult
+
+    messages: List[Dict[str, Any]] = [{"role": "user", "content": "Run the test instructions."}]
+    for turn in range(turns):
+        tool_use_id = f"toolu_{turn:024d}"
+        messages.append({"role": "assistant", "content": [
+            {"type": "text", "text": f"Turn {turn + 1}: clicking the next element."},
+            {"type": "tool_use", "id": tool_use_id, "name": "computer",
+             "input": {"action": "left_click", "coordinate": [512, 384]}},
+        ]})
+        result = ToolResult(output="Clicked", base64_image=screenshots[turn % len(screenshots)])
+        messages.append({"role": "user", "content": [_make_api_tool_result(result, tool_use_id)]})
+    return messages
+
+
+def copy_history(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copy the message and block structure (the helpers mutate it) while sharing strings."""
+    copied = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            content = [
+                {**block, "content": list(block["content"])} if block.get("type") == "tool_result" else dict(block)
+                for block in content
+            ]
+        copied.append({**message, "content": content})
+    return copied
+
+
+def make_response(with_thinking: bool):
+    from anthropic.types.beta import BetaMessage
+
+    content: List[Dict[str, Any]] = []
+    if with_thinking:
+        content.append({"type": "thinking", "thinking": "The button is in the top right. " * 20, "signature": "sig" * 50})
+    content.append({"type": "text", "text": "I'll click the submit button."})
+    content.append({"type": "tool_use", "id": "toolu_000000000000000000000001", "name": "computer",
+                    "input": {"action": "left_click", "coordinate": [900, 40]}})
+    return BetaMessage.model_validate({
+        "id": "msg_benchmark", "type": "message", "role": "assistant", "model": "benchmark",
+        "content": content, "stop_reason": "tool_use", "stop_sequence": None,
+        "usage": {"input_tokens": 1000, "output_tokens": 50},
+    })
+
+
+def measure(run: Callable[[Any], Any], prepare: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    """Time `run(prepare())` per call, excluding `prepare`, and its peak allocation."""
+    inputs = [prepare() for _ in range(iterations)]
+    timings = []
+    for value in inputs:
+        started = time.perf_counter()
+        run(value)
+        timings.append(time.perf_counter() - started)
+
+    value = prepare()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run(value)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    summary = percentiles(timing * 1e6 for timing in timings)
+    return {
+        "time_us": summary,
+        "alloc_peak_bytes": peak,
+    }
+
+
+def run_cases(turn_counts, screenshot_bytes: int, iterations: int) -> Dict[str, Dict[str, Any]]:
+    from agent.loop import (
+        _inject_prompt_caching,
+        _make_api_tool_result,
+        _maybe_filter_to_n_most_recent_images,
+        _response_to_params,
+    )
+    from agent.tools import ToolResult
+
+    screenshots = make_screenshots(screenshot_bytes, SCREENSHOT_POOL)
+    cases: Dict[str, Dict[str, Any]] = {}
+
+    for turns in turn_counts:
+        history = make_history(turns, screenshots)
+        cases[f"filter_images_first_pass/{turns}"] = measure(
+            lambda messages: _maybe_filter_to_n_most_recent_images(messages, IMAGES_TO_KEEP, MIN_REMOVAL_THRESHOLD),
+            lambda: copy_history(history), iterations,
+        )
+
+        # What every turn after the first sees: old images already removed, one new one
+        steady = copy_history(history)
+        _maybe_filter_to_n_most_recent_images(steady, IMAGES_TO_KEEP, 1)
+        steady.append({"role": "assistant", "content": [dict(history[-2]["content"][1], id="toolu_new")]})
+        steady.append({"role": "user", "content": [_make_api_tool_result(ToolResult(base64_image=screenshots[0]), "toolu_new")]})
+        cases[f"filter_images_steady/{turns}"] = measure(
+            lambda messages: _maybe_filter_to_n_most_recent_images(messages, IMAGES_TO_KEEP, MIN_REMOVAL_THRESHOLD),
+            lambda: copy_history(steady), iterations,
+        )
+
+        cases[f"inject_prompt_caching/{turns}"] = measure(
+            _inject_prompt_caching, lambda: copy_history(history), iterations,
+        )
+
+    results = {
+        "screenshot": ToolResult(output="Took screenshot", base64_image=screenshots[0]),
+        "text": ToolResult(output="benchmark\n" * 50, system="tool must be restarted"),
+        "error": ToolResult(error="Command failed with exit code 1"),
+    }
+    for name, result in results.items():
+        cases[f"make_api_tool_result/{name}"] = measure(
+            lambda value: _make_api_tool_result(value, "toolu_benchmark"), lambda result=result: result, iterations,
+        )
+
+    for name, with_thinking in (("tool_use", False), ("thinking", True)):
+        response = make_response(with_thinking)
+        cases[f"response_to_params/{name}"] = measure(_response_to_params, lambda: response, iterations)
+
+    return cases
+
+
+def check_budgets(cases: Dict[str, Dict[str, Any]], budgets: Dict[str, Dict[str, float]]) -> List[str]:
+    """Compare median time and peak allocation with the stored budget of each case."""
+    failures = []
+    for name, case in cases.items():
+        budget = budgets.get(name)
+        if not budget:
+            print(f"{'no budget':>10}  {name}")
+            continue
+        median, allocated = case["time_us"]["p50"], case["alloc_peak_bytes"]
+        over = []
+        if median > budget["time_us"]:
+            over.append(f"time {median:.1f}us > {budget['time_us']:.1f}us")
+        if allocated > budget["alloc_bytes"]:
+            over.append(f"allocations {allocated} B > {budget['alloc_bytes']} B")
+        print(f"{'OVER' if over else 'ok':>10}  {name}: {median:.1f}us, {allocated} B")
+        if over:
+            failures.append(f"{name}: {', '.join(over)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, nargs="+", default=list(TURN_COUNTS), help="History lengths to build")
+    parser.add_argument("--screenshot-bytes", type=int, default=SCREENSHOT_BYTES, help="Raw size of each synthetic screenshot")
+    parser.add_argument("--iterations", type=int, default=50, help="Timed calls per case")
+    parser.add_argument("--budgets", default=BUDGETS_PATH)
+    parser.add_argument("--update-budgets", action="store_true", help="Rewrite the budgets from this run with headroom")
+    parser.add_argument("--output", help="Write results JSON here")
+    args = parser.parse_args()
+
+    cases = run_cases(args.turns, args.screenshot_bytes, args.iterations)
+
+    if args.update_budgets:
+        budgets = {
+            name: {
+                "time_us": round(max(case["time_us"]["p50"] * TIME_HEADROOM, TIME_FLOOR_US), 1),
+                "alloc_bytes": int(case["alloc_peak_bytes"] * ALLOC_HEADROOM) + 1024,
+            }
+            for name, case in cases.items()
+        }
+        with open(args.budgets, "w") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote {len(budgets)} budgets to {args.budgets}")
+
+    if args.output:
+        write_results(args.output, {
+            "benchmark": "loop_micro",
+            "environment": environment(),
+            "config": vars(args),
+            "cases": cases,
+        })
+
+    with open(args.budgets) as f:
+        failures = check_budgets(cases, json.load(f))
+    if failures:
+        print(f"{len(failures)} case(s) over budget:", file=sys.stderr)
+        for failure in failures:
+            print(f"  - {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
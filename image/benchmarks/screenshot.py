@@ -0,0 +1,282 @@
+"""
+Screenshot pipeline benchmark across capture backends, resolutions and encoders.
+
+For each screen size (the MAX_SCALING_TARGETS plus native 1080p and 1440p) a headless
+Xvfb is started showing the static test page, and the benchmark measures:
+- tool: `BaseComputerTool.screenshot` exactly as the agent runs it
+- capture backends, each producing a PNG scaled like the tool does:
+  gnome-screenshot and scrot (temp file + convert), convert (ImageMagick `x:root`),
+  memory (xwd piped through convert, no temp file) and pillow (ImageGrab, in process)
+- encoders: one raw capture re-encoded as PNG, JPEG and WebP at several qualities
+
+Each case reports latency and CPU time (this process plus its children) percentiles in
+ms, bytes produced, base64 size and overhead, and base64 encode time. Backends that are
+not installed are skipped.
+
+    cd image && python -m benchmarks.screenshot --iterations 20 --output screenshots.json
+    python -m benchmarks.screenshot --resolutions 1024x768 1920x1080 --skip-encoders
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .common import environment, percentiles, start_display, write_results
+
+SCREENSHOT_DISPLAY = 98
+NATIVE_RESOLUTIONS = {"1080p": (1920, 1080), "1440p": (2560, 1440)}
+# (format, quality); None keeps ImageMagick's default. PNG quality is zlib level * 10 + filter.
+ENCODERS: List[Tuple[str, Optional[int]]] = [
+    ("png", None),
+    ("png", 15),
+    ("png", 95),
+    ("jpeg", 60),
+    ("jpeg", 80),
+    ("jpeg", 90),
+    ("webp", 60),
+    ("webp", 80),
+    ("webp", 90),
+]
+
+
+def resolutions() -> Dict[str, Tuple[int, int]]:
+    from agent.tools.computer import MAX_SCALING_TARGETS
+
+    sizes = {name: (target["width"], target["height"]) for name, target in MAX_SCALING_TARGETS.items()}
+    sizes.update(NATIVE_RESOLUTIONS)
+    return sizes
+
+
+def shell(command: str, env: Dict[str, str]) -> bytes:
+    completed = subprocess.run(command, shell=True, env=env, capture_output=True, timeout=60)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.decode(errors="replace").strip() or f"exit {completed.returncode}")
+    return completed.stdout
+
+
+def measure(capture: Callable[[], bytes], iterations: int, warmup: int) -> Dict[str, Any]:
+    """Run `capture` repeatedly, recording wall time, CPU time and output sizes."""
+    latencies, cpu_times, encode_times, sizes, encoded_sizes = [], [], [], [], []
+    errors = 0
+    last_error = None
+    for index in range(warmup + iterations):
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_before = time.process_time()
+        started = time.perf_counter()
+        try:
+            image = capture()
+        except Exception as e:
+            errors += 1
+            last_error = str(e)[:500]
+            continue
+        latency = time.perf_counter() - started
+        cpu = time.process_time() - cpu_before
+        children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += (children_after.ru_utime - children_before.ru_utime) + (children_after.ru_stime - children_before.ru_stime)
+
+        encode_started = time.perf_counter()
+        encoded = base64.b64encode(image)
+        encode_time = time.perf_counter() - encode_started
+        if index < warmup:
+            continue
+        latencies.append(latency * 1000)
+        cpu_times.append(cpu * 1000)
+        encode_times.append(encode_time * 1000)
+        sizes.append(len(image))
+        encoded_sizes.append(len(encoded))
+
+    if not sizes:
+        return {"errors": errors, "error": last_error}
+    mean_bytes = sum(sizes) / len(sizes)
+    mean_encoded = sum(encoded_sizes) / len(encoded_sizes)
+    return {
+        "latency_ms": percentiles(latencies),
+        "cpu_ms": percentiles(cpu_times),
+        "bytes": mean_bytes,
+        "base64_bytes": mean_encoded,
+        "base64_overhead": mean_encoded / mean_bytes - 1 if mean_bytes else 0,
+        "base64_encode_ms": percentiles(encode_times),
+        "errors": errors,
+        "error": last_error,
+    }
+
+
+def capture_backends(env: Dict[str, str], display: int, size: Tuple[int, int], workdir: str) -> Dict[str, Callable[[], bytes]]:
+    """PNG captures scaled to `size`, keyed by backend, for the tools installed here."""
+    width, height = size
+    resize = f"-resize {width}x{height}!"
+    path = os.path.join(workdir, "capture.png")
+
+    def via_file(command: str) -> Callable[[], bytes]:
+        def capture() -> bytes:
+            shell(command, env)
+            shell(f"convert {path} {resize} {path}", env)
+            with open(path, "rb") as f:
+                return f.read()
+        return capture
+
+    backends: Dict[str, Callable[[], bytes]] = {}
+    if shutil.which("gnome-screenshot"):
+        backends["gnome-screenshot"] = via_file(f"gnome-screenshot -f {path} -p")
+    if shutil.which("scrot"):
+        backends["scrot"] = via_file(f"scrot -o -p {path}")
+    if shutil.which("convert"):
+        def convert() -> bytes:
+            shell(f"convert x:root {resize} png:{path}", env)
+            with open(path, "rb") as f:
+                return f.read()
+        backends["convert"] = convert
+        if shutil.which("xwd"):
+            backends["memory"] = lambda: shell(f"xwd -root -silent | convert xwd:- {resize} png:-", env)
+    try:
+        from PIL import ImageGrab
+    except ImportError:
+        ImageGrab = None
+    if ImageGrab is not None:
+        def pillow() -> bytes:
+            import io
+
+            image = ImageGrab.grab(xdisplay=f":{display}")
+            if image.size != size:
+                image = image.resize(size)
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            return buffer.getvalue()
+        backends["pillow"] = pillow
+    return backends
+
+
+def make_tool(display: int, width: int, height: int):
+    """The computer tool configured for this screen, as the agent would build it."""
+    from agent.tools.computer import ComputerTool20250124
+
+    os.environ.update({"WIDTH": str(width), "HEIGHT": str(height), "DISPLAY_NUM": str(display)})
+    return ComputerTool20250124()
+
+
+def tool_capture(tool, loop: asyncio.AbstractEventLoop) -> Callable[[], bytes]:
+    """`BaseComputerTool.screenshot` run on `loop`, returning the decoded image."""
+    from agent.tools.computer import OUTPUT_DIR
+
+    def capture() -> bytes:
+        result = loop.run_until_complete(tool.screenshot())
+        # The tool leaves its PNG in OUTPUT_DIR; don't let the benchmark fill the disk
+        for name in os.listdir(OUTPUT_DIR):
+            if name.startswith("screenshot_"):
+                os.remove(os.path.join(OUTPUT_DIR, name))
+        return base64.b64decode(result.base64_image)
+
+    return capture
+
+
+def encoder_captures(env: Dict[str, str], size: Tuple[int, int], workdir: str) -> Dict[str, Callable[[], bytes]]:
+    """Re-encode one raw capture with each format and quality, scaled to `size`."""
+    if not shutil.which("convert"):
+        return {}
+    source = os.path.join(workdir, "source.miff")
+    shell(f"convert x:root {source}", env)
+    width, height = size
+    encoders = {}
+    for image_format, quality in ENCODERS:
+        option = f"-quality {quality} " if quality is not None else ""
+        name = f"{image_format}" + (f"/q{quality}" if quality is not None else "")
+        command = f"convert {source} -resize {width}x{height}! {option}{image_format}:-"
+        encoders[name] = lambda command=command: shell(command, env)
+    return encoders
+
+
+def run_resolution(label: str, width: int, height: int, args, log) -> Dict[str, Any]:
+    from agent.tools.computer import ScalingSource
+
+    tool = make_tool(SCREENSHOT_DISPLAY, width, height)
+    scaled = tool.scale_coordinates(ScalingSource.COMPUTER, width, height)
+    result: Dict[str, Any] = {"screen": [width, height], "scaled": list(scaled)}
+    with ExitStack() as stack:
+        content = start_display(stack, SCREENSHOT_DISPLAY, width, height, log)
+        if content is None:
+            sys.exit("Xvfb is not installed")
+        result["content"] = content
+        workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="bench-screenshot-"))
+        env = {**os.environ, "DISPLAY": f":{SCREENSHOT_DISPLAY}"}
+
+        print(f"{label} ({width}x{height} -> {scaled[0]}x{scaled[1]})")
+        loop = asyncio.new_event_loop()
+        stack.callback(loop.close)
+        result["tool"] = measure(tool_capture(tool, loop), args.iterations, args.warmup)
+
+        result["backends"] = {}
+        for name, capture in capture_backends(env, SCREENSHOT_DISPLAY, scaled, workdir).items():
+            if args.backends and name not in args.backends:
+                continue
+            result["backends"][name] = measure(capture, args.iterations, args.warmup)
+
+        if not args.skip_encoders:
+            result["encoders"] = {
+                name: measure(capture, args.iterations, args.warmup)
+                for name, capture in encoder_captures(env, scaled, workdir).items()
+            }
+    return result
+
+
+def print_table(results: Dict[str, Any]):
+    print(f"\n{'resolution':<8} {'case':<28} {'p50 ms':>8} {'p95 ms':>8} {'cpu ms':>8} {'KiB':>8} {'b64 KiB':>8}")
+    for label, result in results.items():
+        cases = {"tool": result.get("tool", {})}
+        cases.update({f"backend {name}": case for name, case in result.get("backends", {}).items()})
+        cases.update({f"encode {name}": case for name, case in result.get("encoders", {}).items()})
+        for name, case in cases.items():
+            if "latency_ms" not in case:
+                print(f"{label:<8} {name:<28} failed: {case.get('error')}")
+                continue
+            print(f"{label:<8} {name:<28} {case['latency_ms']['p50']:>8.1f} {case['latency_ms']['p95']:>8.1f} "
+                  f"{case['cpu_ms']['p50']:>8.1f} {case['bytes'] / 1024:>8.1f} {case['base64_bytes'] / 1024:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20, help="Measured captures per case")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured captures before each case")
+    parser.add_argument("--resolutions", nargs="+", help="Subset of names (XGA, 1080p, ...) or WxH sizes")
+    parser.add_argument("--backends", nargs="+", help="Subset of capture backends to run")
+    parser.add_argument("--skip-encoders", action="store_true", help="Skip the encoder comparison")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--log", default=os.path.join(tempfile.gettempdir(), "tilt-bench-screenshot.log"))
+    args = parser.parse_args()
+
+    sizes = resolutions()
+    if args.resolutions:
+        selected = {}
+        for name in args.resolutions:
+            if name in sizes:
+                selected[name] = sizes[name]
+            else:
+                width, _, height = name.partition("x")
+                selected[name] = (int(width), int(height))
+        sizes = selected
+
+    results = {}
+    with open(args.log, "w") as log:
+        for label, (width, height) in sizes.items():
+            results[label] = run_resolution(label, width, height, args, log)
+
+    print_table(results)
+    if args.output:
+        write_results(args.output, {
+            "benchmark": "screenshot",
+            "environment": environment(),
+            "config": vars(args),
+            "resolutions": results,
+        })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Runs queued tasks concurrently through `TaskRunner.process_task` for the e2e benchmark.
+
+Started by `benchmarks.e2e` with the same environment as the API service; prints one
+JSON line with wall time, the aggregate timing statistics and peak RSS.
+
+    python -m benchmarks.task_worker <task_id> [<task_id> ...]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+
+def peak_rss_bytes() -> int:
+    """VmHWM (peak resident set) of this process."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+async def run(task_ids):
+    from agent.task_runner import TaskRunner
+    from agent.timing_utils import timing_collector
+
+    runner = TaskRunner()
+    tasks = [await runner.db.get_task_by_id(task_id) for task_id in task_ids]
+    started = time.perf_counter()
+    await asyncio.gather(*(runner.process_task(task) for task in tasks if task))
+    duration = time.perf_counter() - started
+
+    statuses = [getattr(await runner.db.get_task_by_id(task_id), "status", None) for task_id in task_ids]
+    return {
+        "tasks": len(task_ids),
+        "duration": duration,
+        "statuses": statuses,
+        "statistics": timing_collector.get_statistics(),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__, file=sys.stderr)
+        sys.exit(2)
+    result = asyncio.run(run(sys.argv[1:]))
+    print(json.dumps(result, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import time
+
+from agent.host_sampler import GroupSample, HostSample, HostSampler
+
+
+class FakeSampler(HostSampler):
+    """Returns a fixed sample instead of reading /proc."""
+
+    def sample(self):
+        return HostSample(
+            timestamp=time.perf_counter(),
+            host_cpu_percent=50.0,
+            memory_available_percent=40.0,
+            groups={"api": GroupSample(cpu_percent=20.0, rss_bytes=1024, read_bytes=0, write_bytes=0, processes=1)},
+        )
+
+
+def test_sub_interval_step_gets_the_sample_taken_at_its_end(monkeypatch):
+    monkeypatch.delenv("TILT_HOST_SAMPLING", raising=False)
+    # The thread samples once on start, then not again within the test
+    sampler = FakeSampler(interval=60)
+    sampler.available = True
+    sampler.ensure_started()
+    while not sampler._samples:
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    time.sleep(0.01)
+    end = time.perf_counter()
+    resources = sampler.summarize(start, end)
+
+    assert resources is not None
+    assert resources["samples"] == 1
+    assert resources["groups"]["api"]["cpu_percent_max"] == 20.0
+
+
+def test_summary_without_sampling_thread_is_empty():
+    sampler = FakeSampler(interval=60)
+    start = time.perf_counter()
+    assert sampler.summarize(start, time.perf_counter()) is None
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timezone
+
+from agent import db
+from agent.interrupts import MAX_PENDING_PER_KEY, Interrupt, InterruptHub
+
+
+def test_discarded_interrupt_is_redelivered_by_backfill(monkeypatch):
+    stored = [{
+        "_id": "X",
+        "test_id": "T1",
+        "message": "go left",
+        "created_at": datetime.now(timezone.utc),
+    }]
+
+    async def find_unprocessed_interrupts(key):
+        return [document for document in stored if document["test_id"] == key]
+
+    monkeypatch.setattr(db, "find_unprocessed_interrupts", find_unprocessed_interrupts)
+
+    async def run():
+        hub = InterruptHub()
+        hub.claim("T1")
+        assert hub.publish(Interrupt(key="T1", message="go left", interrupt_id="X"))
+        # The run ends before draining; the interrupt is still unprocessed in MongoDB
+        hub.discard("T1")
+        # The next run claims the key again and loads what is still unprocessed
+        hub.claim("T1")
+        await hub.backfill("T1")
+        return hub.drain("T1")
+
+    interrupts = asyncio.run(run())
+    assert [interrupt.interrupt_id for interrupt in interrupts] == ["X"]
+
+
+def test_delivered_interrupt_is_not_published_twice():
+    async def run():
+        hub = InterruptHub()
+        hub.claim("T1")
+        hub.publish(Interrupt(key="T1", message="go left", interrupt_id="X"))
+        delivered = hub.drain("T1")
+        hub.discard("T1")
+        # The change stream reports the same insert after local delivery
+        assert not hub.publish(Interrupt(key="T1", message="go left", interrupt_id="X"))
+        return delivered, hub.drain("T1")
+
+    delivered, again = asyncio.run(run())
+    assert len(delivered) == 1
+    assert again == []
+
+
+def test_interrupt_dropped_by_a_full_queue_can_be_delivered_later():
+    async def run():
+        hub = InterruptHub()
+        hub.claim("T1")
+        for index in range(MAX_PENDING_PER_KEY):
+            hub.publish(Interrupt(key="T1", message=str(index)))
+        assert not hub.publish(Interrupt(key="T1", message="late", interrupt_id="Y"))
+        hub.drain("T1")
+        return hub.publish(Interrupt(key="T1", message="late", interrupt_id="Y"))
+
+    assert asyncio.run(run())
+
+
+def test_unclaimed_keys_get_no_queue():
+    async def run():
+        hub = InterruptHub()
+        # Another process owns this test; the interrupt waits in MongoDB
+        assert not hub.publish(Interrupt(key="elsewhere", message="hi", interrupt_id="Z"))
+        return hub._queues
+
+    assert asyncio.run(run()) == {}
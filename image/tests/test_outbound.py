@@ -0,0 +1,54 @@
+import asyncio
+
+from agent.outbound import OutboundBuffer
+
+
+def _message(content, **fields):
+    return {"type": "message", "role": "assistant", "content": content, **fields}
+
+
+async def _drain(buffer):
+    buffer.close()
+    events = []
+    while (event := await buffer.get(timeout=1)) is not None:
+        events.append(event)
+    return events
+
+
+def test_text_blocks_stay_separate_while_the_client_keeps_up():
+    async def run():
+        buffer = OutboundBuffer(max_events=4)
+        await buffer.put(_message("First paragraph."))
+        await buffer.put(_message("Second paragraph."))
+        return await _drain(buffer)
+
+    events = asyncio.run(run())
+    assert [event["content"] for event in events] == ["First paragraph.", "Second paragraph."]
+
+
+def test_full_buffer_merges_text_blocks_as_paragraphs():
+    async def run():
+        buffer = OutboundBuffer(max_events=2)
+        await buffer.put({"type": "tool_use", "tool_name": "computer"})
+        await buffer.put(_message("First."))
+        await buffer.put(_message("Second."))
+        return await _drain(buffer), buffer.coalesced
+
+    events, coalesced = asyncio.run(run())
+    assert events[1]["content"] == "First.\n\nSecond."
+    assert coalesced == 1
+
+
+def test_interrupt_echo_is_never_merged_into_assistant_text():
+    async def run():
+        buffer = OutboundBuffer(max_events=2, stall_seconds=0.05)
+        await buffer.put({"type": "tool_use", "tool_name": "computer"})
+        await buffer.put(_message("Assistant reply."))
+        # No room and nothing to merge with: the put waits for the reader
+        pending = asyncio.create_task(buffer.put(_message("**User sent:** stop", echo=True)))
+        first = await buffer.get(timeout=1)
+        await pending
+        return [first] + await _drain(buffer)
+
+    events = asyncio.run(run())
+    assert [event.get("content") for event in events] == [None, "Assistant reply.", "**User sent:** stop"]
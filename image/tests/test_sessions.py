@@ -0,0 +1,75 @@
+import asyncio
+import base64
+
+from agent import artifacts
+from agent.artifacts import ArtifactStore
+from agent.sessions import HOT_MESSAGES, SessionStore
+
+
+def _turns(count, size):
+    return [{"role": "user", "content": "x" * size} for _ in range(count)]
+
+
+def _screenshot(seed):
+    data = b"\x89PNG\r\n\x1a\n" + bytes([seed]) * 1000
+    return {"role": "user", "content": [{
+        "type": "image",
+        "source": {"type": "base64", "media_type": "image/png", "data": base64.b64encode(data).decode()},
+    }]}
+
+
+def test_commit_spills_the_running_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "artifact_store", ArtifactStore(root=str(tmp_path / "artifacts")))
+    store = SessionStore(spill_dir=str(tmp_path / "sessions"), memory_bytes=10_000)
+
+    async def run():
+        session = store.get_or_create("single")
+        messages = []
+        for _ in range(5):
+            # A run holds the session lock until after it commits
+            async with session.lock:
+                messages = store.history(session) + _turns(4, 15_000)
+                store.commit(session, messages)
+        return session, messages
+
+    session, messages = asyncio.run(run())
+    assert session.spilled_count > 0
+    assert len(session.messages) == HOT_MESSAGES
+    assert store.history(session) == messages
+
+
+def test_spilled_images_survive_pruning(tmp_path, monkeypatch):
+    artifact_store = ArtifactStore(root=str(tmp_path / "artifacts"), max_bytes=1)
+    monkeypatch.setattr(artifacts, "artifact_store", artifact_store)
+    store = SessionStore(spill_dir=str(tmp_path / "sessions"), memory_bytes=1)
+    session = store.get_or_create("images")
+
+    messages = [_screenshot(seed) for seed in range(HOT_MESSAGES + 2)]
+    store.commit(session, messages)
+    assert session.spilled_count == 2
+
+    artifact_store.prune()
+    assert store.history(session) == messages
+
+    store.delete("images")
+    artifact_store.prune()
+    assert not any(path.is_file() for path in (tmp_path / "artifacts").rglob("*"))
+
+
+def test_budget_skips_a_session_being_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "artifact_store", ArtifactStore(root=str(tmp_path / "artifacts")))
+    store = SessionStore(spill_dir=str(tmp_path / "sessions"), memory_bytes=10 ** 9)
+    idle = store.get_or_create("idle")
+    idle_messages = _turns(HOT_MESSAGES + 5, 2_000)
+    store.commit(idle, idle_messages)
+    store.memory_bytes = 10_000
+
+    other = store.get_or_create("other")
+    # history() of the idle session is in progress in another thread
+    with idle.io_lock:
+        store.commit(other, _turns(2, 10))
+    assert idle.spilled_count == 0
+
+    store.commit(other, _turns(2, 10))
+    assert idle.spilled_count == 5
+    assert store.history(idle) == idle_messages